@@ -2,11 +2,12 @@
 import os
 import asyncio
 import logging
-import asyncpg
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 
 from services import db as dbsvc
+from services import llm as llmsvc
+from services import admin_settings, db_pool, llm_batch, llm_context, llm_log, pg_json, pg_listen, scenario_catalog, singleflight
 from middlewares.rate_limit import RateLimitMiddleware, CallbackRateLimitMiddleware
 from filters.free_text_guard import FreeTextGuard
 from middlewares.input_guard import InputSanitizerMiddleware
@@ -17,8 +18,20 @@ async def main() -> None:
     token = os.environ["BOT_TOKEN"]
     db_url = os.environ.get("DATABASE_URL", "postgresql://app:app@db:5432/appdb")
 
-    pool = await asyncpg.create_pool(db_url, min_size=1, max_size=5)
+    # размер/таймауты пула — из env (DB_POOL_*), метрики acquire и запросов — services/db_pool.py;
+    # json/jsonb ↔ dict/list на каждом соединении — без json.dumps/json.loads в запросах
+    pool = await db_pool.create_pool(db_url, init=pg_json.init_connection)
     dbsvc.set_pool(pool)
+    llmsvc.init_http_client()
+    llm_log.sink.start()
+    await admin_settings.refresh()  # снимок настроек; дальше — по NOTIFY (pg_listen) и TTL
+    catalog = await scenario_catalog.refresh()  # каталог сценариев — так же
+    # словари tiktoken для бюджета контекста — до первого запроса (чтение с диска/сети — в потоке)
+    await asyncio.to_thread(
+        llm_context.preload, llmsvc.OPENAI_MODEL, *(sc.model for sc in catalog.scenarios.values())
+    )
+    pg_listen.start()
+    llm_batch.start()  # периодические прогнозы через Batch API (если включены в админке)
 
     bot = Bot(token=token, default=DefaultBotProperties(parse_mode="HTML"))
     dp = Dispatcher()
@@ -42,6 +55,11 @@ async def main() -> None:
     try:
         await dp.start_polling(bot)
     finally:
+        await llm_batch.stop()
+        await pg_listen.stop()
+        await llm_log.sink.stop()  # дописать буфер llm_messages до закрытия пула
+        await llmsvc.close_http_client()
+        await singleflight.close()
         await pool.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+# bench/load_llm.py
+"""
+Сквозной нагрузочный прогон LLM-пути бота против мок-сервера (bench/mock_openai.py).
+
+    cd bot && python -m bench.mock_openai --port 8089 --latency lognormal:800:0.4 &
+    cd bot && python -m bench.load_llm --sessions 200 --concurrency 50 \
+        --base-url http://127.0.0.1:8089/v1
+
+Каждая «сессия» проходит сценарии как пользователь после /start: strengths+weaknesses
+(онбординг), затем разделы меню. --combined: разделы из LLM_COMBINED_SCENARIOS — одним
+запросом при открытии первого из них (как menu_* в handlers.py). Через тот же код, что и бот: services.llm.run_scenario —
+планировщик, ретраи, ремонт JSON, валидация, стриминг для текстовых разделов.
+Postgres не нужен: сценарии/контекст/настройки подставляются фикстурами (как в
+db/migrations/003_admin_scenarios.sql), лог llm_messages и кэш LLM отключены.
+
+Итог: p50/p95/p99 по сценариям, пропускная способность, ошибки и метрики процесса.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+ONBOARDING = ("strengths", "weaknesses")
+MENU = ("mission", "love", "finance", "karma", "countries", "business")
+TEXT_CODES = ("mission", "love", "finance", "karma")  # стримятся при --stream
+
+_LIST = '{"type":"object","required":["items"],"properties":{"items":{"type":"array","items":{"type":"string"},"minItems":%d,"maxItems":%d}}}'
+_TEXT = '{"type":"object","required":["%s"],"properties":{"%s":{"type":"string"}}}'
+
+# scenario -> (prompt_template, schema_json) — как сиды 003_admin_scenarios.sql
+SCENARIOS = {
+    "mission": ('Верни JSON: {"mission":"string"}. Учитывай FACTS и ASTRO_JSON. Кратко, 2–4 предложения.',
+                _TEXT % ("mission", "mission")),
+    "strengths": ('Верни JSON: {"items":["string",...]} c ровно 10 пунктами. Краткие формулировки.',
+                  _LIST % (10, 10)),
+    "weaknesses": ('Верни JSON: {"items":["string",...]} c ровно 10 пунктами. Корректные формулировки.',
+                   _LIST % (10, 10)),
+    "countries": ('Верни JSON: {"items":["Страна — краткое обоснование",...]} c ровно 5 пунктами.',
+                  _LIST % (5, 5)),
+    "business": ('Верни JSON: {"items":["Бизнес — почему подходит",...]} c ровно 10 пунктами.',
+                 _LIST % (10, 10)),
+    "love": ('Верни JSON: {"love":"string"}. Учитывай пол/имя/контекст.',
+             _TEXT % ("love", "love")),
+    "finance": ('Сжатый разбор финансового потенциала. Формат ответа строго JSON: { "text": "..." }.',
+                _TEXT % ("text", "text")),
+    "karma": ('Кармический разбор. Формат ответа строго JSON: { "text": "..." }.',
+              _TEXT % ("text", "text")),
+}
+
+ASTRO = {
+    "planets": {p: {"sign": random.choice(("Aries", "Leo", "Virgo", "Pisces")), "deg": round(random.random() * 30, 2)}
+                for p in ("Sun", "Moon", "Mercury", "Venus", "Mars", "Jupiter", "Saturn")},
+    "houses": {str(i): round(random.random() * 360, 1) for i in range(1, 13)},
+}
+
+
+def _install_fixtures(llm, llm_cache) -> None:
+    """Подменяет обращения к БД в services.llm на фикстуры в памяти."""
+
+    async def _get_scenario(scenario):
+        prompt, schema = SCENARIOS[scenario]
+        return prompt, llm.llm_schema.coerce_schema(schema), None, llm.DEFAULT_PARAMS
+
+    async def _build_context(session_id, spec=None):
+        return {"astro_json": ASTRO, "facts": {"extra": {}}, "summary": ""}
+
+    async def _strict():
+        return True
+
+    async def _system_prompt():
+        return ""
+
+    async def _log(*args, **kwargs):
+        return None
+
+    llm._get_scenario = _get_scenario
+    llm._build_context = _build_context
+    llm._admin_flag_strict = _strict
+    llm._admin_system_prompt = _system_prompt
+    llm._log_llm = _log
+    llm_cache.LLM_CACHE_ENABLED = False
+
+
+async def _noop_partial(_text: str) -> None:
+    """on_partial для --stream: тексты стримятся, но в Telegram не отправляются."""
+    return None
+
+
+async def _session(llm, sid: int, results: dict, errors: dict, stream: bool, combined: bool) -> None:
+    from services.llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_ONBOARDING
+
+    done: set[str] = set()
+
+    async def _one(code: str, priority: int) -> None:
+        on_partial = _noop_partial if stream and code in TEXT_CODES else None
+        t0 = time.perf_counter()
+        try:
+            if code in done:
+                data = {"cached": True}  # уже сгенерирован вместе с другим разделом — отдали бы из БД
+            elif combined and code in llm.LLM_COMBINED_SCENARIOS:
+                codes = [code, *(c for c in llm.LLM_COMBINED_SCENARIOS if c != code and c not in done)]
+                parts = await llm.run_scenarios(sid, codes, on_partial=on_partial, tg_id=sid, priority=priority)
+                done.update(c for c, v in parts.items() if v)
+                data = parts.get(code)
+            else:
+                data = await llm.run_scenario(sid, code, on_partial=on_partial, tg_id=sid, priority=priority)
+            status = "ok" if data else "empty"
+        except Exception as e:
+            status = type(e).__name__
+        results.setdefault(code, []).append((time.perf_counter() - t0) * 1000)
+        if status != "ok":
+            errors[(code, status)] = errors.get((code, status), 0) + 1
+
+    await asyncio.gather(*(_one(c, PRIORITY_ONBOARDING) for c in ONBOARDING))
+    for code in random.sample(MENU, k=len(MENU)):
+        await _one(code, PRIORITY_INTERACTIVE)
+
+
+def _pct(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run(args: argparse.Namespace) -> None:
+    from services import llm, llm_cache, metrics
+
+    _install_fixtures(llm, llm_cache)
+    llm.init_http_client()
+    results: dict[str, list[float]] = {}
+    errors: dict[tuple[str, str], int] = {}
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def _guarded(sid: int) -> None:
+        async with sem:
+            await _session(llm, sid, results, errors, args.stream, args.combined)
+
+    t0 = time.perf_counter()
+    try:
+        await asyncio.gather(*(_guarded(100000 + i) for i in range(args.sessions)))
+    finally:
+        await llm.close_http_client()
+    elapsed = time.perf_counter() - t0
+
+    total = sum(len(v) for v in results.values())
+    print(f"сессий: {args.sessions}  параллельно: {args.concurrency}  вызовов: {total}  "
+          f"время: {elapsed:.1f} с  пропускная: {total / elapsed:.1f} выз/с")
+    print(f"{'scenario':<12}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (мс)")
+    for code in (*ONBOARDING, *MENU):
+        v = results.get(code, [])
+        print(f"{code:<12}{len(v):>6}{_pct(v, .5):>9.0f}{_pct(v, .95):>9.0f}"
+              f"{_pct(v, .99):>9.0f}{max(v, default=0):>9.0f}")
+    if errors:
+        print("ошибки:")
+        for (code, status), n in sorted(errors.items()):
+            print(f"  {code} {status}: {n}")
+    if args.metrics:
+        print()
+        print(metrics.render())
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="LLM load test against an OpenAI-compatible endpoint")
+    ap.add_argument("--sessions", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--base-url", default="http://127.0.0.1:8089/v1")
+    ap.add_argument("--stream", action="store_true", help="текстовые разделы — стримом (on_partial)")
+    ap.add_argument("--combined", action="store_true", help="разделы LLM_COMBINED_SCENARIOS — одним запросом")
+    ap.add_argument("--no-metrics", dest="metrics", action="store_false")
+    args = ap.parse_args()
+
+    # до импорта services.llm: константы читаются при импорте
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ.setdefault("LLM_PREFETCH_ENABLED", "0")
+    if "services.llm" in sys.modules:
+        raise SystemExit("services.llm уже импортирован — запускайте как python -m bench.load_llm")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
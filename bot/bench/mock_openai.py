@@ -0,0 +1,305 @@
+# bench/mock_openai.py
+"""
+Локальный OpenAI-совместимый мок для нагрузочных тестов (без реальных токенов).
+
+    cd bot && python -m bench.mock_openai --port 8089 \
+        --latency lognormal:900:0.5 --error-rate 0.02 --invalid-rate 0.05 \
+        --burst-429 60:5 --rpm 3000
+
+POST /v1/chat/completions — обычный и stream=true (SSE) ответ с usage и заголовками x-ratelimit-*.
+Batch API (для services/llm_batch.py): POST /v1/files, POST /v1/batches, GET /v1/batches/{id},
+GET /v1/files/{id}/content — пачка «выполняется» --batch-delay секунд, ошибки/невалидные — по тем же долям.
+
+Задержка (--latency):  fixed:MS | uniform:LO:HI | normal:MEAN:STD | lognormal:MEDIAN:SIGMA
+Ошибки:
+  --error-rate    доля ответов 500/502/503
+  --hang-rate     доля запросов, которые «висят» --hang-sec (проверка таймаутов клиента)
+  --invalid-rate  доля ответов, не проходящих схему (обрезанный JSON или не тот формат)
+  --fixable-share из них — доля «тривиально сломанных» (```-блок, обёртка, склеенные пункты)
+  --burst-429     PERIOD:LEN — каждые PERIOD секунд LEN секунд подряд отвечаем 429
+  --rpm           лимит запросов в минуту (скользящее окно), сверх — 429 с retry-after
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from collections import deque
+
+from aiohttp import web
+
+LIST_SIZES = {"strengths": 10, "weaknesses": 10, "business": 10, "countries": 5}
+_SCENARIO_RE = re.compile(r"SCENARIO=([a-z0-9_+]+)")
+
+
+def parse_latency(spec: str):
+    kind, *args = spec.split(":")
+    vals = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: vals[0]
+    if kind == "uniform":
+        return lambda: random.uniform(vals[0], vals[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(vals[0], vals[1]))
+    if kind == "lognormal":
+        import math
+        mu = math.log(vals[0])
+        return lambda: random.lognormvariate(mu, vals[1])
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+def _scenario(body: dict) -> str:
+    for m in reversed(body.get("messages") or []):
+        found = _SCENARIO_RE.search(m.get("content") or "")
+        if found:
+            return found.group(1)
+    return "text"
+
+
+def _content(scenario: str, invalid: bool, fixable: bool = False) -> str:
+    if "+" in scenario:
+        # комбинированный запрос (llm.run_scenarios): {scenario: ответ}; invalid портит одну часть
+        codes = scenario.split("+")
+        bad = random.choice(codes) if invalid else None
+        parts = {c: json.loads(_content(c, False)) if c != bad else {} for c in codes}
+        return json.dumps(parts, ensure_ascii=False)
+    if scenario in LIST_SIZES:
+        n = LIST_SIZES[scenario]
+        items = [f"{scenario} #{i + 1}: пример пункта из мок-сервера" for i in range(n)]
+        if invalid and fixable:
+            # чинится локально (llm_repair): обёртка вместо items, последние пункты склеены
+            return json.dumps({scenario: items[:-2] + ["\n".join(items[-2:])]}, ensure_ascii=False)
+        if invalid:
+            items = items[: max(1, n // 2)]  # не тот minItems -> ValidationError
+        return json.dumps({"items": items}, ensure_ascii=False)
+    text = f"Мок-текст для раздела {scenario}. " * 12
+    if invalid and fixable:
+        # чинится локально: ```-блок с пояснением и ключ раздела вместо text
+        return "Вот ответ:\n```json\n" + json.dumps({scenario: text}, ensure_ascii=False) + "\n```"
+    if invalid:
+        return '{"' + scenario + '": "' + text[:40]  # обрезанный JSON
+    return json.dumps({scenario: text, "text": text}, ensure_ascii=False)
+
+
+class MockState:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.latency = parse_latency(args.latency)
+        self.started = time.monotonic()
+        self.window: deque[float] = deque()
+        self.requests = 0
+        self.by_status: dict[int, int] = {}
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.ids = itertools.count(1)
+
+    def in_burst(self) -> bool:
+        if not self.args.burst_429:
+            return False
+        period, length = (float(x) for x in self.args.burst_429.split(":"))
+        return (time.monotonic() - self.started) % period < length
+
+    def rpm_exceeded(self) -> bool:
+        if not self.args.rpm:
+            return False
+        now = time.monotonic()
+        while self.window and now - self.window[0] > 60:
+            self.window.popleft()
+        if len(self.window) >= self.args.rpm:
+            return True
+        self.window.append(now)
+        return False
+
+    def headers(self) -> dict:
+        limit = self.args.rpm or 10000
+        return {
+            "x-ratelimit-limit-requests": str(limit),
+            "x-ratelimit-remaining-requests": str(max(0, limit - len(self.window))),
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-limit-tokens": str(self.args.tpm),
+            "x-ratelimit-remaining-tokens": str(self.args.tpm),
+        }
+
+
+def _usage(body: dict, content: str) -> dict:
+    prompt = sum(len(m.get("content") or "") for m in body.get("messages") or []) // 3
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": len(content) // 3,
+        "total_tokens": prompt + len(content) // 3,
+        "prompt_tokens_details": {"cached_tokens": (prompt // 1024) * 1024 // 2},
+    }
+
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    st: MockState = request.app["state"]
+    args = st.args
+    body = await request.json()
+    st.requests += 1
+
+    def _status(code: int, **kw) -> web.Response:
+        st.by_status[code] = st.by_status.get(code, 0) + 1
+        return web.json_response({"error": {"message": f"mock {code}"}}, status=code, **kw)
+
+    if st.in_burst() or st.rpm_exceeded():
+        return _status(429, headers={**st.headers(), "retry-after": str(args.retry_after)})
+
+    if random.random() < args.hang_rate:
+        await asyncio.sleep(args.hang_sec)
+
+    await asyncio.sleep(st.latency() / 1000.0)
+    if random.random() < args.error_rate:
+        return _status(random.choice((500, 502, 503)))
+
+    content = _content(_scenario(body), random.random() < args.invalid_rate,
+                       random.random() < args.fixable_share)
+    usage = _usage(body, content)
+    model = body.get("model", "mock")
+    st.by_status[200] = st.by_status.get(200, 0) + 1
+
+    if not body.get("stream"):
+        return web.json_response(_completion(body, content, f"mock-{st.requests}"), headers=st.headers())
+
+    resp = web.StreamResponse(headers={**st.headers(), "Content-Type": "text/event-stream"})
+    await resp.prepare(request)
+    step = max(1, len(content) // args.stream_chunks)
+    for i in range(0, len(content), step):
+        chunk = {"object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {"content": content[i:i + step]}}]}
+        await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await asyncio.sleep(args.stream_gap_ms / 1000.0)
+    final = {"object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage}
+    await resp.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+    await resp.write_eof()
+    return resp
+
+
+def _completion(body: dict, content: str, rid: str) -> dict:
+    return {
+        "id": rid,
+        "object": "chat.completion",
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": _usage(body, content),
+    }
+
+
+async def upload_file(request: web.Request) -> web.Response:
+    st: MockState = request.app["state"]
+    form = await request.post()
+    upload = form["file"]
+    file_id = f"file-{next(st.ids)}"
+    st.files[file_id] = upload.file.read()
+    return web.json_response({"id": file_id, "object": "file", "bytes": len(st.files[file_id]),
+                              "purpose": form.get("purpose", "batch")})
+
+
+async def file_content(request: web.Request) -> web.Response:
+    st: MockState = request.app["state"]
+    data = st.files.get(request.match_info["file_id"])
+    if data is None:
+        return web.json_response({"error": {"message": "file not found"}}, status=404)
+    return web.Response(body=data, content_type="application/jsonl")
+
+
+async def _run_batch(st: MockState, batch: dict) -> None:
+    await asyncio.sleep(st.args.batch_delay)
+    out = []
+    lines = st.files[batch["input_file_id"]].decode("utf-8").splitlines()
+    failed = 0
+    for n, line in enumerate(lines):
+        if not line.strip():
+            continue
+        req = json.loads(line)
+        rid = f"batch_req_{n}"
+        if random.random() < st.args.error_rate:
+            failed += 1
+            resp = {"status_code": 500, "request_id": rid, "body": {"error": {"message": "mock 500"}}}
+        else:
+            content = _content(_scenario(req["body"]), random.random() < st.args.invalid_rate,
+                               random.random() < st.args.fixable_share)
+            resp = {"status_code": 200, "request_id": rid, "body": _completion(req["body"], content, rid)}
+        out.append(json.dumps({"id": rid, "custom_id": req["custom_id"], "response": resp, "error": None},
+                              ensure_ascii=False))
+    file_id = f"file-{next(st.ids)}"
+    st.files[file_id] = ("\n".join(out) + "\n").encode("utf-8")
+    batch.update(status="completed", output_file_id=file_id, completed_at=int(time.time()),
+                 request_counts={"total": len(out), "completed": len(out) - failed, "failed": failed})
+
+
+async def create_batch(request: web.Request) -> web.Response:
+    st: MockState = request.app["state"]
+    body = await request.json()
+    if body.get("input_file_id") not in st.files:
+        return web.json_response({"error": {"message": "input file not found"}}, status=400)
+    batch = {
+        "id": f"batch_{next(st.ids)}",
+        "object": "batch",
+        "endpoint": body.get("endpoint"),
+        "input_file_id": body["input_file_id"],
+        "completion_window": body.get("completion_window", "24h"),
+        "status": "in_progress",
+        "output_file_id": None,
+        "created_at": int(time.time()),
+        "metadata": body.get("metadata") or {},
+    }
+    st.batches[batch["id"]] = batch
+    asyncio.create_task(_run_batch(st, batch))
+    return web.json_response(batch)
+
+
+async def get_batch(request: web.Request) -> web.Response:
+    st: MockState = request.app["state"]
+    batch = st.batches.get(request.match_info["batch_id"])
+    if batch is None:
+        return web.json_response({"error": {"message": "batch not found"}}, status=404)
+    return web.json_response(batch)
+
+
+async def stats(request: web.Request) -> web.Response:
+    st: MockState = request.app["state"]
+    return web.json_response({"requests": st.requests, "by_status": st.by_status, "batches": len(st.batches)})
+
+
+def make_app(args: argparse.Namespace) -> web.Application:
+    app = web.Application(client_max_size=200 * 1024 * 1024)  # файлы Batch API — до 200 МБ, как у провайдера
+    app["state"] = MockState(args)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/files", upload_file)
+    app.router.add_get("/v1/files/{file_id}/content", file_content)
+    app.router.add_post("/v1/batches", create_batch)
+    app.router.add_get("/v1/batches/{batch_id}", get_batch)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="OpenAI-compatible mock server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="lognormal:800:0.4")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--hang-rate", type=float, default=0.0)
+    ap.add_argument("--hang-sec", type=float, default=120.0)
+    ap.add_argument("--invalid-rate", type=float, default=0.0)
+    ap.add_argument("--fixable-share", type=float, default=0.0,
+                    help="доля невалидных ответов, которые чинятся локально (services/llm_repair.py)")
+    ap.add_argument("--burst-429", default="", help="PERIOD:LEN, секунды")
+    ap.add_argument("--rpm", type=int, default=0)
+    ap.add_argument("--tpm", type=int, default=2_000_000)
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--stream-chunks", type=int, default=20)
+    ap.add_argument("--stream-gap-ms", type=float, default=20.0)
+    ap.add_argument("--batch-delay", type=float, default=5.0, help="сколько секунд «выполняется» пачка")
+    return ap
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    web.run_app(make_app(args), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# bench/schema_validation.py
+"""
+Микро-бенчмарк валидации ответа LLM по схеме сценария.
+
+    cd bot && python -m bench.schema_validation [-n 20000]
+
+Сравнивает прежний путь (json.loads схемы + jsonschema.validate на каждый вызов)
+с кэшированным (services.llm_schema: разобранная схема + скомпилированный валидатор).
+"""
+import json
+import time
+import argparse
+
+from jsonschema import validate as js_validate
+
+from services import llm_schema
+
+# схема и ответ как у сценария strengths (см. db/migrations/003_admin_scenarios.sql)
+SCHEMA_TEXT = json.dumps({
+    "type": "object",
+    "required": ["items"],
+    "properties": {
+        "items": {"type": "array", "items": {"type": "string"}, "minItems": 10, "maxItems": 10},
+    },
+})
+DATA = {"items": [f"Сильная сторона №{i}: умение доводить дела до конца" for i in range(10)]}
+
+
+def _old(n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        schema = json.loads(SCHEMA_TEXT)
+        js_validate(DATA, schema)
+    return time.perf_counter() - t0
+
+
+def _new(n: int) -> float:
+    schema = llm_schema.coerce_schema(SCHEMA_TEXT)  # разбор — один раз (кодек пула + каталог сценариев)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        llm_schema.validator_for("strengths", schema).validate(DATA)
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=20000)
+    args = ap.parse_args()
+
+    _old(200), _new(200)  # прогрев
+    old, new = _old(args.n), _new(args.n)
+    per_old, per_new = old / args.n * 1e6, new / args.n * 1e6
+    print(f"validate() каждый раз : {per_old:8.1f} мкс/вызов")
+    print(f"кэш валидатора        : {per_new:8.1f} мкс/вызов")
+    print(f"экономия              : {per_old - per_new:8.1f} мкс/вызов (x{per_old / per_new:.1f})")
+
+
+if __name__ == "__main__":
+    main()
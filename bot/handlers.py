@@ -1,13 +1,15 @@
 import re
+import html
+import time
 import asyncio
 from datetime import date, time as dtime
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, MessageEntity
+from aiogram.types import Message, CallbackQuery, MessageEntity, ErrorEvent
 from aiogram.enums import ChatAction, ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandStart, ExceptionTypeFilter
 from aiogram.filters.command import CommandObject
 from aiogram.utils.formatting import CustomEmoji
 import json, logging, os
@@ -18,14 +20,23 @@ from services import db as dbsvc
 from services import geocode as geosvc
 from services import astro as astrosvc
 from services import llm as llmsvc
+from services import admin_settings, llm_log, metrics, prefetch, scenario_catalog, singleflight
+from services.llm_scheduler import (
+    scheduler as llm_scheduler, PRIORITY_ONBOARDING, PRIORITY_INTERACTIVE, PRIORITY_REGEN, PRIORITY_PREFETCH,
+)
+from services.llm_breaker import LLMUnavailable, breaker as llm_breaker
 from services.db import _require_pool
 from scenarios import SCN  # ← оставляем пакетный импорт
 
 
 router = Router()
 
+BOT_OWNER_ID = int(os.getenv("BOT_OWNER_ID", "0") or 0)
+
 SCN_PREFIX = "scn:"  # префикс для callback_data сценариев
 
+LLM_UNAVAILABLE_TEXT = "⏳ Генерация сейчас перегружена. Попробуй ещё раз через минуту."
+
 
 # helpers
 
@@ -91,17 +102,6 @@ def _as_bool(v) -> bool:
         return v.strip().lower() in ("1", "true", "t", "yes", "on")
     return False
 
-def _as_json_obj(v) -> dict:
-    if isinstance(v, dict):
-        return v
-    if isinstance(v, str):
-        try:
-            return json.loads(v)
-        except Exception:
-            return {}
-    return {}
-
-
 async def _locks_for_menu_from_message(m: Message) -> dict:
     """Получить замочки, имея только Message (после спиннера)."""
     class _Dummy:
@@ -210,27 +210,13 @@ async def _need_channel_gate(cb: CallbackQuery, scenario: str) -> tuple[bool, st
     Сценарий под замком, если bonus_sections[scenario] == 'channel'
     и включён enable_channel_gate.
     """
-    enable_gate_raw = await dbsvc.get_admin_value("enable_channel_gate")
-    enable_gate = _as_bool(enable_gate_raw)
-    if not enable_gate:
+    cfg = await admin_settings.get()  # снимок в памяти, без запросов к БД
+    if not cfg.enable_channel_gate or cfg.bonus_sections.get(scenario) != "channel":
         return (False, None)
 
-    bonus_raw = await dbsvc.get_admin_value("bonus_sections")
-    bonus = _as_json_obj(bonus_raw)
-    if bonus.get(scenario) != "channel":
-        return (False, None)
-
-    # читаем id/handle и явный URL из админки
-    channel_id = await dbsvc.get_admin_value("telegram_channel_id") or ""
-    url_override = await dbsvc.get_admin_value("telegram_channel_url") or ""
-
-    # приведение типов + трим пробелов/кавычек, на всякий
-    if not isinstance(channel_id, str):
-        channel_id = str(channel_id)
-    if not isinstance(url_override, str):
-        url_override = str(url_override)
-    channel_id = channel_id.strip().strip('"').strip("'")
-    url_override = url_override.strip().strip('"').strip("'")
+    # id/handle и явный URL из админки; трим пробелов/кавычек, на всякий
+    channel_id = cfg.telegram_channel_id.strip().strip('"').strip("'")
+    url_override = cfg.telegram_channel_url.strip().strip('"').strip("'")
 
     # уже подписан?
     if channel_id and await _user_is_channel_member(cb, channel_id):
@@ -264,18 +250,11 @@ async def _need_referral_gate(cb: CallbackQuery, scenario: str) -> tuple[bool, i
       - admin_settings.referral_bonus_threshold (int)
       - admin_settings.bonus_sections -> {"year": "referral", ...}
     """
-    enabled = _as_bool(await _get_admin_value("enable_referrals"))
-    if not enabled:
+    cfg = await admin_settings.get()
+    if not cfg.enable_referrals or cfg.bonus_sections.get(scenario) != "referral":
         return (False, 0, 0)
 
-    bonus = _as_json_obj(await _get_admin_value("bonus_sections"))
-    if bonus.get(scenario) != "referral":
-        return (False, 0, 0)
-
-    try:
-        threshold = int(await _get_admin_value("referral_bonus_threshold") or 3)
-    except Exception:
-        threshold = 3
+    threshold = cfg.referral_bonus_threshold or 3
 
     # user_id в БД
     pool = _require_pool()
@@ -290,7 +269,7 @@ async def _need_referral_gate(cb: CallbackQuery, scenario: str) -> tuple[bool, i
 async def _locks_for_menu(cb: CallbackQuery) -> dict:
     """Собирает замочки по bonus_sections из админки."""
     locked = {}
-    bonus = _as_json_obj(await _get_admin_value("bonus_sections")) or {}
+    bonus = (await admin_settings.get()).bonus_sections
 
     for scen, mode in bonus.items():
         mode = (mode or "").strip().lower()
@@ -488,6 +467,56 @@ async def back_to_time_known(cb: CallbackQuery, state: FSMContext):
     await safe_edit(cb, "Вы знаете точное время рождения?", reply_markup=time_known_kb())
 
 
+FIRST_SCREEN_REQUIRED = ("strengths", "weaknesses")
+FIRST_SCREEN_MAX = 6  # потолок параллельных генераций на онбординге
+
+
+async def _first_screen_codes() -> list[str]:
+    """strengths/weaknesses + доп. сценарии первого экрана из admin_settings.first_screen_scenarios."""
+    raw = await _get_admin_value("first_screen_scenarios")
+    codes = list(FIRST_SCREEN_REQUIRED)
+    for c in raw if isinstance(raw, list) else []:
+        c = str(c or "").strip().lower()
+        if c and c not in codes:
+            codes.append(c)
+    return codes[:FIRST_SCREEN_MAX]
+
+
+async def _first_screen_generate(session_id: int, astro_json: dict, tg_id: int) -> dict[str, dict]:
+    """
+    Генерирует сценарии первого экрана конкурентно.
+    Ошибка одного сценария не роняет остальные: упавший сценарий (лог) в results не попадает и не
+    сохраняется — его догенерирует хендлер меню. Отмена хендлера отменяет все генерации.
+    Если упали оба обязательных — пробрасываем ошибку.
+    """
+    codes = await _first_screen_codes()
+
+    async def _one(code: str) -> dict:
+        if code in FIRST_SCREEN_REQUIRED:
+            return await llmsvc.generate_list_or_mock(
+                scenario=code, n=10, astro_json=astro_json, session_summary=None, session_id=session_id,
+                tg_id=tg_id, priority=PRIORITY_ONBOARDING,
+            )
+        return await llmsvc.run_scenario(
+            session_id, code, tg_id=tg_id, priority=PRIORITY_ONBOARDING
+        ) or {}
+
+    raw = await asyncio.gather(*(_one(c) for c in codes), return_exceptions=True)
+
+    results: dict[str, dict] = {}
+    errors: list[BaseException] = []
+    for code, res in zip(codes, raw):
+        if isinstance(res, BaseException):
+            logging.warning("first-screen scenario %s failed: %r", code, res)
+            if code in FIRST_SCREEN_REQUIRED:
+                errors.append(res)
+            continue
+        results[code] = res if isinstance(res, dict) else {}
+    if len(errors) == len(FIRST_SCREEN_REQUIRED):
+        raise errors[0]
+    return results
+
+
 @router.message(Flow.CITY)
 async def set_city(m: Message, state: FSMContext):
     city = (m.text or "").strip()
@@ -527,37 +556,36 @@ async def set_city(m: Message, state: FSMContext):
         await dbsvc.save_raw_calc(data["session_id"], astro_json)
         await dbsvc.set_unknown_time(data["session_id"], bt is None)
 
-        # Первичная генерация: 10 сильных / 10 слабых
+        # Первичная генерация: 10 сильных / 10 слабых (+ доп. сценарии из админки) — параллельно
         session_id = data["session_id"]
-        strengths = await llmsvc.generate_list_or_mock(
-            scenario="strengths", n=10, astro_json=astro_json, session_summary=None, session_id=session_id
-        )
-        weaknesses = await llmsvc.generate_list_or_mock(
-            scenario="weaknesses", n=10, astro_json=astro_json, session_summary=None, session_id=session_id
-        )
-        await dbsvc.upsert_session_facts(session_id, strengths=strengths, weaknesses=weaknesses)
-
-        # Версии фактов — делаем текущие активными
-        await dbsvc.add_fact_version(session_id, "strengths", strengths, make_active=True)
-        await dbsvc.add_fact_version(session_id, "weaknesses", weaknesses, make_active=True)
-
-        # Короткая сводка по сессии (для LLM-контекста)
-        name = data.get("user_name") or "пользователь"
-        gender = data.get("gender") or "-"
-        sys_title = {"western": "Западная", "vedic": "Ведическая", "bazi": "БаЦзы"}.get(data["system"], data["system"])
-        city_str = f"lat={lat}, lon={lon}, tz={tz}"
-        summary = (
-                f"Имя: {name}; пол: {gender}; система: {sys_title}; дата: {bd}"
-                + (f", время: {bt}" if bt else ", время: неизвестно")
-                + f"; место: {city_str}. "
-                  f"Сильные: {', '.join(strengths.get('items', [])[:3])}. "
-                  f"Слабые: {', '.join(weaknesses.get('items', [])[:3])}."
+        results = await _first_screen_generate(session_id, astro_json, m.from_user.id)
+        # упавший обязательный сценарий (второй удался) не сохраняем — его догенерирует меню
+        strengths = results.pop("strengths", None)
+        weaknesses = results.pop("weaknesses", None)
+
+        # Сохраняем всё одним проходом, когда все результаты на руках
+        columns = {}
+        extra: dict = {}
+        versions = []
+        for code, res in (("strengths", strengths), ("weaknesses", weaknesses)):
+            if res is not None:
+                columns[code] = res
+                versions.append((code, res))
+        for code, res in results.items():
+            cols, ext, version = _facts_patch_for(code, res)
+            columns.update(cols)
+            extra.update(ext)
+            if version is not None:
+                versions.append((code, version))
+        # Версии (активные), факты и сводка по сессии — одной транзакцией
+        await dbsvc.save_scenario_results(
+            session_id, dict(versions), op="onboarding", extra=extra or None, **columns
         )
-        await dbsvc.upsert_session_summary(session_id, summary)
+        versions_codes = [code for code, _ in versions]
 
         # Текст первого экрана: 10/10 + главное меню
-        s_items = strengths.get("items", [])
-        w_items = weaknesses.get("items", [])
+        s_items = (strengths or {}).get("items", [])
+        w_items = (weaknesses or {}).get("items", [])
         first_text = (
             "🔮 <b>Твоя карта готова. Вот первый разбор:</b>\n\n"
             "<b>10 сильных сторон</b>\n"
@@ -579,6 +607,20 @@ async def set_city(m: Message, state: FSMContext):
 
         await msg.edit_text(first_text, reply_markup=markup)
 
+        # пока пользователь читает 10/10 — в фоне готовим самые популярные разделы меню
+        if llmsvc.OPENAI_API_KEY:
+            tg_id = m.from_user.id
+            prefetch.schedule(
+                session_id,
+                skip=[*versions_codes, *results.keys()],
+                worker=lambda codes: _gen_and_store_many(
+                    session_id, codes, tg_id=tg_id, priority=PRIORITY_PREFETCH, source=prefetch.SOURCE_PREFETCH
+                ),
+            )
+
+    except LLMUnavailable:
+        await msg.edit_text(f"{LLM_UNAVAILABLE_TEXT}\nНапиши город ещё раз.")
+        await state.set_state(Flow.CITY)
     except Exception as e:
         logging.exception("calc/generate failed: %s", e)
         await msg.edit_text("😕 Что-то пошло не так при расчёте карты. Попробуй ещё раз или укажи другой город.")
@@ -645,6 +687,33 @@ async def safe_edit(cb: CallbackQuery, text: str, reply_markup=None):
     else:
         await cb.answer()
 
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL_SEC", "1.5"))  # лимит Telegram ~1 правка/сек
+STREAM_PREVIEW_LIMIT = 3800  # сообщение — не длиннее 4096 символов
+
+
+def _stream_editor(cb: CallbackQuery, header: str):
+    """
+    on_partial-колбэк для стриминга LLM: правит сообщение частичным текстом
+    не чаще STREAM_EDIT_INTERVAL, уважает RetryAfter. Финальный текст рисует хендлер.
+    """
+    last = {"at": 0.0, "len": 0}
+
+    async def _on_partial(text: str) -> None:
+        now = time.monotonic()
+        if now < last["at"] + STREAM_EDIT_INTERVAL or len(text) <= last["len"]:
+            return
+        last["at"], last["len"] = now, len(text)
+        body = html.escape(text[:STREAM_PREVIEW_LIMIT], quote=False)
+        try:
+            await cb.message.edit_text(f"{header}\n\n{body} ▌")
+        except TelegramRetryAfter as e:
+            last["at"] = now + e.retry_after
+        except TelegramBadRequest:
+            pass
+
+    return _on_partial
+
+
 async def _safe_delete_message(bot, chat_id: int, message_id: int | None):
     if not message_id:
         return
@@ -656,19 +725,15 @@ async def _safe_delete_message(bot, chat_id: int, message_id: int | None):
 
 async def _show_year(tg_id: int) -> bool:
     """Годовой отчёт открыт? Зависит от админки и числа приглашённых."""
-    enabled = _as_bool(await _get_admin_value("enable_referrals"))
-    if not enabled:
+    cfg = await admin_settings.get()
+    if not cfg.enable_referrals:
         return False
 
-    bonus = _as_json_obj(await _get_admin_value("bonus_sections"))
-    mode = (bonus.get("year") or "referral").strip().lower()
+    mode = (cfg.bonus_sections.get("year") or "referral").strip().lower()
     if mode not in {"referral", "referrals"}:
         return False
 
-    try:
-        thr = int(await _get_admin_value("referral_bonus_threshold") or 0)
-    except Exception:
-        thr = 0
+    thr = cfg.referral_bonus_threshold or 0  # не задан — отчёт закрыт (как до снимка настроек)
     if thr <= 0:
         return False
 
@@ -749,72 +814,194 @@ async def _spinner_anim_loop(bot, chat_id: int, stop: asyncio.Event):
                 pass
 
 
-async def _gen_and_store(session_id: int, code: str) -> tuple[dict, str]:
+def _facts_patch_for(code: str, data: dict) -> tuple[dict, dict, dict | None]:
     """
-    Универсально дергаем LLM-сценарий (через admin_scenarios), сохраняем в БД и
-    возвращаем (исходный_json, превью_для_экрана).
-    Логика сохранения:
+    Раскладывает результат сценария по session_facts:
+    (колонки, ключи для extra, payload версии или None).
       - mission / love -> в колонки mission/love (текст)
       - finance / karma / year -> в session_facts.extra[code] (текст)
       - strengths / weaknesses / business / countries -> списки ("items")
-      - всё остальное -> session_facts.extra[code] = как есть (dict)
+      - всё остальное -> session_facts.extra[code] = как есть (dict), без версии
     """
-    from services import llm as llmsvc
-
-    pool = _require_pool()
-    # дергаем LLM и получаем dict
-    data = await llmsvc.run_scenario(session_id, code) or {}
-
-    # вытащим краткое превью: либо первые пункты, либо короткий текст/сырой json
-    def _preview_from_data(d: dict) -> str:
-        if isinstance(d, dict):
-            if isinstance(d.get("items"), list):
-                return "\n".join(f"• {str(x)}" for x in d["items"][:10]) or "—"
-            # распространённые поля-тексты
-            for k in (code, "text", "mission", "love", "finance", "karma", "year"):
-                if isinstance(d.get(k), str) and d[k].strip():
-                    return d[k]
-        # fallback — компактный json
-        try:
-            return json.dumps(d, ensure_ascii=False)[:1000]
-        except Exception:
-            return str(d)[:1000]
-
-    # текущие факты
-    facts = await dbsvc.get_session_facts(session_id) or {}
-    extra_raw = facts.get("extra")
-    extra = extra_raw.copy() if isinstance(extra_raw, dict) else {}
-
-    # Сохранение по типам
+    data = data if isinstance(data, dict) else {}
     if code in {"mission", "love"}:
         text = data.get("text") or data.get(code) or ""
-        await dbsvc.add_fact_version(session_id, code, {"text": text}, make_active=True)
-        await dbsvc.upsert_session_facts(session_id, **{code: text})
-
-    elif code in {"finance", "karma", "year"}:
+        return {code: text}, {}, {"text": text}
+    if code in {"finance", "karma", "year"}:
         text = data.get("text") or data.get(code) or ""
-        await dbsvc.add_fact_version(session_id, code, {"text": text}, make_active=True)
-        extra[code] = text
-        await dbsvc.upsert_session_facts(session_id, extra=extra)
-
-    elif code in {"strengths", "weaknesses", "business", "countries"}:
+        return {}, {code: text}, {"text": text}
+    if code in {"strengths", "weaknesses", "business", "countries"}:
         # ожидаем {"items":[...]}
         items = data.get("items")
         payload = {"items": items if isinstance(items, list) else []}
-        await dbsvc.add_fact_version(session_id, code, payload, make_active=True)
-        await dbsvc.upsert_session_facts(session_id, **{code: payload})
+        return {code: payload}, {}, payload
+    # неизвестный/кастомный сценарий — сохраняем «как есть» в extra
+    return {}, {code: data}, None
 
-    else:
-        # неизвестный/кастомный сценарий — сохраняем «как есть» в extra
-        extra[code] = data
-        await dbsvc.upsert_session_facts(session_id, extra=extra)
 
-    # пересобираем summary
-    await dbsvc.rebuild_session_summary(session_id)
+_store_flights = singleflight.SingleFlight("gen_and_store", preempt_from=PRIORITY_PREFETCH)
 
-    return data, _preview_from_data(data)
+
+def _preview_from_data(code: str, d: dict) -> str:
+    """Краткое превью: либо первые пункты, либо короткий текст/сырой json."""
+    if isinstance(d, dict):
+        if isinstance(d.get("items"), list):
+            return "\n".join(f"• {str(x)}" for x in d["items"][:10]) or "—"
+        # распространённые поля-тексты
+        for k in (code, "text", "mission", "love", "finance", "karma", "year"):
+            if isinstance(d.get(k), str) and d[k].strip():
+                return d[k]
+    # fallback — компактный json
+    try:
+        return json.dumps(d, ensure_ascii=False)[:1000]
+    except Exception:
+        return str(d)[:1000]
+
+
+async def _gen_and_store(
+    session_id: int,
+    code: str,
+    *,
+    use_cache: bool = True,
+    tg_id: int | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    source: str = "user",
+) -> tuple[dict, str]:
+    """
+    Универсально дергаем LLM-сценарий (через admin_scenarios), сохраняем в БД и
+    возвращаем (исходный_json, превью_для_экрана).
+    Логика сохранения — см. _facts_patch_for.
+    use_cache=False — перегенерация мимо кэша LLM; tg_id/priority — для очереди LLM;
+    source — пометка версии ("prefetch" для фоновой предгенерации).
+    Одновременные вызовы для той же (сессии, сценария) делят одну генерацию и одну запись;
+    идущую предгенерацию клик отменяет и генерирует сам (см. singleflight).
+    """
+    return await _store_flights.do(
+        (session_id, code),
+        lambda waited: _gen_and_store_once(
+            session_id, code, use_cache=use_cache or waited, tg_id=tg_id, priority=priority, source=source
+        ),
+        priority=priority,
+    )
+
+
+async def _gen_and_store_once(
+    session_id: int,
+    code: str,
+    *,
+    use_cache: bool,
+    tg_id: int | None,
+    priority: int,
+    source: str,
+) -> tuple[dict, str]:
+    from services import llm as llmsvc
+
+    pool = _require_pool()
+    # дергаем LLM и получаем dict
+    data = await llmsvc.run_scenario(
+        session_id, code, use_cache=use_cache, tg_id=tg_id, priority=priority
+    ) or {}
+
+    # версия, факты и summary — одной транзакцией
+    columns, extra_patch, version = _facts_patch_for(code, data)
+    await dbsvc.save_scenario_results(
+        session_id, {code: version} if version is not None else {}, op="gen_and_store", source=source,
+        extra=extra_patch or None, **columns,
+    )
+
+    return data, _preview_from_data(code, data)
+
+
+async def _gen_and_store_many(
+    session_id: int,
+    codes: list[str],
+    *,
+    tg_id: int | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    source: str = "user",
+    on_partial=None,
+) -> dict[str, dict]:
+    """
+    Несколько сценариев одним запросом к LLM (llmsvc.run_scenarios) и одна запись в БД:
+    версии — одной транзакцией, session_facts — одним upsert, summary пересобирается один раз.
+    Возвращает {code: json}; пустые/неудавшиеся части не сохраняются.
+    Коды регистрируются в _store_flights: клик по одному из них ждёт этот запрос, а не запускает второй.
+    """
+    if len(codes) == 1:
+        data, _ = await _gen_and_store(session_id, codes[0], tg_id=tg_id, priority=priority, source=source)
+        return {codes[0]: data}
+
+    shared = await _store_flights.do_many(
+        [(session_id, code) for code in codes],
+        lambda keys: _gen_and_store_many_once(
+            session_id, [code for _, code in keys], tg_id=tg_id, priority=priority, source=source,
+            on_partial=on_partial,
+        ),
+        priority=priority,
+    )
+    return {code: data for (_, code), (data, _) in shared.items()}
+
+
+async def _gen_and_store_many_once(
+    session_id: int,
+    codes: list[str],
+    *,
+    tg_id: int | None,
+    priority: int,
+    source: str,
+    on_partial,
+) -> dict[tuple[int, str], tuple[dict, str]]:
+    results = await llmsvc.run_scenarios(
+        session_id, codes, tg_id=tg_id, priority=priority, on_partial=on_partial
+    )
+    columns: dict = {}
+    extra_patch: dict = {}
+    versions: dict = {}
+    for code, data in results.items():
+        if not data:
+            continue
+        cols, extra, version = _facts_patch_for(code, data)
+        columns.update(cols)
+        extra_patch.update(extra)
+        if version is not None:
+            versions[code] = version
+    if columns or extra_patch or versions:
+        await dbsvc.save_scenario_results(
+            session_id, versions, op="gen_and_store_many", source=source, extra=extra_patch or None, **columns
+        )
+    # значения — как у _gen_and_store: (json, превью), чтобы do() по одному коду мог дождаться этого запроса
+    out = {}
+    for code in codes:
+        data = results.get(code) or {}
+        out[(session_id, code)] = (data, _preview_from_data(code, data))
+    return out
 
 
+def _fact_text(facts: dict | None, code: str):
+    """Готовый текст сценария в session_facts (колонка или extra[code]), см. _facts_patch_for."""
+    facts = facts or {}
+    if code in {"mission", "love"}:
+        return facts.get(code)
+    extra = facts.get("extra")
+    return extra.get(code) if isinstance(extra, dict) else None
+
+
+async def _combined_text(cb: CallbackQuery, session_id: int, code: str, facts: dict | None, header: str) -> str | None:
+    """
+    Открыли раздел из LLM_COMBINED_SCENARIOS, а готовых разделов группы нет: генерируем все
+    недостающие одним запросом (текст открытого — стримом). None — комбинированный режим не нужен.
+    """
+    group = llmsvc.LLM_COMBINED_SCENARIOS
+    if code not in group or not llmsvc.OPENAI_API_KEY:
+        return None
+    missing = [c for c in group if c != code and not _fact_text(facts, c)]
+    if not missing:
+        return None
+    results = await _gen_and_store_many(
+        session_id, [code, *missing], tg_id=cb.from_user.id, on_partial=_stream_editor(cb, header)
+    )
+    cols, extra, _ = _facts_patch_for(code, results.get(code) or {})
+    return cols.get(code) or extra.get(code) or None
 
 
 # ---------- Главное меню: сценарии ----------
@@ -831,26 +1018,23 @@ async def menu_mission(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     session_id = data["session_id"]
 
-    facts = await dbsvc.get_session_facts(session_id)
+    await prefetch.note_open(session_id, "mission")
+    bundle = await dbsvc.load_session_bundle(session_id, astro=False)
+    facts = bundle.facts if bundle else {}
     mission = (facts or {}).get("mission")
     if not mission:
-        from services.db import _require_pool
-        pool = _require_pool()
-        row = await pool.fetchrow("SELECT raw_calc_json FROM sessions WHERE id=$1", session_id)
-        astro_json = row["raw_calc_json"] if row else None
-
-        summary = await dbsvc.get_session_summary_text(session_id)
+        mission = await _combined_text(cb, session_id, "mission", facts, "🌟 <b>Твоя миссия</b>")
+    if not mission:
+        # ASTRO_JSON, факты и сводку run_scenario подтянет сам (_build_context)
         mission = await llmsvc.generate_text_or_mock(
             scenario="mission",
-            astro_json=astro_json,
-            session_summary=summary,
             session_id=session_id,
+            tg_id=cb.from_user.id,
+            on_partial=_stream_editor(cb, "🌟 <b>Твоя миссия</b>"),
         )
 
         # версионирование (храним текст в jsonb как {"text": "..."}), + каноническая запись
-        await dbsvc.add_fact_version(session_id, "mission", {"text": mission}, make_active=True)
-        await dbsvc.upsert_session_facts(session_id, mission=mission)
-        await dbsvc.rebuild_session_summary(session_id)
+        await dbsvc.save_scenario_results(session_id, {"mission": {"text": mission}}, op="menu_mission", mission=mission)
 
     locks = await _locks_for_menu(cb)
     markup = await _main_menu_markup_for_user(cb.from_user.id, locks)
@@ -866,25 +1050,19 @@ async def menu_countries(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     session_id = data["session_id"]
 
-    facts = await dbsvc.get_session_facts(session_id)
+    await prefetch.note_open(session_id, "countries")
+    bundle = await dbsvc.load_session_bundle(session_id, astro=False)
+    facts = bundle.facts if bundle else {}
     countries = (facts or {}).get("countries")
     if not countries or "items" not in countries:
-        from services.db import _require_pool
-        pool = _require_pool()
-        row = await pool.fetchrow("SELECT raw_calc_json FROM sessions WHERE id=$1", session_id)
-        astro_json = row["raw_calc_json"] if row else None
-
-        summary = await dbsvc.get_session_summary_text(session_id)
+        # ASTRO_JSON, факты и сводку run_scenario подтянет сам (_build_context)
         countries = await llmsvc.generate_list_or_mock(
             scenario="countries",
             n=5,
-            astro_json=astro_json,
-            session_summary=summary,
             session_id=session_id,
+            tg_id=cb.from_user.id,
         )
-        await dbsvc.add_fact_version(session_id, "countries", countries, make_active=True)
-        await dbsvc.upsert_session_facts(session_id, countries=countries)
-        await dbsvc.rebuild_session_summary(session_id)
+        await dbsvc.save_scenario_results(session_id, {"countries": countries}, op="menu_countries", countries=countries)
 
     text = "🗺️ <b>Топ-5 стран для жизни</b>\n\n" + _fmt_list(countries.get("items", []))
     locks = await _locks_for_menu(cb)
@@ -903,25 +1081,19 @@ async def menu_business(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     session_id = data["session_id"]
 
-    facts = await dbsvc.get_session_facts(session_id)
+    await prefetch.note_open(session_id, "business")
+    bundle = await dbsvc.load_session_bundle(session_id, astro=False)
+    facts = bundle.facts if bundle else {}
     business = (facts or {}).get("business")
     if not business or "items" not in business:
-        from services.db import _require_pool
-        pool = _require_pool()
-        row = await pool.fetchrow("SELECT raw_calc_json FROM sessions WHERE id=$1", session_id)
-        astro_json = row["raw_calc_json"] if row else None
-
-        summary = await dbsvc.get_session_summary_text(session_id)
+        # ASTRO_JSON, факты и сводку run_scenario подтянет сам (_build_context)
         business = await llmsvc.generate_list_or_mock(
             scenario="business",
             n=10,
-            astro_json=astro_json,
-            session_summary=summary,
             session_id=session_id,
+            tg_id=cb.from_user.id,
         )
-        await dbsvc.add_fact_version(session_id, "business", business, make_active=True)
-        await dbsvc.upsert_session_facts(session_id, business=business)
-        await dbsvc.rebuild_session_summary(session_id)
+        await dbsvc.save_scenario_results(session_id, {"business": business}, op="menu_business", business=business)
 
     text = "💼 <b>Топ-10 бизнес-идей</b>\n\n" + _fmt_list(business.get("items", []))
     locks = await _locks_for_menu(cb)
@@ -940,24 +1112,21 @@ async def menu_love(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     session_id = data["session_id"]
 
-    facts = await dbsvc.get_session_facts(session_id)
+    await prefetch.note_open(session_id, "love")
+    bundle = await dbsvc.load_session_bundle(session_id, astro=False)
+    facts = bundle.facts if bundle else {}
     love = (facts or {}).get("love")
     if not love:
-        from services.db import _require_pool
-        pool = _require_pool()
-        row = await pool.fetchrow("SELECT raw_calc_json FROM sessions WHERE id=$1", session_id)
-        astro_json = row["raw_calc_json"] if row else None
-
-        summary = await dbsvc.get_session_summary_text(session_id)
+        love = await _combined_text(cb, session_id, "love", facts, "❤️ <b>Личная жизнь</b>")
+    if not love:
+        # ASTRO_JSON, факты и сводку run_scenario подтянет сам (_build_context)
         love = await llmsvc.generate_text_or_mock(
             scenario="love",
-            astro_json=astro_json,
-            session_summary=summary,
             session_id=session_id,
+            tg_id=cb.from_user.id,
+            on_partial=_stream_editor(cb, "❤️ <b>Личная жизнь</b>"),
         )
-        await dbsvc.add_fact_version(session_id, "love", {"text": love}, make_active=True)
-        await dbsvc.upsert_session_facts(session_id, love=love)
-        await dbsvc.rebuild_session_summary(session_id)
+        await dbsvc.save_scenario_results(session_id, {"love": {"text": love}}, op="menu_love", love=love)
 
     locks = await _locks_for_menu(cb)
     markup = await _main_menu_markup_for_user(cb.from_user.id, locks)
@@ -1011,8 +1180,10 @@ async def menu_finance(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     session_id = data["session_id"]
 
+    await prefetch.note_open(session_id, "finance")
     # пробуем взять из кэша (session_facts.extra.finance)
-    facts = await dbsvc.get_session_facts(session_id)
+    bundle = await dbsvc.load_session_bundle(session_id, astro=False)
+    facts = bundle.facts if bundle else {}
     finance = None
     if facts:
         extra_raw = facts.get("extra")
@@ -1020,37 +1191,21 @@ async def menu_finance(cb: CallbackQuery, state: FSMContext):
         finance = extra.get("finance")
 
     if not finance:
-        # достаём astro_json и session_summary
-        from services.db import _require_pool
-        pool = _require_pool()
-        row = await pool.fetchrow("SELECT raw_calc_json FROM sessions WHERE id=$1", session_id)
-        astro_json = row["raw_calc_json"] if row else None
-
-        summary = await dbsvc.get_session_summary_text(session_id)
-
+        finance = await _combined_text(cb, session_id, "finance", facts, "💰 <b>Финансовый потенциал</b>")
+    if not finance:
+        # ASTRO_JSON, факты и сводку run_scenario подтянет сам (_build_context)
         # генерим текст
         finance = await llmsvc.generate_text_or_mock(
             scenario="finance",
-            astro_json=astro_json,
-            session_summary=summary,
             session_id=session_id,
+            tg_id=cb.from_user.id,
+            on_partial=_stream_editor(cb, "💰 <b>Финансовый потенциал</b>"),
         )
 
-        # версия (для истории и «перегенерации» в будущем)
-        await dbsvc.add_fact_version(session_id, "finance", {"text": finance}, make_active=True)
-
-        # сохраняем в session_facts.extra -> finance (без изменения схемы таблицы)
-        await pool.execute(
-            """
-            INSERT INTO session_facts (session_id, extra)
-            VALUES ($1, jsonb_build_object('finance', to_jsonb($2::text)))
-            ON CONFLICT (session_id) DO UPDATE
-            SET extra = coalesce(session_facts.extra, '{}'::jsonb)
-                       || jsonb_build_object('finance', to_jsonb($2::text))
-            """,
-            session_id, finance
+        # версия (для истории и «перегенерации» в будущем) + session_facts.extra -> finance
+        await dbsvc.save_scenario_results(
+            session_id, {"finance": {"text": finance}}, op="menu_finance", extra={"finance": finance}
         )
-        await dbsvc.rebuild_session_summary(session_id)
 
     # рисуем меню с замочками
     locks = await _locks_for_menu(cb)
@@ -1066,76 +1221,40 @@ async def menu_year(cb: CallbackQuery, state: FSMContext):
 
     data = await state.get_data()
     session_id = data["session_id"]
-    pool = _require_pool()
 
+    await prefetch.note_open(session_id, "year")
     # 1) читаем extra
-    row = await pool.fetchrow("SELECT extra FROM session_facts WHERE session_id=$1", session_id)
-    raw_extra = row["extra"] if row else None
-
-    # 2) нормализуем к строке + миграции/починка «обёртки»
-    year_text = None
-    if isinstance(raw_extra, dict):
-        year_raw = raw_extra.get("year")
-    elif isinstance(raw_extra, str) and raw_extra:
-        year_raw = raw_extra
-        # миграция случая, когда ВЕСЬ extra был строкой
-        await pool.execute(
-            "UPDATE session_facts SET extra = jsonb_build_object('year', to_jsonb($2::text)) WHERE session_id=$1",
-            session_id, year_raw
-        )
-    else:
-        year_raw = None
+    bundle = await dbsvc.load_session_bundle(session_id, astro=False)
+    facts = bundle.facts if bundle else {}
+    raw_extra = facts.get("extra")
+    year_raw = raw_extra.get("year") if isinstance(raw_extra, dict) else None
 
-    # если year_raw — словарь: берём .text/.year; если строка — распаковываем JSON-строку
+    # 2) нормализуем к строке: словарь — берём .text/.year; строка — распаковываем JSON-строку
     if isinstance(year_raw, dict):
         year_text = year_raw.get("text") or year_raw.get("year") or json.dumps(year_raw, ensure_ascii=False)
-        # перезаписываем extra.year плоским текстом
-        await pool.execute(
-            """
-            UPDATE session_facts
-            SET extra = COALESCE(extra,'{}'::jsonb) || jsonb_build_object('year', to_jsonb($2::text))
-            WHERE session_id=$1
-            """,
-            session_id, year_text
-        )
     elif isinstance(year_raw, str):
-        unwrapped = _unwrap_json_text(year_raw)
-        if unwrapped != year_raw:
-            await pool.execute(
-                """
-                UPDATE session_facts
-                SET extra = COALESCE(extra,'{}'::jsonb) || jsonb_build_object('year', to_jsonb($2::text))
-                WHERE session_id=$1
-                """,
-                session_id, unwrapped
-            )
-        year_text = unwrapped
+        year_text = _unwrap_json_text(year_raw)
     else:
         year_text = None
 
-    # 3) если «мусор» (пусто/только год/слишком коротко) — СНАЧАЛА очищаем ключ, чтобы он не мешал
+    # 3) если «мусор» (пусто/только год/слишком коротко) — СНАЧАЛА очищаем ключ, чтобы он не мешал;
+    #    иначе, если была «обёртка», перезаписываем extra.year плоским текстом
     if _needs_year_regen(year_text):
-        await pool.execute(
-            "UPDATE session_facts SET extra = COALESCE(extra,'{}'::jsonb) - 'year' WHERE session_id=$1",
-            session_id
-        )
+        if year_raw is not None:
+            await dbsvc.upsert_session_facts(session_id, drop_extra=("year",))
 
         # 4) основная генерация
-        row2 = await pool.fetchrow("SELECT raw_calc_json FROM sessions WHERE id=$1", session_id)
-        astro_json = row2["raw_calc_json"] if row2 else None
-        summary = await dbsvc.get_session_summary_text(session_id)
-
         year_text = await llmsvc.generate_text_or_mock(
             scenario="year",
-            astro_json=astro_json,
-            session_summary=summary,
             session_id=session_id,
+            tg_id=cb.from_user.id,
+            on_partial=_stream_editor(cb, "📅 <b>Годовой отчёт</b>"),
         )
 
         # 5) фолбэк: если снова мусор (например, вернулось «2024») — пробуем админ-сценарий
         if _needs_year_regen(year_text):
             try:
-                data_json = await llmsvc.run_scenario(session_id, "year") or {}
+                data_json = await llmsvc.run_scenario(session_id, "year", tg_id=cb.from_user.id) or {}
                 year_text = (data_json.get("text") if isinstance(data_json, dict) else "") \
                             or "Годовой отчёт недоступен. Попробуй позже."
             except Exception:
@@ -1145,15 +1264,11 @@ async def menu_year(cb: CallbackQuery, state: FSMContext):
             year_text = _unwrap_json_text(year_text)
 
         # 6) сохраняем в версии и в extra.year
-        await dbsvc.add_fact_version(session_id, "year", {"text": year_text}, make_active=True)
-        await pool.execute("""
-            INSERT INTO session_facts (session_id, extra)
-            VALUES ($1, jsonb_build_object('year', to_jsonb($2::text)))
-            ON CONFLICT (session_id) DO UPDATE
-            SET extra = COALESCE(session_facts.extra, '{}'::jsonb)
-                     || jsonb_build_object('year', to_jsonb($2::text))
-        """, session_id, year_text)
-        await dbsvc.rebuild_session_summary(session_id)
+        await dbsvc.save_scenario_results(
+            session_id, {"year": {"text": year_text}}, op="menu_year", extra={"year": year_text}
+        )
+    elif year_text != year_raw:
+        await dbsvc.upsert_session_facts(session_id, extra={"year": year_text})
 
     # 7) показать отчёт
     locks = await _locks_for_menu(cb)
@@ -1169,6 +1284,8 @@ async def menu_year(cb: CallbackQuery, state: FSMContext):
 @router.callback_query(Flow.MENU, F.data == "menu:reset")
 async def menu_reset(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
+    if data.get("session_id"):
+        prefetch.cancel(data["session_id"])
     user_id = data.get("user_id")
     if user_id:
         await dbsvc.deactivate_sessions(user_id)
@@ -1194,7 +1311,9 @@ async def menu_karma(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     session_id = data["session_id"]
 
-    facts = await dbsvc.get_session_facts(session_id)
+    await prefetch.note_open(session_id, "karma")
+    bundle = await dbsvc.load_session_bundle(session_id, astro=False)
+    facts = bundle.facts if bundle else {}
     karma = None
     if facts:
         extra_raw = facts.get("extra")
@@ -1202,36 +1321,55 @@ async def menu_karma(cb: CallbackQuery, state: FSMContext):
         karma = extra.get("karma")
 
     if not karma:
-        from services.db import _require_pool
-        pool = _require_pool()
-        row = await pool.fetchrow("SELECT raw_calc_json FROM sessions WHERE id=$1", session_id)
-        astro_json = row["raw_calc_json"] if row else None
-        summary = await dbsvc.get_session_summary_text(session_id)
-
+        karma = await _combined_text(cb, session_id, "karma", facts, "🌀 <b>Кармический разбор</b>")
+    if not karma:
+        # ASTRO_JSON, факты и сводку run_scenario подтянет сам (_build_context)
         karma = await llmsvc.generate_text_or_mock(
             scenario="karma",
-            astro_json=astro_json,
-            session_summary=summary,
             session_id=session_id,
+            tg_id=cb.from_user.id,
+            on_partial=_stream_editor(cb, "🌀 <b>Кармический разбор</b>"),
         )
 
-        await dbsvc.add_fact_version(session_id, "karma", {"text": karma}, make_active=True)
-        await pool.execute(
-            """
-            INSERT INTO session_facts (session_id, extra)
-            VALUES ($1, jsonb_build_object('karma', to_jsonb($2::text)))
-            ON CONFLICT (session_id) DO UPDATE
-            SET extra = coalesce(session_facts.extra, '{}'::jsonb)
-                       || jsonb_build_object('karma', to_jsonb($2::text))
-            """,
-            session_id, karma
+        await dbsvc.save_scenario_results(
+            session_id, {"karma": {"text": karma}}, op="menu_karma", extra={"karma": karma}
         )
-        await dbsvc.rebuild_session_summary(session_id)
 
     locks = await _locks_for_menu(cb)
     markup = await _main_menu_markup_for_user(cb.from_user.id, locks)
     await safe_edit(cb, f"🌀 <b>Кармический разбор</b>\n\n{karma}", reply_markup=markup)
 
+@router.message(Command("stats"))
+async def owner_stats(m: Message):
+    """Метрики LLM-вызовов (только владельцу бота)."""
+    if not BOT_OWNER_ID or m.from_user.id != BOT_OWNER_ID:
+        return
+    head = (
+        f"inflight={llm_scheduler.inflight} queued={llm_scheduler.queued()} breaker={llm_breaker.state}\n"
+        f"llm_log={llm_log.sink.stats()}\n"
+        f"db_pool={_require_pool().stats()}\n\n"
+    )
+    text = head + metrics.render()
+    await m.answer(f"<pre>{html.escape(text[:3900])}</pre>")
+
+
+@router.errors(ExceptionTypeFilter(LLMUnavailable))
+async def on_llm_unavailable(event: ErrorEvent):
+    """Breaker открыт (services/llm_breaker.py): вместо тишины — понятное сообщение."""
+    upd = event.update
+    try:
+        if upd.callback_query:
+            try:
+                await upd.callback_query.answer(LLM_UNAVAILABLE_TEXT, show_alert=True)
+            except TelegramBadRequest:  # колбэк уже отвечен («Готовлю раздел…»)
+                await upd.callback_query.message.answer(LLM_UNAVAILABLE_TEXT)
+        elif upd.message:
+            await upd.message.answer(LLM_UNAVAILABLE_TEXT)
+    except Exception as e:
+        logging.warning("llm unavailable notice failed: %s", e)
+    return True
+
+
 @router.message(F.text.lower().in_({"расчёты", "расчеты"}))
 @router.message(F.text.startswith("/calc"))
 async def open_calc_menu_msg(m: Message):
@@ -1277,7 +1415,7 @@ async def run_scenario(cb: CallbackQuery, state: FSMContext):
     await cb.answer()  # убрать часики
     await cb.message.answer("Готовлю раздел…")
 
-    _, preview = await _gen_and_store(session_id, code)
+    _, preview = await _gen_and_store(session_id, code, tg_id=cb.from_user.id)
 
     head = await _scenario_title(code)
     await cb.message.answer(f"<b>{head}</b>\n\n{preview}", reply_markup=_scenario_view_kb(code))
@@ -1306,16 +1444,17 @@ async def scenario_regen(cb: CallbackQuery, state: FSMContext):
         await state.update_data(session_id=session_id)
 
     await cb.answer("Пересчитываю…")
-    _, preview = await _gen_and_store(session_id, code)
+    _, preview = await _gen_and_store(
+        session_id, code, use_cache=False, tg_id=cb.from_user.id, priority=PRIORITY_REGEN
+    )
     head = await _scenario_title(code)
     await cb.message.answer(f"♻️ <b>{head}</b> (обновлено)\n\n{preview}", reply_markup=_scenario_view_kb(code))
 
 
 async def _scenario_title(code: str) -> str:
-    """Заголовок сценария из admin_scenarios, или сам code если не найден."""
-    pool = _require_pool()
-    row = await pool.fetchrow("SELECT title FROM admin_scenarios WHERE scenario=$1", code)
-    return (row["title"] if row and row["title"] else code)
+    """Заголовок сценария из каталога admin_scenarios, или сам code если не найден."""
+    sc = await scenario_catalog.get_scenario(code)
+    return sc.title if sc else code
 
 async def _log_spinner_kind(msg: Message):
     # Если это был стикер
@@ -0,0 +1,122 @@
+# services/admin_settings.py
+"""
+Снимок admin_settings (строка id=1) в памяти процесса.
+
+Раньше каждое чтение настройки было SELECT: рендер меню (_locks_for_menu → гейты) делал 5–10
+запросов, InputSanitizerMiddleware — ещё один на каждый текст. Теперь:
+  - строка читается целиком и приводится к типам (AdminSettings) — при первом обращении;
+  - триггер на admin_settings (миграция 019) шлёт NOTIFY admin_settings_changed,
+    services/pg_listen.py ловит его и снимок перечитывается;
+  - страховка — ADMIN_SETTINGS_TTL_SEC: снимок старше TTL перечитывается в фоне,
+    читатели получают текущий без ожидания.
+Чтение — await get() / current(): поле объекта, без запросов к БД.
+"""
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field, fields
+from typing import Any, Optional
+
+from services import metrics, pg_listen
+from services.db import _require_pool
+
+ADMIN_SETTINGS_TTL_SEC = float(os.getenv("ADMIN_SETTINGS_TTL_SEC", "60"))
+ADMIN_SETTINGS_CHANNEL = "admin_settings_changed"
+
+
+@dataclass(frozen=True)
+class AdminSettings:
+    greeting_text: str = ""
+    system_prompt: str = ""
+    enable_referrals: bool = False
+    referral_bonus_threshold: Optional[int] = None  # None — не задан: гейт разделов берёт 3, годовой отчёт — 0
+    enable_channel_gate: bool = False
+    telegram_channel_id: str = ""
+    telegram_channel_url: str = ""
+    bonus_sections: dict = field(default_factory=dict)
+    enable_compat: bool = False
+    enable_periodic_horoscopes: bool = False
+    strict_json: Optional[bool] = None  # None — решает STRICT_JSON_SCHEMA (llm._strict_json_flag_default)
+    max_input_length: int = 80
+    first_screen_scenarios: list = field(default_factory=lambda: ["strengths", "weaknesses"])
+
+    def get(self, key: str) -> Any:
+        return getattr(self, key) if key in KEYS else None
+
+
+KEYS = frozenset(f.name for f in fields(AdminSettings))
+_DEFAULTS = AdminSettings()
+
+_snapshot: Optional[AdminSettings] = None
+_loaded_at = 0.0
+_refresh_task: asyncio.Task | None = None
+
+
+def _typed(row: Any) -> AdminSettings:
+    """Строка admin_settings → AdminSettings; NULL/мусор в колонке — значение по умолчанию."""
+    cols = set(row.keys()) if row is not None else set()
+    values: dict[str, Any] = {}
+    for f in fields(AdminSettings):
+        raw = row[f.name] if f.name in cols else None
+        default = getattr(_DEFAULTS, f.name)
+        if raw is None:
+            continue
+        if f.name == "strict_json" or isinstance(default, bool):
+            values[f.name] = raw if isinstance(raw, bool) else str(raw).strip().lower() in ("1", "true", "on", "yes")
+        elif f.name == "referral_bonus_threshold" or isinstance(default, int):
+            try:
+                values[f.name] = int(raw)
+            except (TypeError, ValueError):
+                pass
+        elif isinstance(default, (dict, list)):
+            if isinstance(raw, type(default)):  # jsonb уже декодирован кодеком пула (services/pg_json.py)
+                values[f.name] = raw
+        else:
+            values[f.name] = str(raw)
+    return AdminSettings(**values)
+
+
+async def refresh(reason: str = "load") -> AdminSettings:
+    """Перечитать строку id=1. Ошибка БД — остаётся прежний снимок (или значения по умолчанию)."""
+    global _snapshot, _loaded_at
+    try:
+        row = await _require_pool().fetchrow("SELECT * FROM admin_settings WHERE id=1")
+        _snapshot = _typed(row)
+        metrics.inc("admin_settings_reload_total", reason=reason)
+    except Exception as e:
+        logging.warning("admin_settings reload (%s) failed: %s", reason, e)
+        metrics.inc("admin_settings_reload_total", reason="error")
+        if _snapshot is None:
+            _snapshot = _DEFAULTS
+    _loaded_at = time.monotonic()  # и после ошибки: следующая попытка — через TTL, а не на каждом чтении
+    return _snapshot
+
+
+def _schedule(reason: str) -> None:
+    """Фоновое перечитывание; пачка уведомлений подряд схлопывается в одно."""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(refresh(reason), name="admin-settings-refresh")
+
+
+def _on_notify(payload: Optional[str]) -> None:
+    _schedule("notify" if payload is not None else "resync")
+
+
+def current() -> AdminSettings:
+    """Снимок без ожидания (до первой загрузки — значения по умолчанию); устаревший — обновится в фоне."""
+    if _snapshot is None:
+        return _DEFAULTS
+    if time.monotonic() - _loaded_at > ADMIN_SETTINGS_TTL_SEC:
+        _schedule("ttl")
+    return _snapshot
+
+
+async def get() -> AdminSettings:
+    if _snapshot is None:
+        return await refresh()
+    return current()
+
+
+pg_listen.subscribe(ADMIN_SETTINGS_CHANNEL, _on_notify)
@@ -1,14 +1,20 @@
 # bot/services/db.py
-import json
 import logging
-from typing import Optional, Any, Dict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional, Any, Dict, Iterable
 import asyncpg
 
+from services import metrics
+
 _pool: Optional[asyncpg.Pool] = None
 
 
 def set_pool(pool: asyncpg.Pool) -> None:
-    """Передаём пул из app.py, чтобы все сервисы использовали одну коннекцию."""
+    """Передаём пул из app.py, чтобы все сервисы использовали одну коннекцию.
+
+    В боте это db_pool.InstrumentedPool — тот же интерфейс, что у asyncpg.Pool, плюс метрики acquire.
+    """
     global _pool
     _pool = pool
 
@@ -51,16 +57,8 @@ async def list_enabled_scenarios() -> list[dict[str, str]]:
     Вернёт список включённых сценариев для кнопок меню.
     [{ "scenario": "mission", "title": "Миссия" }, ...]
     """
-    pool = _require_pool()
-    rows = await pool.fetch(
-        """
-        SELECT scenario, title
-        FROM admin_scenarios
-        WHERE enabled = true
-        ORDER BY scenario
-        """
-    )
-    return [{"scenario": r["scenario"], "title": r["title"]} for r in rows]
+    from services import scenario_catalog  # каталог в памяти; сам импортирует db
+    return [{"scenario": s.code, "title": s.title} for s in (await scenario_catalog.get()).enabled]
 
 
 
@@ -133,16 +131,35 @@ async def set_location(session_id: int, lat: float, lon: float, tz: str) -> None
 async def save_raw_calc(session_id: int, astro_json: dict) -> None:
     pool = _require_pool()
     await pool.execute(
-        "UPDATE sessions SET raw_calc_json=$2::jsonb WHERE id=$1",
+        "UPDATE sessions SET raw_calc_json=$2 WHERE id=$1",
         session_id,
-        json.dumps(astro_json, ensure_ascii=False),
+        astro_json,
     )
 
 
 
 # ---------- session_facts ----------
 
-async def upsert_session_facts(
+_FACTS_COLUMNS = "mission, strengths, weaknesses, countries, business, love, extra"
+
+# патч фактов (см. upsert_session_facts); $9 — ключи extra на удаление
+_FACTS_PATCH_SQL = """
+    INSERT INTO session_facts (session_id, mission, strengths, weaknesses, countries, business, love, extra)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+    ON CONFLICT (session_id) DO UPDATE SET
+        mission    = COALESCE(EXCLUDED.mission,    session_facts.mission),
+        strengths  = COALESCE(EXCLUDED.strengths,  session_facts.strengths),
+        weaknesses = COALESCE(EXCLUDED.weaknesses, session_facts.weaknesses),
+        countries  = COALESCE(EXCLUDED.countries,  session_facts.countries),
+        business   = COALESCE(EXCLUDED.business,   session_facts.business),
+        love       = COALESCE(EXCLUDED.love,       session_facts.love),
+        extra      = (COALESCE(session_facts.extra, '{}'::jsonb) - $9::text[])
+                     || COALESCE(EXCLUDED.extra, '{}'::jsonb),
+        updated_at = now()
+"""
+
+
+def _facts_patch_args(
     session_id: int,
     *,
     mission: Optional[str] = None,
@@ -152,86 +169,114 @@ async def upsert_session_facts(
     business: Optional[dict] = None,
     love: Optional[str] = None,
     extra: Optional[dict] = None,
-) -> None:
-    pool = _require_pool()
+    drop_extra: tuple[str, ...] = (),
+) -> tuple:
+    return (session_id, mission, strengths, weaknesses, countries, business, love, extra, list(drop_extra))
 
-    def _j(v):
-        return None if v is None else json.dumps(v, ensure_ascii=False)
 
-    await pool.execute(
-        """
-        INSERT INTO session_facts (session_id, mission, strengths, weaknesses, countries, business, love, extra)
-        VALUES ($1, $2, $3::jsonb, $4::jsonb, $5::jsonb, $6::jsonb, $7, $8::jsonb)
-        ON CONFLICT (session_id) DO UPDATE SET
-            mission    = COALESCE(EXCLUDED.mission,    session_facts.mission),
-            strengths  = COALESCE(EXCLUDED.strengths,  session_facts.strengths),
-            weaknesses = COALESCE(EXCLUDED.weaknesses, session_facts.weaknesses),
-            countries  = COALESCE(EXCLUDED.countries,  session_facts.countries),
-            business   = COALESCE(EXCLUDED.business,   session_facts.business),
-            love       = COALESCE(EXCLUDED.love,       session_facts.love),
-            extra      = COALESCE(EXCLUDED.extra,      session_facts.extra),
-            updated_at = now()
-        """,
-        session_id,
-        mission,
-        _j(strengths),
-        _j(weaknesses),
-        _j(countries),
-        _j(business),
-        love,
-        _j(extra),
+async def upsert_session_facts(
+    session_id: int,
+    *,
+    mission: Optional[str] = None,
+    strengths: Optional[dict] = None,
+    weaknesses: Optional[dict] = None,
+    countries: Optional[dict] = None,
+    business: Optional[dict] = None,
+    love: Optional[str] = None,
+    extra: Optional[dict] = None,
+    drop_extra: tuple[str, ...] = (),
+) -> dict:
+    """
+    Патч session_facts одной командой (одна версия строки на сохранение):
+      - колонки: переданное (не None) заменяет текущее, None — оставляет как есть;
+      - extra: ключи патча ложатся поверх текущего extra (||), остальные ключи не трогаются;
+      - drop_extra: ключи extra, которые надо удалить.
+    Возвращает новую строку (как get_session_facts).
+    """
+    pool = _require_pool()
+    row = await pool.fetchrow(
+        f"{_FACTS_PATCH_SQL} RETURNING {_FACTS_COLUMNS}",
+        *_facts_patch_args(
+            session_id, mission=mission, strengths=strengths, weaknesses=weaknesses, countries=countries,
+            business=business, love=love, extra=extra, drop_extra=drop_extra,
+        ),
     )
-
-
-    # динамически собираем апдейт
-    sets, values = [], [session_id]
-    idx = 2
-    for col, val in [
-        ("mission", mission),
-        ("strengths", strengths),
-        ("weaknesses", weaknesses),
-        ("countries", countries),
-        ("business", business),
-        ("love", love),
-        ("extra", extra),
-    ]:
-        if val is not None:
-            sets.append(f"{col} = ${idx}")
-            values.append(json.dumps(val) if isinstance(val, (dict, list)) else val)
-            idx += 1
-
-    if sets:
-        q = f"UPDATE session_facts SET {', '.join(sets)}, updated_at=now() WHERE session_id=$1"
-        await pool.execute(q, *values)
+    return dict(row)
 
 async def get_session_facts(session_id: int) -> dict:
     pool = _require_pool()
-    row = await pool.fetchrow(
-        """
-        SELECT mission, strengths, weaknesses, countries, business, love, extra
-        FROM session_facts WHERE session_id=$1
-        """,
-        session_id,
+    row = await pool.fetchrow(f"SELECT {_FACTS_COLUMNS} FROM session_facts WHERE session_id=$1", session_id)
+    return dict(row) if row else {}
+
+@dataclass
+class SessionBundle:
+    """Всё о сессии для LLM-контекста и экранов меню — результат load_session_bundle."""
+    session_id: int
+    user_id: int
+    tg_id: Optional[int]
+    user_name: Optional[str]
+    gender: Optional[str]
+    system: Optional[str]
+    birth_date: Any
+    birth_time: Any
+    lat: Optional[float]
+    lon: Optional[float]
+    tz: Optional[str]
+    unknown_time: Optional[bool]
+    astro_json: Any                                   # None при astro=False
+    facts: Dict[str, Any] = field(default_factory=dict)  # как get_session_facts; {} — фактов ещё нет
+    summary: str = ""
+
+
+# s — sessions, u — users, f — session_facts (или CTE с ними), sm — session_summary
+_BUNDLE_SELECT = """
+    s.user_id, s.system, s.birth_date, s.birth_time, s.lat, s.lon, s.tz, s.unknown_time,
+    u.tg_id, u.user_name, u.gender,
+    f.session_id IS NOT NULL AS has_facts,
+    f.mission, f.strengths, f.weaknesses, f.countries, f.business, f.love, f.extra,
+    sm.summary_text
+"""
+
+_BUNDLE_SQL = f"""
+    SELECT {_BUNDLE_SELECT}, CASE WHEN $2 THEN s.raw_calc_json END AS raw_calc_json
+    FROM sessions s
+    JOIN users u ON u.id = s.user_id
+    LEFT JOIN session_facts f ON f.session_id = s.id
+    LEFT JOIN session_summary sm ON sm.session_id = s.id
+    WHERE s.id = $1
+"""
+
+
+def _bundle_from_row(session_id: int, row: Any) -> SessionBundle:
+    facts = {k: row[k] for k in _FACTS_COLUMNS.split(", ")} if row["has_facts"] else {}
+    return SessionBundle(
+        session_id=session_id,
+        user_id=row["user_id"],
+        tg_id=row["tg_id"],
+        user_name=row["user_name"],
+        gender=row["gender"],
+        system=row["system"],
+        birth_date=row["birth_date"],
+        birth_time=row["birth_time"],
+        lat=row["lat"],
+        lon=row["lon"],
+        tz=row["tz"],
+        unknown_time=row["unknown_time"],
+        astro_json=row.get("raw_calc_json"),
+        facts=facts,
+        summary=row["summary_text"] or "",
     )
-    if not row:
-        return {}
 
-    result = dict(row)
 
-    def _maybe_json(x):
-        if isinstance(x, str):
-            try:
-                return json.loads(x)
-            except Exception:
-                return x
-        return x
-
-    # поля jsonb могут прийти строкой — приводим к dict/list
-    for key in ("strengths", "weaknesses", "countries", "business", "extra"):
-        if key in result:
-            result[key] = _maybe_json(result[key])
-
-    return result
+async def load_session_bundle(session_id: int, *, astro: bool = True) -> Optional[SessionBundle]:
+    """
+    Сессия, пользователь, ASTRO_JSON, факты и сводка — одним запросом (вместо raw_calc_json +
+    get_session_facts + get_session_summary_text + sessions⋈users). None — сессии нет.
+    astro=False — без raw_calc_json (самое крупное поле; экранам меню с готовыми фактами не нужно).
+    """
+    pool = _require_pool()
+    row = await pool.fetchrow(_BUNDLE_SQL, session_id, astro)
+    return _bundle_from_row(session_id, row) if row else None
 
 async def log_llm_message(
     session_id: int,
@@ -253,46 +298,44 @@ async def log_llm_message(
         session_id, scenario, role, content, schema_ok, input_tokens, output_tokens, status,
     )
 
-# Полная замена функции add_fact_version
 async def add_fact_version(
     session_id: int,
     scenario: str,
     content,
     *,
     make_active: bool = False,
+    source: str = "user",
 ):
     """
     Сохраняет новую версию фактов для сценария.
-    content — dict/str; в БД хранится jsonb.
+    content — dict/list; в БД хранится jsonb (кодек пула, services/pg_json.py).
     Если make_active=True — деактивируем старые версии и ставим новую активной.
+    source — откуда версия: "user" (клик/онбординг) или "prefetch" (фоновая предгенерация).
     """
-    pool = _require_pool()
+    await add_fact_versions(session_id, {scenario: content}, make_active=make_active, source=source)
 
-    # Всегда приводим к строке JSON — так гарантированно совместимо с $3::jsonb
-    if isinstance(content, (bytes, bytearray)):
-        content_json = content.decode("utf-8", errors="replace")
-    elif isinstance(content, str):
-        content_json = content
-    else:
-        content_json = json.dumps(content, ensure_ascii=False)
 
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            if make_active:
-                # Снимем активность со старых версий этого сценария
-                await conn.execute(
-                    "UPDATE session_facts_versions SET is_active=false WHERE session_id=$1 AND scenario=$2",
-                    session_id, scenario
-                )
-
-            # Вставляем новую версию (явный каст к jsonb)
-            await conn.execute(
-                """
-                INSERT INTO session_facts_versions (session_id, scenario, content, is_active)
-                VALUES ($1, $2, $3::jsonb, $4)
-                """,
-                session_id, scenario, content_json, make_active
-            )
+async def add_fact_versions(
+    session_id: int,
+    contents: dict[str, Any],
+    *,
+    make_active: bool = False,
+    source: str = "user",
+):
+    """Версии нескольких сценариев сессии одной транзакцией ({scenario: content})."""
+    if not contents:
+        return
+    async with unit_of_work("add_fact_versions") as uow:
+        await uow.add_versions(session_id, contents, make_active=make_active, source=source)
+
+_SUMMARY_UPSERT_SQL = """
+    INSERT INTO session_summary (session_id, summary_text)
+    VALUES ($1, $2)
+    ON CONFLICT (session_id) DO UPDATE
+      SET summary_text = EXCLUDED.summary_text,
+          updated_at   = now()
+"""
+
 
 async def upsert_session_summary(session_id: int, summary_text: str | None) -> None:
     """
@@ -300,17 +343,7 @@ async def upsert_session_summary(session_id: int, summary_text: str | None) -> N
     Если запись уже есть — обновляет текст и updated_at.
     """
     pool = _require_pool()
-    summary_text = summary_text or ""
-    await pool.execute(
-        """
-        INSERT INTO session_summary (session_id, summary_text)
-        VALUES ($1, $2)
-        ON CONFLICT (session_id) DO UPDATE
-          SET summary_text = EXCLUDED.summary_text,
-              updated_at   = now()
-        """,
-        session_id, summary_text
-    )
+    await pool.execute(_SUMMARY_UPSERT_SQL, session_id, summary_text or "")
 
 # -- get session summary text ---------------------------------------------------
 async def get_session_summary_text(session_id: int) -> str:
@@ -325,44 +358,14 @@ async def get_session_summary_text(session_id: int) -> str:
     return (row["summary_text"] if row and row["summary_text"] else "") or ""
 
 # ---------- admin_settings (нормализованная схема; одна строка id=1) ----------
-from typing import Any, Optional
-import json
-
-# Маппинг поддерживаемых настроек на колонки таблицы
-_ADMIN_COL_MAP: dict[str, str] = {
-    "greeting_text": "greeting_text",
-    "system_prompt": "system_prompt",
-    "enable_referrals": "enable_referrals",
-    "referral_bonus_threshold": "referral_bonus_threshold",
-    "enable_channel_gate": "enable_channel_gate",
-    "telegram_channel_id": "telegram_channel_id",
-    "telegram_channel_url": "telegram_channel_url",
-    "bonus_sections": "bonus_sections",
-    "enable_compat": "enable_compat",
-    "enable_periodic_horoscopes": "enable_periodic_horoscopes",
-    "strict_json": "strict_json",
-    "max_input_length": "max_input_length",
-}
 
 async def get_admin_value(key: str) -> Optional[Any]:
     """
-    Возвращает значение настройки из admin_settings (id=1).
+    Значение настройки из admin_settings (id=1) — из снимка в памяти (services/admin_settings.py),
+    без запроса к БД; снимок обновляется по NOTIFY и TTL.
     """
-    col = _ADMIN_COL_MAP.get(key)
-    if not col:
-        return None
-    pool = _require_pool()
-    row = await pool.fetchrow(f"SELECT {col} FROM admin_settings WHERE id=1")
-    if not row:
-        return None
-    val = row[col]
-    # JSONB может прийти строкой — попробуем распарсить
-    if col == "bonus_sections" and isinstance(val, str):
-        try:
-            val = json.loads(val)
-        except Exception:
-            pass
-    return val
+    from services import admin_settings  # admin_settings сам импортирует db
+    return (await admin_settings.get()).get(key)
 
 async def get_greeting_text() -> str:
     """
@@ -452,41 +455,16 @@ def _join_items(obj: Optional[dict], n: int) -> str:
     items = obj.get("items") or []
     return ", ".join(map(str, items[:n]))
 
-async def rebuild_session_summary(session_id: int) -> None:
-    """
-    Пересобирает SESSION_SUMMARY из sessions, users и session_facts.
-    Вызывай после сохранения любого сценария.
-    """
-    pool = _require_pool()
-
-    srow = await pool.fetchrow(
-        """
-        SELECT s.user_id, s.system, s.birth_date, s.birth_time, s.lat, s.lon, s.tz, s.unknown_time,
-               u.user_name, u.gender
-        FROM sessions s
-        JOIN users u ON u.id = s.user_id
-        WHERE s.id = $1
-        """,
-        session_id,
-    )
-    if not srow:
-        return
+def _summary_text(b: SessionBundle) -> str:
+    """Текст SESSION_SUMMARY из данных сессии, пользователя и фактов."""
+    frow = b.facts
 
-    frow = await pool.fetchrow(
-        """
-        SELECT mission, strengths, weaknesses, countries, business, love, extra
-        FROM session_facts
-        WHERE session_id = $1
-        """,
-        session_id,
-    ) or {}
-
-    name   = srow["user_name"] or "пользователь"
-    gender = srow["gender"] or "-"
-    sys_t  = _sys_title(srow["system"])
-    bd     = srow["birth_date"]
-    bt     = srow["birth_time"]
-    loc    = f"lat={srow['lat']}, lon={srow['lon']}, tz={srow['tz']}"
+    name   = b.user_name or "пользователь"
+    gender = b.gender or "-"
+    sys_t  = _sys_title(b.system)
+    bd     = b.birth_date
+    bt     = b.birth_time
+    loc    = f"lat={b.lat}, lon={b.lon}, tz={b.tz}"
     time_s = f", время: {bt}" if bt else ", время: неизвестно"
 
     # кусочки из фактов
@@ -503,7 +481,9 @@ async def rebuild_session_summary(session_id: int) -> None:
     love_t = love_val if isinstance(love_val, str) else (love_val or {}).get("text","")
     love_snip = _first_sentence(love_t, 120)
 
-    extra = _as_json_obj(frow.get("extra"))
+    extra = frow.get("extra")
+    if not isinstance(extra, dict):
+        extra = {}
     fin_snip   = _first_sentence(extra.get("finance",""), 120)
     karma_snip = _first_sentence(extra.get("karma",""), 120)
     year_snip  = _first_sentence(extra.get("year",""), 120)
@@ -521,24 +501,156 @@ async def rebuild_session_summary(session_id: int) -> None:
     if karma_snip:  parts.append(f" Карма: {karma_snip}")
     if year_snip:   parts.append(f" Год: {year_snip}")
 
-    summary_text = " ".join(parts).strip()
-    await upsert_session_summary(session_id, summary_text)
-
-def _as_json_obj(val):
-    """Всегда вернуть dict. Допускаем None, str (json-строка), bytes; иначе {}."""
-    if val is None:
-        return {}
-    if isinstance(val, dict):
-        return val
-    if isinstance(val, (bytes, bytearray)):
-        try:
-            val = val.decode("utf-8", "ignore")
-        except Exception:
-            return {}
-    if isinstance(val, str):
-        try:
-            obj = json.loads(val)
-            return obj if isinstance(obj, dict) else {}
-        except Exception:
-            return {}
-    return {}
+    return " ".join(parts).strip()
+
+
+async def rebuild_session_summary(session_id: int) -> None:
+    """
+    Пересобирает SESSION_SUMMARY из sessions, users и session_facts (один запрос — load_session_bundle).
+    Вызывай после сохранения любого сценария (или используй unit_of_work — всё одной транзакцией).
+    """
+    b = await load_session_bundle(session_id, astro=False)
+    if b is None:
+        return
+    summary_text = _summary_text(b)
+    if summary_text != b.summary:  # сводка не изменилась — без лишней версии строки
+        await upsert_session_summary(session_id, summary_text)
+
+
+# ---------- unit of work: результат генерации одной транзакцией ----------
+
+ROUNDTRIP_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+# локи версий (session, scenario) в переданном порядке: параллельные записи одного сценария — по очереди,
+# иначе активных версий станет две (и uq_fact_active из patch_002_memory.sql упадёт)
+_VERSION_LOCK_SQL = (
+    "SELECT pg_advisory_xact_lock(hashtextextended(k, 0)) "
+    "FROM unnest($1::text[]) WITH ORDINALITY AS t(k, n) ORDER BY n"
+)
+
+
+def version_lock_keys(pairs: Iterable[tuple[int, str]]) -> list[str]:
+    """
+    Ключи advisory-локов версий ("sfv:<session_id>:<scenario>") — отсортированы и без повторов.
+    Один порядок у всех писателей (UnitOfWork, llm_batch._store) — без взаимоблокировок.
+    """
+    return sorted({f"sfv:{sid}:{scenario}" for sid, scenario in pairs})
+
+
+class UnitOfWork:
+    """
+    Сохранение результата сценария на одном соединении в одной транзакции:
+
+        async with dbsvc.unit_of_work("menu_finance") as uow:
+            await uow.add_versions(session_id, {"finance": {"text": t}}, make_active=True)
+            await uow.patch_facts(session_id, extra={"finance": t})
+            await uow.rebuild_summary(session_id)
+
+    Запросы к БД считаются (BEGIN/COMMIT — тоже): метрики db_roundtrips{op} и db_roundtrips_total{op},
+    чтобы лишний запрос в сценарии сохранения был виден в /stats.
+    """
+
+    def __init__(self, conn: asyncpg.Connection, op: str):
+        self.conn = conn
+        self.op = op
+        self.roundtrips = 0
+        self._bundles: Dict[int, SessionBundle] = {}
+
+    async def _execute(self, query: str, *args) -> str:
+        self.roundtrips += 1
+        return await self.conn.execute(query, *args)
+
+    async def _fetchrow(self, query: str, *args):
+        self.roundtrips += 1
+        return await self.conn.fetchrow(query, *args)
+
+    async def add_versions(
+        self, session_id: int, contents: Dict[str, Any], *, make_active: bool = False, source: str = "user"
+    ) -> None:
+        """
+        Версии нескольких сценариев ({scenario: content}) при любом их числе: лок, [снятие активности], вставка.
+        Снятие активности — отдельной командой до вставки: CTE с UPDATE не обязан выполниться раньше
+        INSERT (тот же снимок), и частичный уникальный индекс по активной версии упал бы.
+        """
+        if not contents:
+            return
+        await self._execute(_VERSION_LOCK_SQL, version_lock_keys((session_id, code) for code in contents))
+        scenarios = list(contents)
+        if make_active:
+            await self._execute(
+                "UPDATE session_facts_versions SET is_active = false "
+                "WHERE session_id = $1 AND scenario = ANY($2::text[]) AND is_active",
+                session_id, scenarios,
+            )
+        await self._execute(
+            """
+            INSERT INTO session_facts_versions (session_id, scenario, content, is_active, source)
+            SELECT $1::bigint, c.key, c.value, $3::boolean, $4::text FROM jsonb_each($2::jsonb) AS c
+            """,
+            session_id, contents, make_active, source,
+        )
+
+    async def patch_facts(self, session_id: int, **patch) -> dict:
+        """
+        Патч session_facts (аргументы — как у upsert_session_facts). Тем же запросом читает сессию,
+        пользователя и сводку — rebuild_summary после него обходится без чтения.
+        """
+        row = await self._fetchrow(
+            f"""
+            WITH f AS ({_FACTS_PATCH_SQL} RETURNING session_id, {_FACTS_COLUMNS})
+            SELECT {_BUNDLE_SELECT}
+            FROM f
+            JOIN sessions s ON s.id = f.session_id
+            JOIN users u ON u.id = s.user_id
+            LEFT JOIN session_summary sm ON sm.session_id = s.id
+            """,
+            *_facts_patch_args(session_id, **patch),
+        )
+        bundle = _bundle_from_row(session_id, row)
+        self._bundles[session_id] = bundle
+        return bundle.facts
+
+    async def rebuild_summary(self, session_id: int) -> None:
+        """Как rebuild_session_summary, но в этой транзакции; после patch_facts — только запись."""
+        b = self._bundles.get(session_id)
+        if b is None:
+            row = await self._fetchrow(_BUNDLE_SQL, session_id, False)
+            if not row:
+                return
+            b = _bundle_from_row(session_id, row)
+        summary_text = _summary_text(b)
+        if summary_text != b.summary:
+            await self._execute(_SUMMARY_UPSERT_SQL, session_id, summary_text)
+
+
+@asynccontextmanager
+async def unit_of_work(op: str):
+    """Транзакция для UnitOfWork; op — метка операции в метриках (например, "gen_and_store")."""
+    pool = _require_pool()
+    async with pool.acquire() as conn:
+        uow = UnitOfWork(conn, op)
+        async with conn.transaction():
+            yield uow
+        uow.roundtrips += 2  # BEGIN + COMMIT
+    metrics.observe("db_roundtrips", uow.roundtrips, buckets=ROUNDTRIP_BUCKETS, op=op)
+    metrics.inc("db_roundtrips_total", uow.roundtrips, op=op)
+
+
+async def save_scenario_results(
+    session_id: int,
+    versions: Dict[str, Any],
+    *,
+    op: str,
+    source: str = "user",
+    **patch,
+) -> dict:
+    """
+    Типичное сохранение после генерации: активные версии + патч фактов + сводка — одна транзакция,
+    6–7 запросов на одном соединении: BEGIN, лок, снятие активности, версии, патч с чтением сессии,
+    [сводка], COMMIT (раздельно — 8 и по соединению на вызов). Возвращает новые факты.
+    """
+    async with unit_of_work(op) as uow:
+        await uow.add_versions(session_id, versions, make_active=True, source=source)
+        facts = await uow.patch_facts(session_id, **patch)
+        await uow.rebuild_summary(session_id)
+    return facts
@@ -0,0 +1,162 @@
+# services/db_pool.py
+"""
+Пул asyncpg с настройками из env и метриками.
+
+Раньше пул был create_pool(min_size=1, max_size=5) без единой цифры о том, ждут ли хэндлеры
+соединения. Теперь:
+  - размер, время жизни простаивающего соединения, кэш prepared statements и таймаут команды —
+    DB_POOL_* / DB_STATEMENT_CACHE_SIZE / DB_COMMAND_TIMEOUT_SEC;
+  - InstrumentedPool: обёртка над asyncpg.Pool (тот же интерфейс) — ожидание acquire
+    (db_pool_acquire_wait_ms), занятые соединения на момент acquire (db_pool_in_use),
+    ошибки acquire (db_pool_acquire_errors_total);
+  - задержка каждого запроса — query logger asyncpg (db_query_ms{query}; метка — команда и таблица).
+
+    pool = await db_pool.create_pool(db_url, init=pg_json.init_connection)
+    pool.stats()  # размер / свободные / занятые / ждущие — в /stats у владельца бота
+"""
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import asyncpg
+
+from services import metrics
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_INACTIVE_SEC = float(os.getenv("DB_POOL_MAX_INACTIVE_SEC", "300"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_COMMAND_TIMEOUT_SEC = float(os.getenv("DB_COMMAND_TIMEOUT_SEC", "30")) or None  # 0 — без таймаута
+DB_QUERY_METRICS = os.getenv("DB_QUERY_METRICS", "1").strip().lower() in ("1", "true", "on", "yes")
+
+WAIT_BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+QUERY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+IN_USE_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50)
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:ONLY\s+)?(?:public\.)?([a-z_][a-z0-9_]*)", re.I)
+
+
+@lru_cache(maxsize=512)
+def query_label(query: str) -> str:
+    """Метка запроса для метрик: команда + первая таблица ("INSERT session_facts", "BEGIN")."""
+    text = query.lstrip()
+    verb = text.split(None, 1)[0].upper() if text else "?"
+    if "RESET ALL" in text:
+        return "RESET"  # сброс соединения при возврате в пул (Connection.get_reset_query)
+    m = _TABLE_RE.search(text)
+    return f"{verb} {m.group(1).lower()}" if m else verb
+
+
+def _on_query(record: Any) -> None:
+    labels = {"query": query_label(record.query)}
+    metrics.observe("db_query_ms", record.elapsed * 1000, buckets=QUERY_BUCKETS_MS, **labels)
+    if record.exception is not None:
+        metrics.inc("db_query_errors_total", error=type(record.exception).__name__, **labels)
+
+
+class _Acquire:
+    def __init__(self, pool: "InstrumentedPool", timeout: Optional[float]):
+        self._pool = pool
+        self._timeout = timeout
+        self._conn: Optional[asyncpg.Connection] = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        p = self._pool
+        p.waiting += 1
+        t0 = time.perf_counter()
+        try:
+            self._conn = await p.pool.acquire(timeout=self._timeout)
+        except Exception as e:
+            metrics.inc("db_pool_acquire_errors_total", pool=p.name, error=type(e).__name__)
+            raise
+        finally:
+            p.waiting -= 1
+        metrics.observe("db_pool_acquire_wait_ms", (time.perf_counter() - t0) * 1000,
+                        buckets=WAIT_BUCKETS_MS, pool=p.name)
+        p.in_use += 1
+        p.max_in_use = max(p.max_in_use, p.in_use)
+        metrics.observe("db_pool_in_use", p.in_use, buckets=IN_USE_BUCKETS, pool=p.name)
+        return self._conn
+
+    async def __aexit__(self, *exc) -> None:
+        p = self._pool
+        try:
+            await p.pool.release(self._conn)
+        finally:
+            p.in_use -= 1
+
+
+class InstrumentedPool:
+    """asyncpg.Pool с метриками acquire; остальное (close, get_size, …) — как у пула."""
+
+    def __init__(self, pool: asyncpg.Pool, name: str = "bot"):
+        self.pool = pool
+        self.name = name
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waiting = 0
+
+    def acquire(self, *, timeout: Optional[float] = None) -> _Acquire:
+        return _Acquire(self, timeout)
+
+    # те же шорткаты, что у asyncpg.Pool — через acquire(), чтобы попадать в метрики
+    async def execute(self, query: str, *args, timeout: Optional[float] = None) -> str:
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, command: str, args, *, timeout: Optional[float] = None) -> None:
+        async with self.acquire() as conn:
+            return await conn.executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query: str, *args, timeout: Optional[float] = None, record_class=None) -> list:
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchrow(self, query: str, *args, timeout: Optional[float] = None, record_class=None):
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchval(self, query: str, *args, column: int = 0, timeout: Optional[float] = None):
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args, column=column, timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "waiting": self.waiting,
+            "max_size": self.pool.get_max_size(),
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.pool, name)
+
+
+async def create_pool(
+    dsn: str,
+    *,
+    init: Optional[Callable[[asyncpg.Connection], Awaitable[None]]] = None,
+    name: str = "bot",
+) -> InstrumentedPool:
+    """Пул с настройками из env; init — доп. настройка соединения (например, pg_json.init_connection)."""
+
+    async def _init(conn: asyncpg.Connection) -> None:
+        if init is not None:
+            await init(conn)
+        if DB_QUERY_METRICS:
+            conn.add_query_logger(_on_query)
+
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_SEC,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT_SEC,
+        init=_init,
+    )
+    return InstrumentedPool(pool, name)
@@ -0,0 +1,416 @@
+# services/llm_batch.py
+"""
+Пакетная генерация периодических прогнозов (admin_settings.enable_periodic_horoscopes).
+
+Интерактивный путь (_openai_chat) не годится для «всей базы раз в день»: он съест RPM/TPM,
+нужные кликам. Здесь — Batch API провайдера:
+  1) раз в сутки (после LLM_BATCH_RUN_HOUR_UTC) на завтрашний период читаем активные сессии курсором
+     и пишем JSONL построчно во временный файл (custom_id = session_id; промпт — как у интерактивного
+     пути); часть — не больше LLM_BATCH_MAX_REQUESTS строк и LLM_BATCH_MAX_BYTES байт (лимиты файла);
+  2) файл → POST /files (purpose=batch) → POST /batches (completion_window=24h); часть, которую не
+     удалось отправить, повторяется на следующих тиках (до LLM_BATCH_SUBMIT_ATTEMPTS попыток);
+  3) каждые LLM_BATCH_POLL_SEC проверяем статус; готовый output читаем построчно (стримом),
+     валидируем по схеме сценария и пишем в session_facts_versions пачками по LLM_BATCH_INSERT_ROWS.
+Квоты не пересекаются: свой HTTP-клиент, мимо планировщика, можно отдельный ключ/проект
+(LLM_BATCH_API_KEY) и endpoint (LLM_BATCH_BASE_URL — для тестов bench/mock_openai.py).
+Состояние пачек — таблица llm_batches (строка на сценарий+период+часть, UNIQUE — защита от двух реплик).
+"""
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from typing import IO, Any, Dict, Optional
+
+import httpx
+from jsonschema import ValidationError
+
+from services.db import _VERSION_LOCK_SQL, _require_pool, version_lock_keys
+from services import db as dbsvc
+from services import llm_context, llm_repair, llm_schema, metrics, scenario_catalog
+from services.llm import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    LLMParams,
+    call_cost_usd,
+    _chat_body,
+    _make_messages,
+    _scenario_params,
+)
+
+LLM_BATCH_SCENARIO = os.getenv("LLM_BATCH_SCENARIO", "horoscope_daily")
+LLM_BATCH_RUN_HOUR_UTC = int(os.getenv("LLM_BATCH_RUN_HOUR_UTC", "2"))
+LLM_BATCH_POLL_SEC = float(os.getenv("LLM_BATCH_POLL_SEC", "300"))
+LLM_BATCH_MAX_REQUESTS = int(os.getenv("LLM_BATCH_MAX_REQUESTS", "50000"))  # лимит Batch API на файл
+LLM_BATCH_MAX_BYTES = int(os.getenv("LLM_BATCH_MAX_BYTES", str(190 * 1024 * 1024)))  # лимит 200 МБ с запасом
+LLM_BATCH_INSERT_ROWS = int(os.getenv("LLM_BATCH_INSERT_ROWS", "500"))
+LLM_BATCH_SUBMIT_ATTEMPTS = int(os.getenv("LLM_BATCH_SUBMIT_ATTEMPTS", "3"))
+LLM_BATCH_MODEL = os.getenv("LLM_BATCH_MODEL", "")  # пусто — модель сценария (admin_scenarios.model)
+LLM_BATCH_API_KEY = os.getenv("LLM_BATCH_API_KEY", "") or OPENAI_API_KEY
+LLM_BATCH_BASE_URL = (os.getenv("LLM_BATCH_BASE_URL", "") or OPENAI_BASE_URL).rstrip("/")
+
+SOURCE_BATCH = "batch"
+_FINAL = ("completed", "failed", "expired", "cancelled")
+_STALE_INGEST = "30 minutes"  # реплика упала посреди записи — подхватываем
+_STALE_BUILD = "30 minutes"   # реплика упала посреди отправки части — отправляем заново
+_FETCH_ROWS = 200             # строк сессий за один FETCH курсора
+_SPOOL_BYTES = 8 * 1024 * 1024  # JSONL части в памяти до 8 МБ, дальше — на диске
+
+_http: httpx.AsyncClient | None = None
+_task: asyncio.Task | None = None
+
+
+def _client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            base_url=LLM_BATCH_BASE_URL,
+            headers={"Authorization": f"Bearer {LLM_BATCH_API_KEY}"},
+            limits=httpx.Limits(max_connections=4),
+            timeout=httpx.Timeout(connect=10, read=300, write=300, pool=30),
+        )
+    return _http
+
+
+async def _scenario(scenario: str) -> tuple[str, dict, Optional[dict], LLMParams]:
+    """Промпт/схема/контекст/модель сценария из каталога; enabled не проверяем — он про кнопку в меню."""
+    sc = await scenario_catalog.get_scenario(scenario)
+    if sc is None:
+        raise RuntimeError(f"Scenario not found: {scenario}")
+    params = _scenario_params(sc)
+    if LLM_BATCH_MODEL:
+        params = params._replace(model=LLM_BATCH_MODEL)
+    return sc.prompt, sc.schema, sc.spec, params
+
+
+_SESSIONS_SQL = """
+    SELECT s.id, s.raw_calc_json,
+           f.mission, f.strengths, f.weaknesses, f.countries, f.business, f.love, f.extra,
+           sm.summary_text
+    FROM sessions s
+    LEFT JOIN session_facts f ON f.session_id = s.id
+    LEFT JOIN session_summary sm ON sm.session_id = s.id
+    WHERE s.is_active AND s.raw_calc_json IS NOT NULL AND s.raw_calc_json <> '{}'::jsonb
+      AND s.id > $1
+    ORDER BY s.id
+    LIMIT $2
+"""
+
+
+def request_line(
+    r: Any,
+    scenario: str,
+    task: str,
+    spec: Optional[dict],
+    params: LLMParams,
+    admin_prompt: str,
+) -> bytes:
+    """Строка JSONL для Batch API: один chat.completions на сессию."""
+    context = {
+        "astro_json": r["raw_calc_json"],
+        "facts": {k: r[k] for k in ("mission", "strengths", "weaknesses", "countries", "business", "love", "extra")},
+        "summary": r["summary_text"] or "",
+    }
+    # session_id=None: не вытесняем пачкой LRU-кэш ASTRO_JSON интерактивных сессий
+    ctx = llm_context.fit(context, spec, params.model)
+    body = _chat_body(_make_messages(task, ctx, scenario, admin_prompt), params)
+    line = json.dumps(
+        {"custom_id": str(r["id"]), "method": "POST", "url": "/v1/chat/completions", "body": body},
+        ensure_ascii=False,
+    )
+    return (line + "\n").encode("utf-8")
+
+
+async def write_requests(out: IO[bytes], scenario: str, period: date, after_id: int) -> tuple[int, Optional[int]]:
+    """
+    JSONL части (сессии с id > after_id) → out построчно; строки сессий читаем курсором,
+    в памяти — не больше _FETCH_ROWS строк. Возвращает (число запросов, последний session_id).
+    """
+    prompt, _, spec, params = await _scenario(scenario)
+    admin_prompt = str(await dbsvc.get_admin_value("system_prompt") or "")
+    task = f"{prompt}\nДАТА: {period.isoformat()}"
+    count, size, last_id = 0, 0, None
+    async with _require_pool().acquire() as conn:
+        async with conn.transaction(readonly=True):
+            async for r in conn.cursor(_SESSIONS_SQL, after_id, LLM_BATCH_MAX_REQUESTS, prefetch=_FETCH_ROWS):
+                line = request_line(r, scenario, task, spec, params, admin_prompt)
+                if count and size + len(line) > LLM_BATCH_MAX_BYTES:
+                    break  # остальное — в следующую часть
+                out.write(line)
+                count, size, last_id = count + 1, size + len(line), r["id"]
+    return count, last_id
+async def _claim_part(scenario: str, period: date, part: int) -> Optional[int]:
+    """
+    Новая часть или повтор неотправленной (ошибка до POST /batches, упавшая реплика) — id строки.
+    None — часть уже отправлена, строится другой репликой или попытки кончились.
+    """
+    return await _require_pool().fetchval(
+        f"""
+        INSERT INTO llm_batches (scenario, period, part) VALUES ($1, $2, $3)
+        ON CONFLICT (scenario, period, part) DO UPDATE
+           SET status='building', attempts=llm_batches.attempts + 1, error=NULL, updated_at=now()
+         WHERE llm_batches.provider_batch_id IS NULL
+           AND llm_batches.attempts < $4
+           AND (llm_batches.status = 'failed'
+                OR (llm_batches.status = 'building' AND llm_batches.updated_at < now() - interval '{_STALE_BUILD}'))
+        RETURNING id
+        """,
+        scenario, period, part, LLM_BATCH_SUBMIT_ATTEMPTS,
+    )
+
+
+async def _submit_part(batch_id: int, scenario: str, period: date, after_id: int) -> tuple[int, Optional[int]]:
+    """Собрать и отправить одну часть (сессии с id > after_id). Возвращает (число запросов, последний id)."""
+    pool = _require_pool()
+    count, last_id = 0, None
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=_SPOOL_BYTES) as payload:
+            count, last_id = await write_requests(payload, scenario, period, after_id)
+            if not count:
+                await pool.execute("UPDATE llm_batches SET status='done', updated_at=now() WHERE id=$1", batch_id)
+                return 0, None
+            payload.seek(0)
+            client = _client()
+            r = await client.post("/files", data={"purpose": "batch"},
+                                  files={"file": (f"{scenario}-{period}-{batch_id}.jsonl", payload, "application/jsonl")})
+        r.raise_for_status()
+        input_file_id = r.json()["id"]
+        r = await client.post("/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+            "metadata": {"scenario": scenario, "period": period.isoformat(), "batch_id": str(batch_id)},
+        })
+        r.raise_for_status()
+        provider_id = r.json()["id"]
+    except Exception as e:
+        # provider_batch_id остаётся NULL — часть заберёт следующий тик (_claim_part)
+        await pool.execute(
+            "UPDATE llm_batches SET status='failed', error=$2, request_count=$3, last_session_id=$4, "
+            "updated_at=now() WHERE id=$1",
+            batch_id, str(e)[:2000], count, last_id,
+        )
+        metrics.inc("llm_batch_total", scenario=scenario, status="submit_failed")
+        raise
+    await pool.execute(
+        """
+        UPDATE llm_batches SET status='submitted', provider_batch_id=$2, input_file_id=$3,
+               request_count=$4, last_session_id=$5, updated_at=now()
+        WHERE id=$1
+        """,
+        batch_id, provider_id, input_file_id, count, last_id,
+    )
+    metrics.inc("llm_batch_total", scenario=scenario, status="submitted")
+    logging.info("llm batch submitted id=%s provider=%s scenario=%s period=%s after=%s requests=%s",
+                 batch_id, provider_id, scenario, period, after_id, count)
+    return count, last_id
+
+
+async def submit(scenario: str, period: date) -> list[int]:
+    """
+    Отправить пачку на период частями (до LLM_BATCH_MAX_REQUESTS сессий / LLM_BATCH_MAX_BYTES, идём по id)
+    до первой пустой части. Уже отправленные части пропускаются, неотправленные — повторяются.
+    Возвращает id отправленных сейчас.
+    """
+    pool = _require_pool()
+    sent: list[int] = []
+    after_id = 0
+    part = 0
+    while True:
+        batch_id = await _claim_part(scenario, period, part)
+        if batch_id is None:
+            row = await pool.fetchrow(
+                "SELECT status, provider_batch_id, request_count, last_session_id FROM llm_batches "
+                "WHERE scenario=$1 AND period=$2 AND part=$3",
+                scenario, period, part,
+            )
+            if row is None or row["last_session_id"] is None:
+                return sent  # часть строится другой репликой / пустая / не отправлена и попытки кончились
+            if row["status"] == "failed" and row["provider_batch_id"] is None:
+                logging.warning("llm batch part %s (%s, %s) not submitted after %s attempts, skipped",
+                                part, scenario, period, LLM_BATCH_SUBMIT_ATTEMPTS)
+            count, last_id = row["request_count"], row["last_session_id"]
+        else:
+            count, last_id = await _submit_part(batch_id, scenario, period, after_id)
+            if count:
+                sent.append(batch_id)
+        if not count or last_id is None:
+            return sent  # сессий больше нет
+        after_id = last_id
+        part += 1
+
+
+async def _store(scenario: str, items: list[tuple[int, str]]) -> int:
+    """Пачка результатов → session_facts_versions одной транзакцией (локи — как в db.UnitOfWork)."""
+    ids = [sid for sid, _ in items]
+    contents = [c for _, c in items]
+    async with _require_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(_VERSION_LOCK_SQL, version_lock_keys((sid, scenario) for sid in ids))
+            await conn.execute(
+                "UPDATE session_facts_versions SET is_active=false "
+                "WHERE scenario=$2 AND session_id = ANY($1::bigint[]) AND is_active",
+                ids, scenario,
+            )
+            status = await conn.execute(
+                """
+                INSERT INTO session_facts_versions (session_id, scenario, content, is_active, source)
+                SELECT t.sid, $3::text, t.c::jsonb, true, $4::text
+                FROM unnest($1::bigint[], $2::text[]) AS t(sid, c)
+                JOIN sessions s ON s.id = t.sid
+                """,
+                ids, contents, scenario, SOURCE_BATCH,
+            )
+    return int(status.split()[-1])
+
+
+def _parse_result(line: str, scenario: str, schema: dict) -> tuple[Optional[int], Optional[str], str]:
+    """Строка output-файла → (session_id, JSON-текст результата, статус)."""
+    try:
+        rec = json.loads(line)
+        sid = int(rec["custom_id"])
+    except (ValueError, KeyError, TypeError):
+        return None, None, "bad_line"
+    resp = rec.get("response") or {}
+    if rec.get("error") or resp.get("status_code") != 200:
+        return sid, None, "error"
+    body = resp.get("body") or {}
+    usage = body.get("usage") or {}
+    if usage.get("prompt_tokens"):
+        metrics.inc("llm_tokens_total", usage["prompt_tokens"], scenario=scenario, kind="input", mode="batch")
+    if usage.get("completion_tokens"):
+        metrics.inc("llm_tokens_total", usage["completion_tokens"], scenario=scenario, kind="output", mode="batch")
+    cost = call_cost_usd(body.get("model") or "", usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    if cost:  # Batch API — половина цены
+        metrics.inc("llm_cost_usd_total", cost / 2, scenario=scenario, model=body.get("model"), mode="batch")
+    try:
+        text = body["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return sid, None, "invalid"
+    try:
+        data = json.loads(text)
+        if schema:
+            llm_schema.validator_for(scenario, schema).validate(data)
+    except (ValueError, TypeError, ValidationError):
+        # только локальный ремонт; не вышло — у сессии остаётся прежняя версия
+        data = llm_repair.repair(text, scenario, schema) if llm_repair.LLM_LOCAL_REPAIR else None
+        if data is None:
+            return sid, None, "invalid"
+        return sid, json.dumps(data, ensure_ascii=False), "repaired"
+    return sid, text, "ok"  # валидный JSON модели — в jsonb как есть, без повторной сериализации
+
+
+async def ingest(batch_id: int, scenario: str, output_file_id: str) -> tuple[int, int]:
+    """Читает output стримом и пишет результаты пачками. Возвращает (ok, fail)."""
+    _, schema, _, _ = await _scenario(scenario)
+    ok = fail = 0
+    buf: list[tuple[int, str]] = []
+    async with _client().stream("GET", f"/files/{output_file_id}/content") as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.strip():
+                continue
+            sid, content, status = _parse_result(line, scenario, schema)
+            metrics.inc("llm_batch_results_total", scenario=scenario, status=status)
+            if content is None:
+                fail += 1
+                continue
+            buf.append((sid, content))
+            if len(buf) >= LLM_BATCH_INSERT_ROWS:
+                ok += await _store(scenario, buf)
+                buf.clear()
+    if buf:
+        ok += await _store(scenario, buf)
+    logging.info("llm batch ingested id=%s scenario=%s ok=%s fail=%s", batch_id, scenario, ok, fail)
+    return ok, fail
+
+
+async def poll() -> None:
+    """Проверить отправленные пачки; готовые — забрать (claim через UPDATE … RETURNING)."""
+    pool = _require_pool()
+    rows = await pool.fetch(
+        f"""
+        SELECT id, scenario, provider_batch_id FROM llm_batches
+        WHERE status = 'submitted'
+           OR (status = 'ingesting' AND updated_at < now() - interval '{_STALE_INGEST}')
+        ORDER BY id
+        """
+    )
+    for row in rows:
+        try:
+            r = await _client().get(f"/batches/{row['provider_batch_id']}")
+            r.raise_for_status()
+            info: Dict[str, Any] = r.json()
+        except Exception as e:
+            # одна недоступная пачка не держит остальные; повтор — на следующем тике
+            logging.warning("llm batch poll failed id=%s provider=%s: %s", row["id"], row["provider_batch_id"], e)
+            metrics.inc("llm_batch_poll_errors_total", scenario=row["scenario"])
+            continue
+        state = info.get("status")
+        if state not in _FINAL:
+            continue
+        claimed = await pool.fetchval(
+            "UPDATE llm_batches SET status='ingesting', output_file_id=$2, updated_at=now() "
+            "WHERE id=$1 AND status IN ('submitted', 'ingesting') RETURNING id",
+            row["id"], info.get("output_file_id"),
+        )
+        if claimed is None:
+            continue
+        ok = fail = 0
+        error = None if state == "completed" else f"provider status: {state}"
+        try:
+            # у expired/cancelled бывает частичный output — забираем, что готово
+            if info.get("output_file_id"):
+                ok, fail = await ingest(row["id"], row["scenario"], info["output_file_id"])
+        except Exception as e:
+            error = str(e)[:2000]
+            logging.warning("llm batch ingest failed id=%s: %s", row["id"], e)
+        await pool.execute(
+            "UPDATE llm_batches SET status=$2, ok_count=$3, fail_count=$4, error=$5, updated_at=now() WHERE id=$1",
+            row["id"], "done" if error is None else "failed", ok, fail, error,
+        )
+        metrics.inc("llm_batch_total", scenario=row["scenario"], status=state)
+
+
+async def tick(now: Optional[datetime] = None) -> None:
+    """Один шаг: забрать готовое; если прогнозы включены и пора — отправить пачку на завтра."""
+    if not LLM_BATCH_API_KEY:
+        return
+    await poll()
+    if not await dbsvc.get_admin_value("enable_periodic_horoscopes"):
+        return
+    now = now or datetime.now(timezone.utc)
+    if now.hour >= LLM_BATCH_RUN_HOUR_UTC:
+        await submit(LLM_BATCH_SCENARIO, now.date() + timedelta(days=1))
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await tick()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning("llm batch tick failed: %s", e)
+        await asyncio.sleep(LLM_BATCH_POLL_SEC)
+
+
+def start() -> None:
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(_run(), name="llm-batch")
+
+
+async def stop() -> None:
+    global _task, _http
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    if _http is not None:
+        client, _http = _http, None
+        await client.aclose()
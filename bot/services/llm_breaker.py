@@ -0,0 +1,112 @@
+# services/llm_breaker.py
+"""
+Circuit breaker и hedged-запросы к OpenAI по собственной статистике задержек.
+
+Окно последних задержек HTTP-попыток наполняет _note_attempt в services/llm.py.
+  - Breaker открывается после LLM_BREAKER_FAILURES неудачных попыток подряд (5xx/таймаут/обрыв)
+    или когда p95 окна выше LLM_BREAKER_LATENCY_MS. Открытый — сразу LLMUnavailable
+    (хэндлер показывает «попробуй через минуту»), а не минуты ретраев и ремонтов.
+    Через LLM_BREAKER_OPEN_SEC пропускается один пробный запрос (half-open): успех закрывает.
+  - Hedge (LLM_HEDGE_ENABLED=1): если ответа нет дольше p95 окна (не меньше LLM_HEDGE_MIN_MS),
+    уходит второй такой же запрос; берём ответ, пришедший первым. Цена — до ~5% лишних запросов.
+429 не считается ни успехом, ни отказом: это лимит, им занимается планировщик.
+"""
+import os
+import time
+import logging
+from collections import deque
+from typing import Optional
+
+from services import metrics
+
+LLM_BREAKER_ENABLED = os.getenv("LLM_BREAKER_ENABLED", "1").strip().lower() in ("1", "true", "on", "yes")
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_LATENCY_MS = float(os.getenv("LLM_BREAKER_LATENCY_MS", "30000"))
+LLM_BREAKER_OPEN_SEC = float(os.getenv("LLM_BREAKER_OPEN_SEC", "30"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+LLM_LATENCY_MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", "20"))
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0").strip().lower() in ("1", "true", "on", "yes")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "1500"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class LLMUnavailable(RuntimeError):
+    """Провайдер деградировал, breaker открыт — запрос не отправлялся."""
+
+
+class CircuitBreaker:
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self._fails = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lat: deque[float] = deque(maxlen=max(1, LLM_LATENCY_WINDOW))
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Квантиль задержки успешных попыток по окну; None — мало данных."""
+        if len(self._lat) < LLM_LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._lat)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _move(self, state: str, reason: str) -> None:
+        if state == self.state:
+            return
+        logging.warning("llm breaker %s → %s (%s)", self.state, state, reason)
+        metrics.inc("llm_breaker_transitions_total", state=state, reason=reason)
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self._lat.clear()  # старые медленные замеры не должны сразу открыть его снова
+        if state == CLOSED:
+            self._fails = 0
+
+    def allow(self) -> bool:
+        """Можно ли отправлять запрос сейчас (в half-open — один пробный за LLM_BREAKER_OPEN_SEC)."""
+        if not LLM_BREAKER_ENABLED or self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN and now - self._opened_at < LLM_BREAKER_OPEN_SEC:
+            return False
+        if self.state == HALF_OPEN and now - self._probe_at < LLM_BREAKER_OPEN_SEC:
+            return False  # проба уже в полёте
+        self._move(HALF_OPEN, "probe")
+        self._probe_at = now
+        return True
+
+    def check(self) -> None:
+        if not self.allow():
+            metrics.inc("llm_breaker_rejected_total")
+            raise LLMUnavailable("LLM circuit breaker is open")
+
+    def record(self, ok: bool, latency_ms: float) -> None:
+        if not ok:
+            self._fails += 1
+            if self.state == HALF_OPEN:
+                self._move(OPEN, "probe_failed")
+            elif self._fails >= LLM_BREAKER_FAILURES:
+                self._move(OPEN, "failures")
+            return
+        self._fails = 0
+        self._lat.append(latency_ms)
+        if self.state == HALF_OPEN:
+            self._move(CLOSED, "probe_ok")
+            return
+        p95 = self.quantile(0.95)
+        if p95 is not None and p95 > LLM_BREAKER_LATENCY_MS:
+            self._move(OPEN, "latency")
+
+    def hedge_delay(self) -> Optional[float]:
+        """Через сколько секунд слать дублирующий запрос; None — hedging выключен или мало данных."""
+        if not LLM_HEDGE_ENABLED:
+            return None
+        q = self.quantile(LLM_HEDGE_QUANTILE)
+        if q is None:
+            return None
+        return max(LLM_HEDGE_MIN_MS, q) / 1000.0
+
+
+breaker = CircuitBreaker()
@@ -0,0 +1,112 @@
+# services/llm_cache.py
+"""
+Кэш результатов LLM по «отпечатку» карты.
+
+Ключ — sha256 от (scenario, prompt_template, schema_json, model, temperature,
+канонический полный ASTRO_JSON — до отбора полей и бюджета контекста). Два уровня: LRU в памяти процесса + таблица llm_cache.
+Правка сценария в админке меняет prompt/schema → меняется ключ, а триггер
+на admin_scenarios чистит старые строки таблицы.
+"""
+import os
+import copy
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from services.db import _require_pool
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "on", "yes")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+
+# key -> (scenario, result)
+_lru: "OrderedDict[str, tuple[str, Dict[str, Any]]]" = OrderedDict()
+
+
+def _canonical(obj: Any) -> str:
+    """Стабильная сериализация: сортировка ключей, без пробелов."""
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def cache_key(
+    scenario: str,
+    prompt_template: str,
+    schema: Dict[str, Any],
+    model: str,
+    temperature: float,
+    astro_json: Any,
+) -> str:
+    parts = [
+        scenario,
+        prompt_template or "",
+        _canonical(schema or {}),
+        model,
+        repr(float(temperature)),
+        _canonical(astro_json),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _remember(key: str, scenario: str, result: Dict[str, Any]) -> None:
+    _lru[key] = (scenario, result)
+    _lru.move_to_end(key)
+    while len(_lru) > LLM_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+async def get(key: str) -> Optional[Dict[str, Any]]:
+    """Результат из LRU или таблицы llm_cache; None при промахе. Всегда отдаём копию."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    hit = _lru.get(key)
+    if hit is not None:
+        _lru.move_to_end(key)
+        return copy.deepcopy(hit[1])
+
+    pool = _require_pool()
+    try:
+        row = await pool.fetchrow(
+            """
+            UPDATE llm_cache SET hits = hits + 1, last_hit_at = now()
+            WHERE key = $1
+            RETURNING scenario, result
+            """,
+            key,
+        )
+    except Exception as e:
+        logging.warning("llm cache read failed: %s", e)
+        return None
+    if not row:
+        return None
+
+    result = row["result"]
+    if not isinstance(result, dict):
+        return None
+    _remember(key, row["scenario"], result)
+    return copy.deepcopy(result)
+
+
+async def put(key: str, scenario: str, model: str, result: Dict[str, Any]) -> None:
+    if not LLM_CACHE_ENABLED or not isinstance(result, dict) or not result:
+        return
+    _remember(key, scenario, copy.deepcopy(result))
+    pool = _require_pool()
+    try:
+        await pool.execute(
+            """
+            INSERT INTO llm_cache (key, scenario, model, result)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (key) DO UPDATE
+            SET result = EXCLUDED.result, created_at = now()
+            """,
+            key, scenario, model, result,
+        )
+    except Exception as e:
+        logging.warning("llm cache write failed: %s", e)
+
+
+def invalidate_scenario(scenario: str) -> None:
+    """Выкинуть из LRU все записи сценария (таблицу чистит триггер на admin_scenarios)."""
+    for key in [k for k, (scn, _) in _lru.items() if scn == scenario]:
+        _lru.pop(key, None)
@@ -0,0 +1,218 @@
+# services/llm_context.py
+"""
+Контекст для промпта под конкретный сценарий.
+
+admin_scenarios.context_spec (jsonb, NULL = весь контекст как раньше):
+  {
+    "astro": ["planets", "pillars.day", ...],   -- пути в ASTRO_JSON (null = весь)
+    "facts": ["mission", "extra.finance", ...], -- поля FACTS (null = все, [] = без FACTS)
+    "summary": true,                            -- нужен ли SESSION_SUMMARY
+    "max_tokens": 2500                          -- бюджет на summary+FACTS+ASTRO_JSON
+  }
+
+Токены считаются локально (tiktoken; словари грузятся при старте — preload() в app.py, в образе они
+скачаны при сборке в TIKTOKEN_CACHE_DIR). Словарь не загрузился — оценка ~3 символа на токен.
+При превышении бюджета режем детерминированно: сначала summary, потом FACTS
+(с конца списка), потом ASTRO_JSON (с конца), пока не влезем.
+
+ASTRO_JSON сессии не меняется между кликами по меню, поэтому его сериализованный
+вид (и число токенов) кэшируется в памяти по (session_id, пути astro).
+"""
+import os
+import json
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import tiktoken
+
+LLM_CONTEXT_MAX_TOKENS = int(os.getenv("LLM_CONTEXT_MAX_TOKENS", "0"))  # 0 = без лимита
+LLM_PREFIX_CACHE_SIZE = int(os.getenv("LLM_PREFIX_CACHE_SIZE", "1024"))
+
+_CHARS_PER_TOKEN = 3
+
+# (session_id, astro paths, model) -> (raw ASTRO_JSON, отобранный объект, текст, токены)
+_astro_cache: "OrderedDict[tuple, tuple[Any, Any, str, int]]" = OrderedDict()
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # нет сети для загрузки словаря и т.п.
+        logging.warning("tiktoken unavailable (%s) → char estimate", e)
+        return None
+
+
+def preload(*models: Optional[str]) -> None:
+    """Загрузить словари для моделей заранее: первый запрос не ждёт чтения/скачивания словаря."""
+    for model in dict.fromkeys(m for m in models if m):
+        enc = _encoding(model)
+        logging.info("tokenizer for %s: %s", model, enc.name if enc is not None else "char estimate")
+
+
+def count_tokens(text: str, model: str) -> int:
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text))
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _truncate(text: str, max_tokens: int, model: str) -> str:
+    if max_tokens <= 0:
+        return ""
+    enc = _encoding(model)
+    if enc is not None:
+        ids = enc.encode(text)
+        return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+    return text[: max_tokens * _CHARS_PER_TOKEN]
+
+
+def dumps(obj: Any) -> str:
+    """Компактная сериализация для промпта (без пробелов — меньше токенов)."""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def parse_spec(raw: Any) -> Optional[Dict[str, Any]]:
+    if not isinstance(raw, dict):
+        return None
+
+    def _paths(v: Any) -> Optional[list[str]]:
+        if v is None:
+            return None
+        if isinstance(v, str):
+            v = [v]
+        return [str(p).strip() for p in v if str(p).strip()] if isinstance(v, list) else None
+
+    try:
+        max_tokens = int(raw.get("max_tokens") or 0)
+    except (TypeError, ValueError):
+        max_tokens = 0
+    return {
+        "astro": _paths(raw.get("astro")),
+        "facts": _paths(raw.get("facts")),
+        "summary": bool(raw.get("summary", True)),
+        "max_tokens": max_tokens,
+    }
+
+
+def merge_specs(specs: list[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Контекст для нескольких сценариев в одном запросе: объединение путей и полей.
+    None (весь контекст) у любого сценария — весь контекст у всех; бюджет — наибольший (0 = без лимита).
+    """
+    if not specs or any(s is None for s in specs):
+        return None
+
+    def _union(key: str) -> Optional[list[str]]:
+        if any(s[key] is None for s in specs):
+            return None
+        return list(dict.fromkeys(p for s in specs for p in s[key]))
+
+    budgets = [s["max_tokens"] for s in specs]
+    return {
+        "astro": _union("astro"),
+        "facts": _union("facts"),
+        "summary": any(s["summary"] for s in specs),
+        "max_tokens": 0 if 0 in budgets else max(budgets),
+    }
+
+
+def _pick(obj: Any, paths: Optional[list[str]]) -> Any:
+    """Оставить только перечисленные пути ("a", "a.b"); порядок — как в списке."""
+    if paths is None or not isinstance(obj, dict):
+        return obj
+    out: Dict[str, Any] = {}
+    for path in paths:
+        keys = path.split(".")
+        src, dst = obj, out
+        for k in keys[:-1]:
+            if not isinstance(src, dict) or k not in src:
+                break
+            src = src[k]
+            dst = dst.setdefault(k, {})
+        else:
+            if isinstance(src, dict) and keys[-1] in src:
+                dst[keys[-1]] = src[keys[-1]]
+    return out
+
+
+def _astro_block(session_id: Optional[int], raw: Any, paths: Optional[list[str]], model: str) -> tuple[Any, str, int]:
+    """Отобранный ASTRO_JSON, его текст и токены; для сессии — из кэша, пока raw_calc_json тот же."""
+    key = (session_id, tuple(paths) if paths is not None else None, model)
+    hit = _astro_cache.get(key) if session_id is not None else None
+    if hit is not None and hit[0] == raw:
+        _astro_cache.move_to_end(key)
+        return hit[1], hit[2], hit[3]
+    astro = _pick(raw, paths)
+    text = dumps(astro)
+    tokens = count_tokens(text, model)
+    if session_id is not None:
+        _astro_cache[key] = (raw, astro, text, tokens)
+        _astro_cache.move_to_end(key)
+        while len(_astro_cache) > LLM_PREFIX_CACHE_SIZE:
+            _astro_cache.popitem(last=False)
+    return astro, text, tokens
+
+
+def _drop_last(obj: Dict[str, Any]) -> bool:
+    if not obj:
+        return False
+    obj.pop(next(reversed(obj)))
+    return True
+
+
+def fit(
+    context: Dict[str, Any],
+    spec: Optional[Dict[str, Any]],
+    model: str,
+    session_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    context: {"astro_json", "facts", "summary"} из _build_context.
+    Возвращает {"astro", "facts", "summary", "astro_text", "facts_text", "tokens", "trimmed"}.
+    """
+    spec = spec or {"astro": None, "facts": None, "summary": True, "max_tokens": 0}
+
+    facts = dict(context.get("facts") or {})
+    if "extra" in facts:
+        facts["extra"] = facts["extra"] or {}
+    facts = {k: v for k, v in _pick(facts, spec["facts"]).items() if v not in (None, "", {}, [])}
+    astro, astro_text, astro_tokens = _astro_block(session_id, context.get("astro_json"), spec["astro"], model)
+    summary = (context.get("summary") or "") if spec["summary"] else ""
+
+    budget = spec["max_tokens"] or LLM_CONTEXT_MAX_TOKENS
+    facts_text = dumps(facts)
+    sizes = [count_tokens(summary, model), count_tokens(facts_text, model), astro_tokens]
+    trimmed = False
+
+    if budget and sum(sizes) > budget:
+        trimmed = True
+        summary = _truncate(summary, budget - sizes[1] - sizes[2], model)
+        sizes[0] = count_tokens(summary, model)
+        while sum(sizes) > budget and _drop_last(facts):
+            facts_text = dumps(facts)
+            sizes[1] = count_tokens(facts_text, model)
+        if isinstance(astro, dict):
+            astro = dict(astro)
+            while sum(sizes) > budget and _drop_last(astro):
+                astro_text = dumps(astro)
+                sizes[2] = count_tokens(astro_text, model)
+        if sum(sizes) > budget:
+            logging.warning("llm context still over budget: %s > %s", sum(sizes), budget)
+
+    return {
+        "astro": astro,
+        "facts": facts,
+        "summary": summary,
+        "astro_text": astro_text,
+        "facts_text": facts_text,
+        "tokens": sum(sizes),
+        "trimmed": trimmed,
+    }
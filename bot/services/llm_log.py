@@ -0,0 +1,130 @@
+# services/llm_log.py
+"""
+Буферизованная запись llm_messages.
+
+_log_llm больше не делает INSERT на каждое сообщение: строки копятся в памяти
+и уходят пачкой через COPY (copy_records_to_table) — по размеру буфера или по таймеру.
+Буфер ограничен: при переполнении строки отбрасываются и считаются в `dropped`.
+На shutdown (app.py) буфер дописывается.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from services.db import _require_pool
+
+LLM_LOG_MAX_BUFFER = int(os.getenv("LLM_LOG_MAX_BUFFER", "2000"))
+LLM_LOG_FLUSH_ROWS = int(os.getenv("LLM_LOG_FLUSH_ROWS", "200"))
+LLM_LOG_FLUSH_SEC = float(os.getenv("LLM_LOG_FLUSH_SEC", "2.0"))
+
+COLUMNS = (
+    "session_id", "role", "content", "scenario", "schema_ok",
+    "input_tokens", "output_tokens", "status", "latency_ms", "attempt", "retry_reason", "model",
+)
+_INSERT_SQL = (
+    f"INSERT INTO llm_messages ({', '.join(COLUMNS)}) "
+    f"VALUES ({', '.join(f'${i}' for i in range(1, len(COLUMNS) + 1))})"
+)
+
+
+async def insert_row(row: tuple) -> None:
+    """Одиночная вставка (без буфера)."""
+    await _require_pool().execute(_INSERT_SQL, *row)
+
+
+class LLMLogSink:
+    def __init__(self, max_buffer: int, flush_rows: int, flush_sec: float):
+        self.max_buffer = max_buffer
+        self.flush_rows = flush_rows
+        self.flush_sec = flush_sec
+        self._buf: list[tuple] = []
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._last_drop_log = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._closing
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run(), name="llm-log-sink")
+
+    async def stop(self) -> None:
+        """Останавливает фоновый флаш и дописывает остаток буфера."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+        await self.flush()
+        logging.info("llm log sink stopped: %s", self.stats())
+
+    def put(self, row: tuple) -> None:
+        if len(self._buf) >= self.max_buffer:
+            self.dropped += 1
+            now = time.monotonic()
+            if now - self._last_drop_log > 10:
+                self._last_drop_log = now
+                logging.warning("llm log buffer full (%s rows) → dropping, dropped=%s", self.max_buffer, self.dropped)
+            return
+        self._buf.append(row)
+        if len(self._buf) >= self.flush_rows:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_sec)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:  # фоновая задача не должна умирать
+                logging.warning("llm log flush failed: %s", e)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._buf:
+                return
+            rows, self._buf = self._buf, []
+            pool = _require_pool()
+            try:
+                async with pool.acquire() as conn:
+                    await conn.copy_records_to_table("llm_messages", records=rows, columns=COLUMNS)
+                self.written += len(rows)
+                return
+            except Exception as e:
+                logging.warning("llm log COPY of %s rows failed (%s) → row-by-row", len(rows), e)
+
+            # одна «плохая» строка не должна терять всю пачку
+            for row in rows:
+                try:
+                    await pool.execute(_INSERT_SQL, *row)
+                    self.written += 1
+                except Exception as e:
+                    self.failed += 1
+                    logging.warning("llm log row failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buf),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+sink = LLMLogSink(LLM_LOG_MAX_BUFFER, LLM_LOG_FLUSH_ROWS, LLM_LOG_FLUSH_SEC)
@@ -0,0 +1,210 @@
+# services/llm_repair.py
+"""
+Локальный ремонт ответа LLM по схеме сценария — до повторного запроса к модели.
+
+Большинство невалидных ответов ломаются одинаково и чинятся детерминированно за микросекунды:
+  - JSON в ```-блоке или с текстом до/после;
+  - не та обёртка: {"mission": "..."} вместо {"text": "..."}, {"result": {...}} вокруг ответа;
+  - лишние ключи при additionalProperties=false;
+  - голый список/строка вместо объекта, строка вместо списка (пункты по строкам) и наоборот, число строкой;
+  - maxItems превышен (обрезаем), minItems недобран, но пункты склеены в одну строку (делим).
+Недостающий контент не придумываем: если после правок схема не проходит — None,
+и _generate_json идёт к модели как раньше. Доля успешных ремонтов — метрика llm_repair_total.
+"""
+import os
+import re
+import json
+import time
+from typing import Any, Dict, Optional
+
+from services import llm_schema, metrics
+
+LLM_LOCAL_REPAIR = os.getenv("LLM_LOCAL_REPAIR", "1").strip().lower() in ("1", "true", "on", "yes")
+
+_FENCE_RE = re.compile(r"```[a-zA-Z]*\s*(.*?)```", re.S)
+_BULLET_RE = re.compile(r"^\s*(?:[-*•—]|\d+[.)])\s*")
+_decoder = json.JSONDecoder()
+_MAX_ROUNDS = 8
+_NO = object()
+
+_PY_TYPES = {
+    "string": str,
+    "array": list,
+    "object": dict,
+    "boolean": bool,
+    "integer": int,
+    "number": (int, float),
+}
+
+
+def extract_json(text: Optional[str]) -> Any:
+    """JSON из ответа модели: как есть, из ```-блока или первый объект/массив среди текста."""
+    if not text:
+        return None
+    s = text.strip()
+    fence = _FENCE_RE.search(s)
+    if fence:
+        s = fence.group(1).strip()
+    try:
+        return json.loads(s)
+    except ValueError:
+        pass
+    starts = [i for i in (s.find("{"), s.find("[")) if i >= 0]
+    if not starts:
+        return None
+    try:
+        obj, _ = _decoder.raw_decode(s, min(starts))  # хвостовой текст после JSON игнорируем
+        return obj
+    except ValueError:
+        return None
+
+
+def _is_type(value: Any, expected: Any) -> bool:
+    types = expected if isinstance(expected, list) else [expected]
+    for t in types:
+        py = _PY_TYPES.get(t)
+        if py is None:
+            continue
+        if t in ("integer", "number") and isinstance(value, bool):
+            continue
+        if isinstance(value, py):
+            return True
+    return False
+
+
+def _split_items(text: str) -> list[str]:
+    parts = [p for p in re.split(r"\n+|;\s*", text) if p.strip()]
+    return [_BULLET_RE.sub("", p).strip() for p in parts]
+
+
+def _coerce(value: Any, expected: Any) -> Any:
+    """Привести значение к ожидаемому типу схемы; _NO — не получилось."""
+    t = expected[0] if isinstance(expected, list) and expected else expected
+    if t == "string":
+        if isinstance(value, list) and all(isinstance(v, (str, int, float)) for v in value):
+            return "\n".join(str(v) for v in value)
+        if isinstance(value, dict):
+            strings = [str(v) for v in value.values() if isinstance(v, (str, int, float)) and str(v).strip()]
+            return " — ".join(strings) if strings else _NO
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+    if t == "array" and isinstance(value, str):
+        return _split_items(value)
+    if t in ("integer", "number") and isinstance(value, str):
+        try:
+            return int(value) if t == "integer" else float(value)
+        except ValueError:
+            return _NO
+    return _NO
+
+
+def _set(root: Any, path: list, value: Any) -> Any:
+    if not path:
+        return value
+    node = root
+    for key in path[:-1]:
+        node = node[key]
+    node[path[-1]] = value
+    return root
+
+
+def _fix_one(root: Any, err) -> tuple[Any, Optional[str]]:
+    """Исправить одну ошибку валидации. (новый корень, что сделано) или (root, None)."""
+    path = list(err.absolute_path)
+    inst = err.instance
+    kind = err.validator
+
+    if kind == "required" and isinstance(inst, dict):
+        props = err.schema.get("properties") or {}
+        for key in err.validator_value:
+            if key in inst:
+                continue
+            want = (props.get(key) or {}).get("type")
+            spare = [k for k in inst if k not in props]
+            fits = [k for k in spare if want is None or _is_type(inst[k], want)]
+            if len(fits) == 1:  # {"mission": "..."} вместо {"text": "..."}
+                inst[key] = inst.pop(fits[0])
+                return root, f"rename:{fits[0]}->{key}"
+            if len(spare) == 1 and want is not None and _coerce(inst[spare[0]], want) is not _NO:
+                inst[key] = _coerce(inst.pop(spare[0]), want)
+                return root, f"rename:{spare[0]}->{key}"
+            # {"result": {"text": ...}} — ответ завёрнут в лишний объект
+            nested = [v for v in inst.values() if isinstance(v, dict) and key in v]
+            if len(inst) == 1 and len(nested) == 1:
+                return _set(root, path, nested[0]), "unwrap"
+        return root, None
+
+    if kind == "additionalProperties" and err.validator_value is False and isinstance(inst, dict):
+        props = err.schema.get("properties") or {}
+        patterns = err.schema.get("patternProperties") or {}
+        extra = [k for k in inst if k not in props and not any(re.search(p, k) for p in patterns)]
+        for k in extra:
+            inst.pop(k)
+        return root, "drop_extra" if extra else None
+
+    if kind == "type":
+        if err.validator_value == "object" and isinstance(inst, (list, str)) and not path:
+            # голый список/строка вместо {"items": [...]} / {"text": "..."}
+            props = err.schema.get("properties") or {}
+            want = "array" if isinstance(inst, list) else "string"
+            slots = [k for k, sub in props.items() if (sub or {}).get("type") == want]
+            if len(slots) == 1:
+                return {slots[0]: inst}, f"wrap:{slots[0]}"
+            return root, None
+        new = _coerce(inst, err.validator_value)
+        if new is _NO:
+            return root, None
+        return _set(root, path, new), f"coerce:{err.validator_value}"
+
+    if kind == "maxItems" and isinstance(inst, list):
+        return _set(root, path, inst[: err.validator_value]), "truncate"
+
+    if kind == "minItems" and isinstance(inst, list):
+        flat = [p for item in inst for p in (_split_items(item) if isinstance(item, str) else [item])]
+        flat = [p for p in flat if p not in ("", None)]
+        if len(flat) >= err.validator_value:  # пункты были склеены в одну строку
+            return _set(root, path, flat), "split_items"
+        return root, None
+
+    return root, None
+
+
+def repair(text: Optional[str], scenario: str, schema: Dict[str, Any]) -> Any:
+    """
+    Починить ответ модели локально. Возвращает валидный по схеме объект или None.
+    Пустая схема — достаточно вытащить JSON-объект.
+    """
+    started = time.perf_counter()
+    data = extract_json(text)
+    fixes: list[str] = []
+    ok = False
+    if data is not None:
+        if not schema:
+            ok = isinstance(data, dict)
+        else:
+            validator = llm_schema.validator_for(scenario, schema)
+            for _ in range(_MAX_ROUNDS):
+                errors = sorted(validator.iter_errors(data), key=lambda e: -len(e.absolute_path))
+                if not errors:
+                    ok = True
+                    break
+                for err in errors:
+                    data, fix = _fix_one(data, err)
+                    if fix:
+                        fixes.append(fix)
+                        break
+                else:
+                    break  # ни одну ошибку не починить — к модели
+    metrics.observe("llm_repair_us", (time.perf_counter() - started) * 1e6,
+                    buckets=(10, 50, 100, 250, 500, 1000, 5000), scenario=scenario)
+    metrics.inc("llm_repair_total", scenario=scenario, result="ok" if ok else "fail")
+    for fix in fixes if ok else ():
+        metrics.inc("llm_repair_fixes_total", fix=fix.split(":")[0])
+    return data if ok else None
+
+
+def repair_rate(**labels: Any) -> float:
+    """Доля ответов, починенных локально (из тех, что пришлось чинить)."""
+    ok = metrics.counter("llm_repair_total", result="ok", **labels)
+    total = ok + metrics.counter("llm_repair_total", result="fail", **labels)
+    return ok / total if total else 0.0
@@ -0,0 +1,250 @@
+# services/llm_scheduler.py
+"""
+Планировщик запросов к LLM (один на процесс).
+
+- ограничивает число одновременных запросов (LLM_MAX_INFLIGHT);
+- держит token bucket'ы на RPM и TPM, подстраивает их по заголовкам x-ratelimit-*;
+- после 429 ставит всю очередь на паузу (retry-after), а не плодит ретраи;
+- очередь честная: внутри одного приоритета пользователи (tg_id) обслуживаются по кругу;
+- приоритеты: онбординг (strengths/weaknesses) < обычный клик < перегенерация < предгенерация.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Hashable, Mapping, Optional
+
+PRIORITY_ONBOARDING = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_REGEN = 2
+PRIORITY_PREFETCH = 3
+
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "8"))
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SEC = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(val: Optional[str]) -> Optional[float]:
+    """'1s' / '6m0s' / '20ms' / '0.5' (retry-after) -> секунды."""
+    if not val:
+        return None
+    val = val.strip()
+    try:
+        return float(val)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(val)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SEC[u] for n, u in parts)
+
+
+def _as_float(val: Optional[str]) -> Optional[float]:
+    try:
+        return float(val) if val is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Ведро на «единицы в минуту»; уровень может уйти в минус, если фактический расход больше оценки."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, per_minute)
+        self.level = self.capacity
+        self._at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._at) * self.capacity / 60.0)
+        self._at = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        need = min(amount, self.capacity) - self.level
+        return 0.0 if need <= 0 else need * 60.0 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def sync(self, limit: Optional[float], remaining: Optional[float]) -> None:
+        """Подстройка по ответу провайдера: его счётчик точнее нашего."""
+        self._refill()
+        if limit:
+            self.capacity = max(1.0, limit)
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+
+
+class _Waiter:
+    __slots__ = ("fut", "tokens")
+
+    def __init__(self, fut: asyncio.Future, tokens: float):
+        self.fut = fut
+        self.tokens = tokens
+
+
+class LLMScheduler:
+    def __init__(self, max_inflight: int, rpm: float, tpm: float):
+        self.max_inflight = max(1, max_inflight)
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.inflight = 0
+        self._paused_until = 0.0
+        # priority -> OrderedDict[user_key, deque[_Waiter]] (круг по пользователям)
+        self._queues: dict[int, "OrderedDict[Hashable, deque[_Waiter]]"] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    # ---- очередь ----
+
+    def queued(self) -> int:
+        return sum(len(q) for users in self._queues.values() for q in users.values())
+
+    def _drop(self, priority: int, user_key: Hashable, w: _Waiter) -> None:
+        """Отменённое ожидание — из очереди сразу, чтобы queued()/try_take его не считали."""
+        users = self._queues.get(priority)
+        q = users.get(user_key) if users is not None else None
+        if q is None:
+            return
+        try:
+            q.remove(w)
+        except ValueError:
+            return
+        if not q:
+            users.pop(user_key)
+            if not users:
+                self._queues.pop(priority)
+
+    def _next_waiter(self, peek: bool) -> Optional[_Waiter]:
+        for prio in sorted(self._queues):
+            users = self._queues[prio]
+            while users:
+                user, q = next(iter(users.items()))
+                while q and q[0].fut.done():  # отменённые ожидания
+                    q.popleft()
+                if not q:
+                    users.pop(user)
+                    continue
+                if peek:
+                    return q[0]
+                w = q.popleft()
+                users.pop(user)
+                if q:
+                    users[user] = q  # в конец круга
+                return w
+            self._queues.pop(prio, None)
+        return None
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._pump()
+
+    def _arm(self, wait: float) -> None:
+        """Один таймер на планировщик: уже взведённый не позже нужного (с точностью до 1 мс) оставляем, иначе переносим."""
+        loop = asyncio.get_running_loop()
+        if self._timer is not None:
+            if self._timer.when() <= loop.time() + wait + 0.001:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_later(wait, self._on_timer)
+
+    def _pump(self) -> None:
+        while self.inflight < self.max_inflight:
+            w = self._next_waiter(peek=True)
+            if w is None:
+                return
+            wait = max(
+                self._paused_until - time.monotonic(),
+                self.rpm.wait_time(1),
+                self.tpm.wait_time(w.tokens),
+            )
+            if wait > 0:
+                self._arm(wait)
+                return
+            w = self._next_waiter(peek=False)
+            self.rpm.take(1)
+            self.tpm.take(w.tokens)
+            self.inflight += 1
+            w.fut.set_result(None)
+
+    def _release(self, reserved: float, used: Optional[float]) -> None:
+        self.inflight -= 1
+        if used is not None:
+            self.tpm.take(used - reserved)
+        self._pump()
+
+    @asynccontextmanager
+    async def slot(self, user_key: Hashable, priority: int = PRIORITY_INTERACTIVE, est_tokens: float = 1000):
+        """
+        Ждём своей очереди и держим слот на время HTTP-запроса.
+        Фактический расход токенов можно сообщить через slot["used_tokens"].
+        """
+        fut = asyncio.get_running_loop().create_future()
+        w = _Waiter(fut, est_tokens)
+        users = self._queues.setdefault(priority, OrderedDict())
+        users.setdefault(user_key, deque()).append(w)
+        self._pump()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(est_tokens, 0)  # слот уже выдан, но не использован
+            else:
+                self._drop(priority, user_key, w)
+                self._pump()  # отменённый мог быть первым в очереди и держать остальных
+            raise
+        info: dict[str, Any] = {"used_tokens": None}
+        try:
+            yield info
+        finally:
+            self._release(est_tokens, info["used_tokens"])
+
+    def try_take(self, tokens: float) -> bool:
+        """
+        Взять RPM/TPM без ожидания (дополнительный запрос внутри уже выданного слота — hedging).
+        False — пауза после 429, в очереди кто-то ждёт или в ведре нет места.
+        """
+        if self._paused_until > time.monotonic() or self.queued():
+            return False
+        if self.rpm.wait_time(1) > 0 or self.tpm.wait_time(tokens) > 0:
+            return False
+        self.rpm.take(1)
+        self.tpm.take(tokens)
+        return True
+
+    # ---- обратная связь от провайдера ----
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        self.rpm.sync(
+            _as_float(headers.get("x-ratelimit-limit-requests")),
+            _as_float(headers.get("x-ratelimit-remaining-requests")),
+        )
+        self.tpm.sync(
+            _as_float(headers.get("x-ratelimit-limit-tokens")),
+            _as_float(headers.get("x-ratelimit-remaining-tokens")),
+        )
+
+    def pause_for(self, headers: Mapping[str, str], default: float = 1.0) -> float:
+        """429: ставим всю очередь на паузу до сброса лимита. Возвращает длительность паузы."""
+        delay = (
+            parse_duration(headers.get("retry-after"))
+            or max(
+                parse_duration(headers.get("x-ratelimit-reset-requests")) or 0.0,
+                parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0.0,
+            )
+            or default
+        )
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logging.warning("LLM rate limited → queue paused for %.2fs (inflight=%s queued=%s)",
+                        delay, self.inflight, self.queued())
+        return delay
+
+
+scheduler = LLMScheduler(LLM_MAX_INFLIGHT, LLM_RPM, LLM_TPM)
@@ -0,0 +1,75 @@
+# services/llm_schema.py
+"""
+JSON-схемы сценариев: разбор и скомпилированные валидаторы.
+
+jsonschema.validate(data, schema) на каждый вызов заново проверяет саму схему и
+собирает валидатор. Здесь валидатор (Draft*Validator под $schema, по умолчанию 2020-12)
+строится один раз на (scenario, sha256 схемы) и переиспользуется; правка схемы в админке
+даёт новый хэш, и старый валидатор сценария выбрасывается.
+"""
+import json
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+from jsonschema import Draft202012Validator, validators
+
+# scenario -> (schema_hash, schema_obj, validator)
+_validators: Dict[str, tuple[str, Any, Any]] = {}
+
+
+def coerce_schema(schema_raw: Any) -> Dict[str, Any]:
+    """
+    schema_json из БД → dict. jsonb декодирует кодек пула (services/pg_json.py), так что обычно
+    это уже dict; строка — старые строки, где схема лежала jsonb-строкой с JSON внутри.
+    """
+    if isinstance(schema_raw, dict):
+        return schema_raw
+    if isinstance(schema_raw, str):
+        try:
+            parsed = json.loads(schema_raw)
+            if isinstance(parsed, dict):
+                return parsed
+        except ValueError:
+            pass
+    if schema_raw:
+        logging.warning("json_schema parse failed, fallback to {}. Raw: %r", str(schema_raw)[:120])
+    return {}
+
+
+def schema_hash(schema: Dict[str, Any]) -> str:
+    canon = json.dumps(schema, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+def validator_for(scenario: str, schema: Dict[str, Any]):
+    """Скомпилированный валидатор схемы сценария (check_schema — один раз)."""
+    hit = _validators.get(scenario)
+    if hit is not None and hit[1] is schema:  # тот же объект схемы (каталог сценариев) — без хэширования
+        return hit[2]
+    digest = schema_hash(schema)
+    if hit is not None and hit[0] == digest:
+        _validators[scenario] = (digest, schema, hit[2])
+        return hit[2]
+    cls = validators.validator_for(schema, default=Draft202012Validator)
+    cls.check_schema(schema)
+    validator = cls(schema)
+    _validators[scenario] = (digest, schema, validator)
+    return validator
+
+
+def merge_schemas(parts: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Общая схема ответа на несколько сценариев: {scenario: <ответ по схеме сценария>}."""
+    return {
+        "type": "object",
+        "required": list(parts),
+        "properties": {code: (schema or {"type": "object"}) for code, schema in parts.items()},
+    }
+
+
+def invalidate(scenario: Optional[str] = None) -> None:
+    """Сбросить валидатор сценария (или все) — например, после правки admin_scenarios."""
+    if scenario is None:
+        _validators.clear()
+    else:
+        _validators.pop(scenario, None)
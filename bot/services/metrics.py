@@ -0,0 +1,123 @@
+# services/metrics.py
+"""
+Метрики процесса в памяти: счётчики и гистограммы с метками.
+
+    metrics.inc("llm_requests_total", scenario="mission", status="200")
+    metrics.observe("llm_latency_ms", 1234, scenario="mission")
+
+Снимок — snapshot(), текстовый отчёт — render() (команда /stats у владельца бота).
+"""
+import bisect
+from typing import Any, Dict, Iterable, Tuple
+
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (
+    50, 100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000, 60000,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_counters: Dict[str, Dict[Labels, float]] = {}
+_hists: Dict[str, Dict[Labels, "Histogram"]] = {}
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Iterable[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # последний — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по корзинам: верхняя граница корзины, где набралась доля q."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 1) if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 1),
+        }
+
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    series = _counters.setdefault(name, {})
+    key = _labels(labels)
+    series[key] = series.get(key, 0) + value
+
+
+def observe(name: str, value: float, buckets: Iterable[float] = LATENCY_BUCKETS_MS, **labels: Any) -> None:
+    series = _hists.setdefault(name, {})
+    key = _labels(labels)
+    h = series.get(key)
+    if h is None:
+        h = series[key] = Histogram(buckets)
+    h.observe(value)
+
+
+def counter(name: str, **labels: Any) -> float:
+    """Сумма счётчика по всем сериям, подходящим под указанные метки."""
+    want = set(_labels(labels))
+    return sum(v for k, v in _counters.get(name, {}).items() if want <= set(k))
+
+
+def histogram(name: str, **labels: Any) -> "Histogram | None":
+    return _hists.get(name, {}).get(_labels(labels))
+
+
+def snapshot() -> Dict[str, Any]:
+    return {
+        "counters": {
+            name: {",".join(f"{k}={v}" for k, v in key): val for key, val in series.items()}
+            for name, series in _counters.items()
+        },
+        "histograms": {
+            name: {",".join(f"{k}={v}" for k, v in key): h.summary() for key, h in series.items()}
+            for name, series in _hists.items()
+        },
+    }
+
+
+def render() -> str:
+    lines: list[str] = []
+    snap = snapshot()
+    for name in sorted(snap["counters"]):
+        lines.append(name)
+        for key, val in sorted(snap["counters"][name].items()):
+            lines.append(f"  {key or '-'}: {val:g}")
+    for name in sorted(snap["histograms"]):
+        lines.append(name)
+        for key, s in sorted(snap["histograms"][name].items()):
+            lines.append(
+                f"  {key or '-'}: n={s['count']} avg={s['avg']} "
+                f"p50={s['p50']:g} p95={s['p95']:g} p99={s['p99']:g} max={s['max']}"
+            )
+    return "\n".join(lines) or "нет данных"
+
+
+def reset() -> None:
+    _counters.clear()
+    _hists.clear()
@@ -0,0 +1,36 @@
+# services/pg_json.py
+"""
+Кодеки json/jsonb для asyncpg: в запросы передаём dict/list, из запросов получаем dict/list.
+
+Без кодека asyncpg отдаёт jsonb строкой, а на запись ждёт строку — отсюда json.dumps перед
+каждым $n::jsonb и повторные json.loads на чтении (ASTRO_JSON, факты, схемы сценариев).
+Кодек ставится на каждое соединение init-хуком пула (app.py):
+
+    pool = await db_pool.create_pool(db_url, init=pg_json.init_connection)
+
+Если установлен orjson — (де)сериализация через него: ASTRO_JSON и факты — самые крупные значения.
+"""
+import json
+from typing import Any
+
+import asyncpg
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(s: str) -> Any:
+    return orjson.loads(s) if orjson is not None else json.loads(s)
+
+
+async def init_connection(conn: asyncpg.Connection) -> None:
+    for typename in ("jsonb", "json"):
+        await conn.set_type_codec(typename, schema="pg_catalog", encoder=dumps, decoder=loads, format="text")
@@ -0,0 +1,86 @@
+# services/pg_listen.py
+"""
+LISTEN на отдельном соединении: один коннект на процесс, несколько каналов.
+
+    pg_listen.subscribe("admin_settings_changed", on_change)   # on_change(payload: str | None)
+    pg_listen.start() / await pg_listen.stop()
+
+Соединение из пула для LISTEN не годится: пул отдаёт его другим запросам. Поэтому — свой
+asyncpg.connect(DATABASE_URL), как у singleflight. При обрыве переподключаемся через
+PG_LISTEN_RECONNECT_SEC и вызываем всех подписчиков с payload=None: уведомления, пришедшие
+без LISTEN, потеряны — подписчик должен перечитать своё состояние целиком.
+"""
+import os
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+import asyncpg
+
+from services import metrics
+
+PG_LISTEN_RECONNECT_SEC = float(os.getenv("PG_LISTEN_RECONNECT_SEC", "5"))
+
+OnNotify = Callable[[Optional[str]], None]
+
+_subs: Dict[str, List[OnNotify]] = {}
+_task: asyncio.Task | None = None
+
+
+def subscribe(channel: str, callback: OnNotify) -> None:
+    """Подписка до start(); колбэк синхронный и быстрый (обычно — запланировать перечитывание)."""
+    _subs.setdefault(channel, []).append(callback)
+
+
+def _dispatch(channel: str, payload: Optional[str]) -> None:
+    metrics.inc("pg_notify_total", channel=channel, kind="notify" if payload is not None else "resync")
+    for cb in _subs.get(channel, ()):
+        try:
+            cb(payload)
+        except Exception as e:
+            logging.warning("pg_listen %s callback failed: %s", channel, e)
+
+
+def _on_notify(conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+    _dispatch(channel, payload)
+
+
+async def _run() -> None:
+    db_url = os.environ.get("DATABASE_URL", "postgresql://app:app@db:5432/appdb")
+    while True:
+        conn: Optional[asyncpg.Connection] = None
+        try:
+            conn = await asyncpg.connect(db_url)
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _c: lost.set())
+            for channel in _subs:
+                await conn.add_listener(channel, _on_notify)
+            for channel in _subs:
+                _dispatch(channel, None)  # что пропустили, пока не слушали
+            await lost.wait()
+            logging.warning("pg_listen connection lost, reconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning("pg_listen failed: %s", e)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(PG_LISTEN_RECONNECT_SEC)
+
+
+def start() -> None:
+    global _task
+    if _subs and (_task is None or _task.done()):
+        _task = asyncio.create_task(_run(), name="pg-listen")
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
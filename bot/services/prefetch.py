@@ -0,0 +1,169 @@
+# services/prefetch.py
+"""
+Фоновая предгенерация разделов меню после расчёта карты.
+
+Какие сценарии готовить — по истории: доля сессий, в которых сценарий открывали
+(session_facts_versions за LLM_PREFETCH_WINDOW_DAYS, без «непросмотренных» предгенераций).
+Генерации идут с самым низким приоритетом планировщика, не больше
+LLM_PREFETCH_CONCURRENCY одновременно и не больше LLM_PREFETCH_DAILY_LIMIT в сутки (потолок расходов).
+Результат пишется в session_facts тем же путём, что и клик, — menu_* отдаёт его из БД без LLM.
+Сценарии из LLM_COMBINED_SCENARIOS готовятся одним запросом (см. llm.run_scenarios).
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterable
+
+from services.db import _require_pool
+from services import metrics, singleflight
+from services.llm import LLM_COMBINED_SCENARIOS
+
+LLM_PREFETCH_ENABLED = os.getenv("LLM_PREFETCH_ENABLED", "1").strip().lower() in ("1", "true", "on", "yes")
+LLM_PREFETCH_TOP = int(os.getenv("LLM_PREFETCH_TOP", "3"))
+LLM_PREFETCH_MIN_SHARE = float(os.getenv("LLM_PREFETCH_MIN_SHARE", "0.2"))
+LLM_PREFETCH_WINDOW_DAYS = int(os.getenv("LLM_PREFETCH_WINDOW_DAYS", "14"))
+LLM_PREFETCH_DAILY_LIMIT = int(os.getenv("LLM_PREFETCH_DAILY_LIMIT", "300"))
+LLM_PREFETCH_CONCURRENCY = int(os.getenv("LLM_PREFETCH_CONCURRENCY", "2"))
+
+SOURCE_PREFETCH = "prefetch"            # версия создана предгенерацией и ещё не открыта
+SOURCE_PREFETCH_USED = "prefetch_used"  # предгенерацию открыли — считается как клик
+
+_RANK_TTL = 600.0
+_PENDING_MAX = 10000
+
+_rank_cache: tuple[float, list[tuple[str, float]]] = (0.0, [])
+_spent_day: str = ""
+_spent = 0
+_sem: asyncio.Semaphore | None = None
+_tasks: dict[int, asyncio.Task] = {}
+_pending: dict[tuple[int, str], None] = {}  # (session_id, scenario) — готово, но ещё не открыто
+
+Worker = Callable[[list[str]], Awaitable[object]]
+
+
+async def ranked_scenarios() -> list[tuple[str, float]]:
+    """[(scenario, доля сессий)] по убыванию; кэшируется на _RANK_TTL."""
+    global _rank_cache
+    ts, ranked = _rank_cache
+    if time.monotonic() - ts < _RANK_TTL:
+        return ranked
+
+    pool = _require_pool()
+    rows = await pool.fetch(
+        """
+        WITH opened AS (
+            SELECT v.session_id, v.scenario
+            FROM session_facts_versions v
+            WHERE v.created_at > now() - make_interval(days => $1)
+              AND v.source IS DISTINCT FROM $2
+        )
+        SELECT o.scenario,
+               count(DISTINCT o.session_id)::float
+                 / GREATEST((SELECT count(DISTINCT session_id) FROM opened), 1) AS share
+        FROM opened o
+        JOIN admin_scenarios s ON s.scenario = o.scenario AND s.enabled
+        GROUP BY o.scenario
+        ORDER BY share DESC, o.scenario
+        """,
+        LLM_PREFETCH_WINDOW_DAYS, SOURCE_PREFETCH,
+    )
+    ranked = [(r["scenario"], float(r["share"])) for r in rows]
+    _rank_cache = (time.monotonic(), ranked)
+    return ranked
+
+
+def _take_budget() -> bool:
+    global _spent_day, _spent
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if day != _spent_day:
+        _spent_day, _spent = day, 0
+    if _spent >= LLM_PREFETCH_DAILY_LIMIT:
+        return False
+    _spent += 1
+    return True
+
+
+def _groups(codes: list[str]) -> list[list[str]]:
+    """Сценарии из LLM_COMBINED_SCENARIOS — одной группой (один запрос), остальные — по одному."""
+    combined = [c for c in codes if c in LLM_COMBINED_SCENARIOS]
+    rest = [[c] for c in codes if c not in LLM_COMBINED_SCENARIOS]
+    return ([combined] if combined else []) + rest
+
+
+async def _run(session_id: int, skip: set[str], worker: Worker) -> None:
+    global _sem
+    if _sem is None:
+        _sem = asyncio.Semaphore(max(1, LLM_PREFETCH_CONCURRENCY))
+    try:
+        ranked = await ranked_scenarios()
+    except Exception as e:
+        logging.warning("prefetch ranking failed: %s", e)
+        return
+    codes = [c for c, share in ranked if share >= LLM_PREFETCH_MIN_SHARE and c not in skip]
+    codes = codes[:LLM_PREFETCH_TOP]
+    for group in _groups(codes):
+        group = [c for c in group if _take_budget()]
+        if not group:
+            metrics.inc("llm_prefetch_total", status="budget")
+            logging.info("prefetch daily limit reached (%s)", LLM_PREFETCH_DAILY_LIMIT)
+            return
+        async with _sem:
+            try:
+                await worker(group)
+                for code in group:
+                    _pending[(session_id, code)] = None
+                    metrics.inc("llm_prefetch_total", scenario=code, status="ok")
+                while len(_pending) > _PENDING_MAX:
+                    _pending.pop(next(iter(_pending)))
+            except asyncio.CancelledError:
+                raise
+            except singleflight.Preempted:
+                # пользователь открыл раздел раньше — генерирует его сам, с приоритетом клика
+                for code in group:
+                    metrics.inc("llm_prefetch_total", scenario=code, status="preempted")
+                logging.info("prefetch %s for session %s preempted by a click", group, session_id)
+            except Exception as e:
+                for code in group:
+                    metrics.inc("llm_prefetch_total", scenario=code, status="error")
+                logging.warning("prefetch %s for session %s failed: %s", group, session_id, e)
+
+
+def schedule(session_id: int, skip: Iterable[str], worker: Worker) -> None:
+    """
+    Запустить предгенерацию для сессии в фоне (не ждём).
+    skip — уже готовые сценарии (первый экран); worker(codes) генерирует и сохраняет сценарии.
+    """
+    if not LLM_PREFETCH_ENABLED or LLM_PREFETCH_TOP <= 0:
+        return
+    cancel(session_id)
+    task = asyncio.create_task(_run(session_id, set(skip), worker), name=f"prefetch-{session_id}")
+    _tasks[session_id] = task
+    task.add_done_callback(lambda t: _tasks.pop(session_id, None) if _tasks.get(session_id) is t else None)
+
+
+def cancel(session_id: int) -> None:
+    """Сессию сбросили — недоделанная предгенерация больше не нужна."""
+    task = _tasks.pop(session_id, None)
+    if task is not None and not task.done():
+        task.cancel()
+    for key in [k for k in _pending if k[0] == session_id]:
+        _pending.pop(key, None)
+
+
+async def note_open(session_id: int, scenario: str) -> None:
+    """Пользователь открыл раздел: если он был предгенерирован — засчитываем как клик для ранжирования."""
+    if _pending.pop((session_id, scenario), False) is False:
+        return
+    metrics.inc("llm_prefetch_hits_total", scenario=scenario)
+    try:
+        await _require_pool().execute(
+            """
+            UPDATE session_facts_versions SET source = $3
+            WHERE session_id = $1 AND scenario = $2 AND is_active AND source = $4
+            """,
+            session_id, scenario, SOURCE_PREFETCH_USED, SOURCE_PREFETCH,
+        )
+    except Exception as e:
+        logging.warning("prefetch note_open failed: %s", e)
@@ -0,0 +1,159 @@
+# services/scenario_catalog.py
+"""
+Каталог сценариев admin_scenarios в памяти процесса.
+
+_get_scenario (llm.py), list_enabled_scenarios (db.py) и _scenario_title (handlers.py) раньше ходили
+в admin_scenarios на каждую генерацию и каждое меню. Теперь таблица читается целиком в неизменяемый
+Catalog: промпт, разобранная схема, скомпилированный валидатор, context_spec, модель/бюджет, заголовок
+и флаг enabled. Версия каталога растёт при каждом изменении содержимого.
+Обновление — как у services/admin_settings.py: триггер (миграция 020) шлёт NOTIFY admin_scenarios_changed
+при сохранении в web-админке, services/pg_listen.py перечитывает каталог; страховка — SCENARIO_CATALOG_TTL_SEC.
+При перезагрузке изменённые/удалённые сценарии сбрасывают свои валидаторы (llm_schema.invalidate)
+и LRU кэша ответов (llm_cache.invalidate_scenario; таблицу llm_cache чистит триггер из 013).
+"""
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional
+
+from services import llm_cache, llm_context, llm_schema, metrics, pg_listen
+from services.db import _require_pool
+
+SCENARIO_CATALOG_TTL_SEC = float(os.getenv("SCENARIO_CATALOG_TTL_SEC", "300"))
+SCENARIO_CATALOG_CHANNEL = "admin_scenarios_changed"
+
+
+@dataclass(frozen=True)
+class Scenario:
+    code: str
+    title: str
+    enabled: bool
+    prompt: str
+    schema: Dict[str, Any]              # разобранная schema_json ({} — без строгой проверки)
+    validator: Any                      # скомпилированный валидатор; None — схема пустая или битая
+    spec: Optional[Dict[str, Any]]      # context_spec (llm_context.parse_spec)
+    model: Optional[str]                # NULL в admin_scenarios — глобальные настройки (llm.LLMParams)
+    temperature: Optional[float]
+    max_output_tokens: Optional[int]
+    schema_hash: str
+
+
+@dataclass(frozen=True)
+class Catalog:
+    version: int
+    scenarios: Dict[str, Scenario]
+    enabled: tuple                      # включённые, по code — порядок кнопок меню
+
+    def get(self, code: str) -> Optional[Scenario]:
+        return self.scenarios.get(code)
+
+
+_catalog: Optional[Catalog] = None
+_loaded_at = 0.0
+_refresh_task: asyncio.Task | None = None
+
+
+def _build(row: Any) -> Scenario:
+    code = row["scenario"]
+    schema = llm_schema.coerce_schema(row["schema_json"])
+    return Scenario(
+        code=code,
+        title=row["title"] or code,
+        enabled=bool(row["enabled"]),
+        prompt=row["prompt_template"] or "",
+        schema=schema,
+        validator=None,
+        spec=llm_context.parse_spec(row["context_spec"]),
+        model=row["model"],
+        temperature=row["temperature"],
+        max_output_tokens=row["max_output_tokens"],
+        schema_hash=llm_schema.schema_hash(schema),
+    )
+
+
+def _changed(old: Scenario, new: Scenario) -> bool:
+    return (old.prompt, old.schema_hash, old.spec, old.model, old.temperature, old.max_output_tokens) != (
+        new.prompt, new.schema_hash, new.spec, new.model, new.temperature, new.max_output_tokens
+    )
+
+
+async def refresh(reason: str = "load") -> Catalog:
+    """Перечитать admin_scenarios. Ошибка БД — остаётся прежний каталог."""
+    global _catalog, _loaded_at
+    _loaded_at = time.monotonic()  # и при ошибке: повтор — через TTL, а не на каждом чтении
+    try:
+        rows = await _require_pool().fetch(
+            """
+            SELECT scenario, title, enabled,
+                   COALESCE(prompt_template, '')      AS prompt_template,
+                   COALESCE(schema_json, '{}'::jsonb) AS schema_json,
+                   context_spec, model, temperature, max_output_tokens
+            FROM admin_scenarios
+            ORDER BY scenario
+            """
+        )
+    except Exception as e:
+        logging.warning("scenario catalog reload (%s) failed: %s", reason, e)
+        metrics.inc("scenario_catalog_reload_total", reason="error")
+        if _catalog is None:
+            raise
+        return _catalog
+
+    fresh = {r["scenario"]: _build(r) for r in rows}
+    old = _catalog.scenarios if _catalog is not None else {}
+    stale = [c for c in old if c not in fresh or _changed(old[c], fresh[c])]
+    for code in stale:
+        llm_schema.invalidate(code)
+        llm_cache.invalidate_scenario(code)
+    for code, sc in fresh.items():
+        if code in old and code not in stale:
+            fresh[code] = replace(sc, schema=old[code].schema, validator=old[code].validator)
+        elif sc.schema:
+            try:
+                fresh[code] = replace(sc, validator=llm_schema.validator_for(code, sc.schema))
+            except Exception as e:  # битая схема не должна ронять весь каталог
+                logging.warning("scenario %s: invalid schema_json: %s", code, getattr(e, "message", e))
+    same = _catalog is not None and not stale and old.keys() == fresh.keys() and all(
+        (old[c].title, old[c].enabled) == (fresh[c].title, fresh[c].enabled) for c in fresh
+    )
+    if same:
+        metrics.inc("scenario_catalog_reload_total", reason=reason, changed="0")
+        return _catalog
+
+    version = (_catalog.version if _catalog is not None else 0) + 1
+    _catalog = Catalog(
+        version=version,
+        scenarios=fresh,
+        enabled=tuple(s for s in fresh.values() if s.enabled),
+    )
+    metrics.inc("scenario_catalog_reload_total", reason=reason, changed="1")
+    logging.info("scenario catalog v%s (%s): %s scenarios, changed=%s", version, reason, len(fresh), stale)
+    return _catalog
+
+
+def _schedule(reason: str) -> None:
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(refresh(reason), name="scenario-catalog-refresh")
+
+
+def _on_notify(payload: Optional[str]) -> None:
+    _schedule("notify" if payload is not None else "resync")
+
+
+async def get() -> Catalog:
+    """Текущий каталог; первый вызов загружает, устаревший (TTL) — обновляется в фоне."""
+    if _catalog is None:
+        return await refresh()
+    if time.monotonic() - _loaded_at > SCENARIO_CATALOG_TTL_SEC:
+        _schedule("ttl")
+    return _catalog
+
+
+async def get_scenario(code: str) -> Optional[Scenario]:
+    return (await get()).get(code)
+
+
+pg_listen.subscribe(SCENARIO_CATALOG_CHANNEL, _on_notify)
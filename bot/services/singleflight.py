@@ -0,0 +1,181 @@
+# services/singleflight.py
+"""
+Single-flight: одновременные запросы с одинаковым ключом делят одну работу.
+
+Двойной тап по кнопке меню или «♻️ Пересчитать», пока генерация ещё идёт, не запускают
+вторую генерацию — все ждут первую и получают тот же результат (копию).
+Работа идёт отдельной задачей: если первый ожидающий отменён, остальные всё равно дождутся.
+
+Приоритет (как у планировщика LLM: меньше — важнее): к фоновой работе (priority ≥ preempt_from)
+вызов важнее неё не присоединяется — фоновая отменяется (её ожидающие получают Preempted),
+запускается своя. Иначе клик ждал бы в очереди планировщика с приоритетом предгенерации.
+do_many — одна работа на несколько ключей (комбинированный запрос): do() по любому из них ждёт её.
+
+SINGLEFLIGHT_PG_LOCK=1 — вариант для нескольких реплик бота: ведущий держит
+pg_advisory_lock по ключу на отдельном соединении; реплика, которой лок не достался,
+ждёт его освобождения и вызывает fn(waited=True) — например, чтобы взять результат из кэша.
+"""
+import os
+import copy
+import asyncio
+import logging
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+import asyncpg
+
+from services import metrics
+
+SINGLEFLIGHT_PG_LOCK = os.getenv("SINGLEFLIGHT_PG_LOCK", "0").strip().lower() in ("1", "true", "on", "yes")
+SINGLEFLIGHT_LOCK_POLL_SEC = float(os.getenv("SINGLEFLIGHT_LOCK_POLL_SEC", "0.25"))
+
+# fn(waited) — waited=True, если пришлось ждать чужую реплику
+Work = Callable[[bool], Awaitable[Any]]
+# fn(keys) — работа по нескольким ключам, возвращает {key: результат}
+ManyWork = Callable[[list], Awaitable[Dict[Hashable, Any]]]
+
+
+class Preempted(Exception):
+    """Работу отменил более важный вызов с тем же ключом — результат будет у него."""
+
+_lock_conn: Optional[asyncpg.Connection] = None
+_lock_conn_guard = asyncio.Lock()
+
+
+async def _lock_query(sql: str, key: str) -> Any:
+    """Один общий коннект для advisory-локов (сессионные локи живут на соединении)."""
+    global _lock_conn
+    async with _lock_conn_guard:
+        if _lock_conn is None or _lock_conn.is_closed():
+            db_url = os.environ.get("DATABASE_URL", "postgresql://app:app@db:5432/appdb")
+            _lock_conn = await asyncpg.connect(db_url)
+        return await _lock_conn.fetchval(sql, key)
+
+
+async def close() -> None:
+    global _lock_conn
+    if _lock_conn is not None and not _lock_conn.is_closed():
+        await _lock_conn.close()
+    _lock_conn = None
+
+
+class _Call:
+    __slots__ = ("task", "priority", "multi")
+
+    def __init__(self, task: asyncio.Task, priority: Optional[int], multi: bool):
+        self.task = task
+        self.priority = priority
+        self.multi = multi  # результат — {key: значение} (do_many)
+
+
+class SingleFlight:
+    def __init__(self, name: str, *, preempt_from: Optional[int] = None):
+        self.name = name
+        self.preempt_from = preempt_from  # работу с priority ≥ preempt_from может отменить вызов важнее; None — никогда
+        self._calls: Dict[Hashable, _Call] = {}
+        self._preempted: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+    def inflight(self) -> int:
+        return len({id(c.task) for c in self._calls.values()})
+
+    def _joinable(self, key: Hashable, priority: Optional[int]) -> Optional[_Call]:
+        """Идущая работа по ключу, к которой можно присоединиться; менее важная — отменяется."""
+        call = self._calls.get(key)
+        if call is None:
+            return None
+        if (
+            self.preempt_from is None or priority is None or call.priority is None
+            or call.priority < self.preempt_from or priority >= call.priority
+        ):
+            return call
+        logging.info("singleflight %s: %r preempted (priority %s → %s)", self.name, key, call.priority, priority)
+        metrics.inc("singleflight_preempted_total", flight=self.name)
+        self._preempted.add(call.task)
+        call.task.cancel()
+        for k in [k for k, c in self._calls.items() if c is call]:
+            self._calls.pop(k)
+        return None
+
+    async def _wait(self, call: _Call, key: Hashable, *, whole: bool = False) -> Any:
+        try:
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            me = asyncio.current_task()
+            if call.task in self._preempted and not (me is not None and me.cancelling()):
+                raise Preempted(f"{self.name}: {key!r}") from None
+            raise
+        return result.get(key) if call.multi and not whole else result
+
+    def _register(self, keys: list, task: asyncio.Task, priority: Optional[int], multi: bool) -> _Call:
+        call = _Call(task, priority, multi)
+        for key in keys:
+            self._calls[key] = call
+
+        def _done(t: asyncio.Task) -> None:
+            for key in keys:
+                if self._calls.get(key) is call:
+                    self._calls.pop(key)
+
+        task.add_done_callback(_done)
+        return call
+
+    async def do(self, key: Hashable, fn: Work, *, priority: Optional[int] = None) -> Any:
+        call = self._joinable(key, priority)
+        if call is not None:
+            metrics.inc("singleflight_shared_total", flight=self.name)
+            return copy.deepcopy(await self._wait(call, key))
+
+        task = asyncio.create_task(self._lead(key, fn), name=f"sf-{self.name}-{key}")
+        return await self._wait(self._register([key], task, priority, multi=False), key)
+
+    async def do_many(self, keys: Iterable[Hashable], fn: ManyWork, *, priority: Optional[int] = None) -> Dict[Hashable, Any]:
+        """
+        Одна работа fn(свободные ключи) на несколько ключей; ключи, по которым работа уже идёт, — ждём её.
+        Advisory-лок между репликами (SINGLEFLIGHT_PG_LOCK) здесь не берётся — только локальная дедупликация.
+        """
+        keys = list(dict.fromkeys(keys))
+        joined = {}
+        for key in keys:
+            call = self._joinable(key, priority)
+            if call is not None:
+                joined[key] = call
+        free = [k for k in keys if k not in joined]
+        own = None
+        if free:
+            task = asyncio.create_task(fn(free), name=f"sf-{self.name}-many")
+            own = self._register(free, task, priority, multi=True)
+        if joined:
+            metrics.inc("singleflight_shared_total", len(joined), flight=self.name)
+        out: Dict[Hashable, Any] = {}
+        for key, call in joined.items():
+            out[key] = copy.deepcopy(await self._wait(call, key))
+        if own is not None:
+            result = await self._wait(own, free, whole=True)
+            for key in free:
+                out[key] = result.get(key)
+        return out
+
+    async def _lead(self, key: Hashable, fn: Work) -> Any:
+        if not SINGLEFLIGHT_PG_LOCK:
+            return await fn(False)
+
+        lock_key = f"{self.name}:{key!r}"
+        waited = False
+        try:
+            while not await _lock_query("SELECT pg_try_advisory_lock(hashtextextended($1, 0))", lock_key):
+                waited = True
+                await asyncio.sleep(SINGLEFLIGHT_LOCK_POLL_SEC)
+        except Exception as e:
+            # БД для локов недоступна — не блокируем генерацию, остаёмся с локальной дедупликацией
+            logging.warning("singleflight pg lock failed (%s) → local only", e)
+            return await fn(False)
+
+        if waited:
+            metrics.inc("singleflight_shared_total", flight=self.name, scope="pg")
+        try:
+            return await fn(waited)
+        finally:
+            try:
+                await _lock_query("SELECT pg_advisory_unlock(hashtextextended($1, 0))", lock_key)
+            except Exception as e:
+                logging.warning("singleflight pg unlock failed: %s", e)
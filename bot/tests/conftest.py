@@ -0,0 +1,6 @@
+# tests/conftest.py
+# Тесты запускаются из bot/ (cd bot && python -m pytest): модули импортируются как в app.py — services.*, bench.*
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
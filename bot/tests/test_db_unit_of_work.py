@@ -0,0 +1,157 @@
+# tests/test_db_unit_of_work.py
+"""UnitOfWork без Postgres: порядок запросов, ключи локов и число round trip'ов."""
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from services import db as dbsvc
+from services import metrics
+
+BUNDLE_ROW = {
+    "user_id": 1, "system": "western", "birth_date": None, "birth_time": None,
+    "lat": 55.7, "lon": 37.6, "tz": "Europe/Moscow", "unknown_time": False,
+    "tg_id": 100, "user_name": "Анна", "gender": "f",
+    "has_facts": True,
+    "mission": None, "strengths": {"items": ["упорство"]}, "weaknesses": None,
+    "countries": None, "business": None, "love": None, "extra": {"finance": "текст"},
+    "summary_text": "",
+}
+
+
+class FakeConn:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, tuple]] = []
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.calls.append(("BEGIN", ()))
+        yield
+        self.calls.append(("COMMIT", ()))
+
+    async def execute(self, query: str, *args) -> str:
+        self.calls.append((query, args))
+        verb = query.split()[0].upper()
+        return {"INSERT": "INSERT 0 1", "UPDATE": "UPDATE 1"}.get(verb, f"{verb} 1")
+
+    async def fetchrow(self, query: str, *args):
+        self.calls.append((query, args))
+        return dict(BUNDLE_ROW)
+
+
+class FakePool:
+    def __init__(self) -> None:
+        self.conn = FakeConn()
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+@pytest.fixture
+def pool():
+    p = FakePool()
+    dbsvc.set_pool(p)
+    yield p
+    dbsvc.set_pool(None)
+
+
+def _sql(calls: list[tuple[str, tuple]]) -> list[str]:
+    return [" ".join(q.split()) for q, _ in calls]
+
+
+def test_versions_lock_then_deactivate_then_insert(pool):
+    contents = {"weaknesses": {"items": ["b"]}, "strengths": {"items": ["a"]}}
+
+    async def main():
+        async with dbsvc.unit_of_work("test") as uow:
+            await uow.add_versions(42, contents, make_active=True, source="user")
+        return uow
+
+    uow = asyncio.run(main())
+    sql = _sql(pool.conn.calls)
+    assert sql[0] == "BEGIN" and sql[-1] == "COMMIT"
+    lock, off, write = sql[1:4]
+    # локи — в одном порядке для всех писателей: две транзакции с пересекающимися сценариями
+    # не ждут друг друга по кругу
+    assert "pg_advisory_xact_lock" in lock
+    assert pool.conn.calls[1][1] == (["sfv:42:strengths", "sfv:42:weaknesses"],)
+    # снятие активности — отдельной командой до вставки (иначе uq_fact_active падает)
+    assert off.startswith("UPDATE session_facts_versions SET is_active = false")
+    assert pool.conn.calls[2][1] == (42, ["weaknesses", "strengths"])
+    assert write.startswith("INSERT INTO session_facts_versions") and "UPDATE" not in write
+    assert pool.conn.calls[3][1] == (42, contents, True, "user")
+    assert uow.roundtrips == 5
+
+
+def test_inactive_versions_do_not_touch_the_active_one(pool):
+    async def main():
+        async with dbsvc.unit_of_work("test") as uow:
+            await uow.add_versions(42, {"finance": {"text": "t"}}, make_active=False)
+
+    asyncio.run(main())
+    assert [s.split()[0] for s in _sql(pool.conn.calls)] == ["BEGIN", "SELECT", "INSERT", "COMMIT"]
+
+
+def test_batch_store_locks_the_same_keys_in_the_same_order(pool):
+    from services import llm_batch
+
+    stored = asyncio.run(llm_batch._store("horoscope_daily", [(10, '{"text":"a"}'), (9, '{"text":"b"}')]))
+
+    sql = _sql(pool.conn.calls)
+    assert [s.split()[0] for s in sql] == ["BEGIN", "SELECT", "UPDATE", "INSERT", "COMMIT"]
+    keys = pool.conn.calls[1][1][0]
+    assert keys == dbsvc.version_lock_keys([(9, "horoscope_daily"), (10, "horoscope_daily")])
+    assert keys == sorted(keys) == ["sfv:10:horoscope_daily", "sfv:9:horoscope_daily"]
+    assert stored == 1
+
+
+def test_lock_keys_are_sorted_and_unique():
+    keys = dbsvc.version_lock_keys([(2, "b"), (1, "a"), (2, "b"), (1, "c")])
+    assert keys == ["sfv:1:a", "sfv:1:c", "sfv:2:b"]
+
+
+def test_empty_versions_skip_the_lock(pool):
+    async def main():
+        async with dbsvc.unit_of_work("test") as uow:
+            await uow.add_versions(42, {})
+        return uow
+
+    assert asyncio.run(main()).roundtrips == 2  # только BEGIN/COMMIT
+    assert _sql(pool.conn.calls) == ["BEGIN", "COMMIT"]
+
+
+def test_save_scenario_results_roundtrips_and_metrics(pool):
+    before = metrics.counter("db_roundtrips_total", op="test_save")
+
+    facts = asyncio.run(dbsvc.save_scenario_results(
+        42, {"finance": {"text": "текст"}}, op="test_save", extra={"finance": "текст"},
+    ))
+
+    sql = _sql(pool.conn.calls)
+    assert [s.split()[0] for s in sql] == ["BEGIN", "SELECT", "UPDATE", "INSERT", "WITH", "INSERT", "COMMIT"]
+    assert "INSERT INTO session_summary" in sql[5]
+    assert facts["extra"] == {"finance": "текст"}
+    assert metrics.counter("db_roundtrips_total", op="test_save") - before == 7
+
+
+def test_unchanged_summary_is_not_rewritten(pool):
+    async def main():
+        async with dbsvc.unit_of_work("test") as uow:
+            await uow.patch_facts(42, extra={"finance": "текст"})
+            summary = dbsvc._summary_text(uow._bundles[42])
+        return summary
+
+    BUNDLE_ROW["summary_text"] = asyncio.run(main())
+    try:
+        pool.conn.calls.clear()
+
+        async def again():
+            async with dbsvc.unit_of_work("test") as uow:
+                await uow.patch_facts(42, extra={"finance": "текст"})
+                await uow.rebuild_summary(42)
+
+        asyncio.run(again())
+        assert not any("session_summary (" in s for s in _sql(pool.conn.calls))
+    finally:
+        BUNDLE_ROW["summary_text"] = ""
@@ -0,0 +1,92 @@
+# tests/test_llm_batch.py
+"""Сборка JSONL пачки без Postgres: строки читаются курсором, часть режется по байтам."""
+import io
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date
+
+import pytest
+
+from services import db as dbsvc
+from services import llm_batch
+from services.llm import LLMParams
+
+
+def _row(sid: int) -> dict:
+    return {
+        "id": sid, "raw_calc_json": {"planets": {"sun": {"sign": "Овен", "deg": 10.5}}},
+        "mission": None, "strengths": {"items": ["упорство"]}, "weaknesses": None,
+        "countries": None, "business": None, "love": None, "extra": {}, "summary_text": "",
+    }
+
+
+class FakeConn:
+    def __init__(self, rows: list[dict]) -> None:
+        self.rows = rows
+        self.fetched = 0
+        self.cursors: list[tuple] = []
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        yield
+
+    def cursor(self, query: str, *args, prefetch: int):
+        self.cursors.append((args, prefetch))
+        after_id, limit = args
+
+        async def gen():
+            for r in [r for r in self.rows if r["id"] > after_id][:limit]:
+                self.fetched += 1
+                yield r
+        return gen()
+
+
+class FakePool:
+    def __init__(self, rows: list[dict]) -> None:
+        self.conn = FakeConn(rows)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    p = FakePool([_row(i) for i in range(1, 11)])
+    dbsvc.set_pool(p)
+
+    async def scenario(code):
+        return "Прогноз на день", {}, None, LLMParams(model="gpt-4o-mini", temperature=0.3)
+
+    async def admin_value(key):
+        return "system"
+
+    monkeypatch.setattr(llm_batch, "_scenario", scenario)
+    monkeypatch.setattr(dbsvc, "get_admin_value", admin_value)
+    yield p
+    dbsvc.set_pool(None)
+
+
+def test_write_requests_streams_lines_from_cursor(pool):
+    out = io.BytesIO()
+    count, last_id = asyncio.run(llm_batch.write_requests(out, "horoscope_daily", date(2026, 1, 2), 4))
+    lines = out.getvalue().decode("utf-8").splitlines()
+    assert (count, last_id) == (6, 10)
+    assert [json.loads(x)["custom_id"] for x in lines] == ["5", "6", "7", "8", "9", "10"]
+    body = json.loads(lines[0])["body"]
+    assert body["model"] == "gpt-4o-mini"
+    assert any("ДАТА: 2026-01-02" in m["content"] for m in body["messages"])
+    assert pool.conn.cursors == [((4, llm_batch.LLM_BATCH_MAX_REQUESTS), llm_batch._FETCH_ROWS)]
+
+
+def test_part_is_cut_by_bytes(pool, monkeypatch):
+    params = LLMParams(model="gpt-4o-mini", temperature=0.3)
+    task = "Прогноз на день\nДАТА: 2026-01-02"
+    line = len(llm_batch.request_line(_row(1), "horoscope_daily", task, None, params, "system"))
+    monkeypatch.setattr(llm_batch, "LLM_BATCH_MAX_BYTES", line * 3 + line // 2)
+    out = io.BytesIO()
+    count, last_id = asyncio.run(llm_batch.write_requests(out, "horoscope_daily", date(2026, 1, 2), 0))
+    assert (count, last_id) == (3, 3)  # следующая часть начнётся с id > 3
+    assert len(out.getvalue().splitlines()) == 3
+    assert pool.conn.fetched == 4  # курсор не дочитывается до конца
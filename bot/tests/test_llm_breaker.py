@@ -0,0 +1,99 @@
+# tests/test_llm_breaker.py
+import pytest
+
+from services import llm_breaker
+from services.llm_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, LLMUnavailable
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(llm_breaker.time, "monotonic", c)
+    monkeypatch.setattr(llm_breaker, "LLM_BREAKER_ENABLED", True)
+    monkeypatch.setattr(llm_breaker, "LLM_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(llm_breaker, "LLM_BREAKER_OPEN_SEC", 30.0)
+    monkeypatch.setattr(llm_breaker, "LLM_BREAKER_LATENCY_MS", 5000.0)
+    monkeypatch.setattr(llm_breaker, "LLM_LATENCY_MIN_SAMPLES", 5)
+    return c
+
+
+def test_opens_after_consecutive_failures(clock):
+    b = CircuitBreaker()
+    b.record(False, 100)
+    b.record(False, 100)
+    b.record(True, 100)  # успех обнуляет счётчик
+    b.record(False, 100)
+    b.record(False, 100)
+    assert b.state == CLOSED
+    b.record(False, 100)
+    assert b.state == OPEN
+    assert not b.allow()
+    with pytest.raises(LLMUnavailable):
+        b.check()
+
+
+def test_half_open_lets_one_probe_through(clock):
+    b = CircuitBreaker()
+    for _ in range(3):
+        b.record(False, 100)
+    clock.now += 31
+    assert b.allow()
+    assert b.state == HALF_OPEN
+    assert not b.allow()  # проба уже в полёте
+    b.record(True, 100)
+    assert b.state == CLOSED
+    assert b.allow()
+
+
+def test_failed_probe_reopens(clock):
+    b = CircuitBreaker()
+    for _ in range(3):
+        b.record(False, 100)
+    clock.now += 31
+    assert b.allow()
+    b.record(False, 100)
+    assert b.state == OPEN
+    assert not b.allow()
+    clock.now += 31
+    assert b.allow()
+
+
+def test_opens_on_slow_p95_and_forgets_old_samples(clock):
+    b = CircuitBreaker()
+    for _ in range(4):
+        b.record(True, 9000)
+    assert b.state == CLOSED  # мало данных
+    b.record(True, 9000)
+    assert b.state == OPEN
+    assert b.quantile(0.95) is None  # окно очищено при открытии
+
+
+def test_disabled_breaker_always_allows(clock, monkeypatch):
+    monkeypatch.setattr(llm_breaker, "LLM_BREAKER_ENABLED", False)
+    b = CircuitBreaker()
+    for _ in range(10):
+        b.record(False, 100)
+    assert b.allow()
+
+
+def test_hedge_delay_from_window(clock, monkeypatch):
+    monkeypatch.setattr(llm_breaker, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm_breaker, "LLM_HEDGE_QUANTILE", 0.95)
+    monkeypatch.setattr(llm_breaker, "LLM_HEDGE_MIN_MS", 1500.0)
+    b = CircuitBreaker()
+    assert b.hedge_delay() is None
+    for ms in (100, 200, 300, 400, 4000):
+        b.record(True, ms)
+    assert b.hedge_delay() == 4.0
+    b = CircuitBreaker()
+    for _ in range(5):
+        b.record(True, 100)
+    assert b.hedge_delay() == 1.5  # не раньше LLM_HEDGE_MIN_MS
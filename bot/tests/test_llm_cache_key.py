@@ -0,0 +1,49 @@
+# tests/test_llm_cache_key.py
+"""Ключ кэша LLM — по полной карте, до отбора полей и бюджета контекста."""
+import asyncio
+
+import pytest
+
+from services import llm, llm_cache, llm_context
+from services.llm import LLMParams
+
+SPEC = {"astro": ["planets"], "facts": None, "summary": False, "max_tokens": 0}
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    seen: list[str] = []
+    charts = {
+        1: {"planets": {"sun": "leo"}, "houses": {"1": "aries"}},
+        2: {"planets": {"sun": "leo"}, "houses": {"1": "virgo"}},  # отбор planets у обеих одинаковый
+    }
+
+    async def get_scenario(code):
+        return "Миссия", {"type": "object"}, SPEC, LLMParams(model="gpt-4o-mini", temperature=0.3)
+
+    async def build_context(session_id, spec=None):
+        return {"astro_json": charts[session_id], "facts": {"extra": {}}, "summary": ""}
+
+    async def cache_get(key):
+        seen.append(key)
+        return {"text": "из кэша"}
+
+    def no_fit(*args, **kwargs):
+        raise AssertionError("при попадании в кэш контекст не собирается")
+
+    monkeypatch.setattr(llm, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm, "_get_scenario", get_scenario)
+    monkeypatch.setattr(llm, "_build_context", build_context)
+    monkeypatch.setattr(llm_cache, "get", cache_get)
+    monkeypatch.setattr(llm_context, "fit", no_fit)
+    return seen
+
+
+def test_charts_with_the_same_trimmed_astro_get_different_keys(keys):
+    async def main():
+        return [await llm._generate_json_once(sid, "mission") for sid in (1, 2, 1)]
+
+    assert asyncio.run(main()) == [{"text": "из кэша"}] * 3
+    assert keys[0] != keys[1]
+    assert keys[0] == keys[2]
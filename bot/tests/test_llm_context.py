@@ -0,0 +1,112 @@
+# tests/test_llm_context.py
+import pytest
+
+from services import llm_context
+from services.llm_context import fit, merge_specs, parse_spec
+
+MODEL = "gpt-4o-mini"
+
+ASTRO = {
+    "planets": {"sun": "leo", "moon": "cancer"},
+    "houses": {"1": "aries", "2": "taurus"},
+    "pillars": {"day": "jia-zi", "year": "geng-wu"},
+}
+FACTS = {
+    "mission": "Помогать людям находить своё дело и доводить начатое до конца.",
+    "strengths": {"items": ["упорство", "эмпатия", "организованность"]},
+    "weaknesses": None,
+    "love": "",
+    "extra": {"finance": "Деньги приходят через обучение других."},
+}
+SUMMARY = "Имя: Анна; пол: f; система: western. " * 4
+
+
+@pytest.fixture(autouse=True)
+def char_estimate(monkeypatch):
+    # детерминированный счёт токенов (~3 символа на токен), независимо от словарей tiktoken
+    monkeypatch.setattr(llm_context, "_encoding", lambda model: None)
+    monkeypatch.setattr(llm_context, "LLM_CONTEXT_MAX_TOKENS", 0)
+    llm_context._astro_cache.clear()
+
+
+def _ctx() -> dict:
+    return {"astro_json": ASTRO, "facts": dict(FACTS), "summary": SUMMARY}
+
+
+def _spec(**kw) -> dict:
+    return parse_spec({"astro": None, "facts": None, "summary": True, **kw})
+
+
+def test_count_tokens_char_estimate():
+    assert llm_context.count_tokens("", MODEL) == 0
+    assert llm_context.count_tokens("abcd", MODEL) == 2
+
+
+def test_parse_and_merge_specs():
+    assert parse_spec(None) is None
+    spec = parse_spec({"astro": "planets", "facts": ["mission", " "], "max_tokens": "bad"})
+    assert spec == {"astro": ["planets"], "facts": ["mission"], "summary": True, "max_tokens": 0}
+
+    a = parse_spec({"astro": ["planets"], "facts": ["mission"], "summary": False, "max_tokens": 500})
+    b = parse_spec({"astro": ["pillars.day", "planets"], "facts": [], "summary": True, "max_tokens": 800})
+    merged = merge_specs([a, b])
+    assert merged == {"astro": ["planets", "pillars.day"], "facts": ["mission"], "summary": True, "max_tokens": 800}
+    assert merge_specs([a, None]) is None
+    assert merge_specs([a, parse_spec({"max_tokens": 0})])["max_tokens"] == 0
+
+
+def test_fit_without_budget_keeps_everything_but_empty_facts():
+    out = fit(_ctx(), None, MODEL)
+    assert out["astro"] == ASTRO
+    assert set(out["facts"]) == {"mission", "strengths", "extra"}
+    assert out["summary"] == SUMMARY
+    assert not out["trimmed"]
+
+
+def test_fit_picks_spec_paths():
+    out = fit(_ctx(), _spec(astro=["pillars.day", "planets"], facts=["extra.finance"], summary=False), MODEL)
+    assert out["astro"] == {"pillars": {"day": "jia-zi"}, "planets": ASTRO["planets"]}
+    assert out["facts"] == {"extra": {"finance": FACTS["extra"]["finance"]}}
+    assert out["summary"] == ""
+
+
+def test_fit_trims_summary_first():
+    full = fit(_ctx(), None, MODEL)["tokens"]
+    budget = full - 10
+    out = fit(_ctx(), _spec(max_tokens=budget), MODEL)
+    assert out["trimmed"]
+    assert out["tokens"] <= budget
+    assert 0 < len(out["summary"]) < len(SUMMARY)
+    assert out["astro"] == ASTRO and set(out["facts"]) == {"mission", "strengths", "extra"}
+
+
+def test_fit_then_drops_facts_from_the_end_then_astro():
+    no_summary = _spec(summary=False)
+    astro_tokens = llm_context.count_tokens(llm_context.dumps(ASTRO), MODEL)
+    out = fit(_ctx(), {**no_summary, "max_tokens": astro_tokens + 5}, MODEL)
+    assert out["summary"] == ""
+    assert out["facts"] == {}  # FACTS режутся раньше ASTRO_JSON
+    assert out["astro"] == ASTRO
+    assert out["tokens"] <= astro_tokens + 5
+
+    out = fit(_ctx(), {**no_summary, "max_tokens": astro_tokens - 5}, MODEL)
+    assert list(out["astro"]) == ["planets", "houses"]  # ASTRO_JSON — с конца
+    assert out["tokens"] <= astro_tokens - 5
+    assert out["astro_text"] == llm_context.dumps(out["astro"])
+
+
+def test_fit_is_deterministic_and_does_not_mutate_input():
+    ctx = _ctx()
+    spec = _spec(max_tokens=40)
+    first = fit(ctx, spec, MODEL)
+    assert fit(ctx, spec, MODEL) == first
+    assert ctx["astro_json"] == ASTRO and ctx["facts"] == FACTS
+
+
+def test_astro_block_cached_per_session_until_chart_changes():
+    out1 = fit(_ctx(), None, MODEL, session_id=7)
+    assert len(llm_context._astro_cache) == 1
+    changed = {**_ctx(), "astro_json": {"planets": {"sun": "virgo"}}}
+    out2 = fit(changed, None, MODEL, session_id=7)
+    assert out1["astro"] == ASTRO
+    assert out2["astro"] == {"planets": {"sun": "virgo"}}
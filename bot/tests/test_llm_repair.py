@@ -0,0 +1,91 @@
+# tests/test_llm_repair.py
+"""Локальный ремонт ответов модели: починенный объект обязан проходить схему сценария."""
+import json
+
+import pytest
+from jsonschema import validate
+
+from bench.load_llm import SCENARIOS
+from services import llm_repair, llm_schema
+
+ITEMS = [f"пункт {i + 1}" for i in range(10)]
+TEXT = "Деньги приходят через обучение других. " * 3
+
+
+def _schema(code: str) -> dict:
+    return llm_schema.coerce_schema(SCENARIOS[code][1])
+
+
+def _repaired(text: str, code: str):
+    schema = _schema(code)
+    data = llm_repair.repair(text, code, schema)
+    assert data is not None, text
+    validate(data, schema)
+    return data
+
+
+def test_extract_json_from_fence_and_surrounding_text():
+    assert llm_repair.extract_json('Вот ответ:\n```json\n{"a": 1}\n```') == {"a": 1}
+    assert llm_repair.extract_json('Конечно! {"a": [1, 2]} Надеюсь, помог.') == {"a": [1, 2]}
+    assert llm_repair.extract_json("без json") is None
+    assert llm_repair.extract_json('{"a": "обрыв') is None
+
+
+def test_fenced_block_with_prose():
+    text = "Вот ответ:\n```json\n" + json.dumps({"mission": TEXT}, ensure_ascii=False) + "\n```"
+    assert _repaired(text, "mission") == {"mission": TEXT}
+
+
+def test_scenario_key_instead_of_text():
+    text = json.dumps({"finance": TEXT}, ensure_ascii=False)
+    assert _repaired(text, "finance") == {"text": TEXT}
+
+
+def test_scenario_key_wrapper_with_merged_items():
+    text = json.dumps({"strengths": ITEMS[:-2] + ["\n".join(ITEMS[-2:])]}, ensure_ascii=False)
+    assert _repaired(text, "strengths") == {"items": ITEMS}
+
+
+def test_items_merged_into_one_bulleted_string():
+    text = json.dumps({"items": "\n".join(f"- {x}" for x in ITEMS[:5])}, ensure_ascii=False)
+    assert _repaired(text, "countries") == {"items": ITEMS[:5]}
+
+
+def test_bare_list_and_nested_wrapper():
+    assert _repaired(json.dumps(ITEMS, ensure_ascii=False), "business") == {"items": ITEMS}
+    text = json.dumps({"result": {"text": TEXT}}, ensure_ascii=False)
+    assert _repaired(text, "karma") == {"text": TEXT}
+
+
+def test_too_many_items_are_truncated():
+    text = json.dumps({"items": ITEMS + ["лишний"]}, ensure_ascii=False)
+    assert _repaired(text, "weaknesses") == {"items": ITEMS}
+
+
+def test_extra_keys_dropped_when_schema_forbids_them():
+    schema = {
+        "type": "object", "required": ["text"], "additionalProperties": False,
+        "properties": {"text": {"type": "string"}},
+    }
+    data = llm_repair.repair(json.dumps({"text": TEXT, "note": "x"}), "test_strict_text", schema)
+    assert data == {"text": TEXT}
+
+
+@pytest.mark.parametrize("text, code", [
+    ('{"finance": "Деньги приходят', "finance"),  # обрезанный JSON
+    (json.dumps({"items": ITEMS[:5]}, ensure_ascii=False), "strengths"),  # пунктов мало — не выдумываем
+    ("Извините, не могу ответить.", "mission"),
+])
+def test_unfixable_answers_go_back_to_the_model(text, code):
+    assert llm_repair.repair(text, code, _schema(code)) is None
+
+
+@pytest.mark.parametrize("code", ["strengths", "weaknesses", "countries", "business", "finance", "karma", "mission", "love"])
+def test_mock_server_fixable_answers_pass_the_schema(code):
+    pytest.importorskip("aiohttp")
+    from bench.mock_openai import _content
+
+    text = _content(code, invalid=True, fixable=True)
+    with pytest.raises(Exception):
+        validate(json.loads(text), _schema(code))  # ответ действительно сломан
+    _repaired(text, code)
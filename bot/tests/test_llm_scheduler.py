@@ -0,0 +1,183 @@
+# tests/test_llm_scheduler.py
+import asyncio
+import time
+
+from services.llm_scheduler import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_ONBOARDING,
+    PRIORITY_PREFETCH,
+    LLMScheduler,
+    TokenBucket,
+    parse_duration,
+)
+
+
+def test_parse_duration():
+    assert parse_duration("1s") == 1.0
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("0.5") == 0.5
+    assert parse_duration("") is None
+    assert parse_duration("soon") is None
+
+
+def test_token_bucket_wait_time():
+    b = TokenBucket(60)  # 1 единица в секунду
+    assert b.wait_time(60) == 0
+    b.take(60)
+    assert 9.5 < b.wait_time(10) <= 10.0
+    b.sync(limit=120, remaining=0)
+    assert b.capacity == 120 and b.level == 0
+
+
+async def _order(s: LLMScheduler, requests: list[tuple[str, int]]) -> list[str]:
+    """Занимаем единственный слот, ставим запросы в очередь и смотрим порядок выдачи."""
+    served: list[str] = []
+
+    async def _one(user: str, prio: int) -> None:
+        async with s.slot(user, prio, est_tokens=1):
+            served.append(user)
+
+    async with s.slot("blocker", PRIORITY_INTERACTIVE, est_tokens=1):
+        tasks = [asyncio.create_task(_one(u, p)) for u, p in requests]
+        await asyncio.sleep(0)
+        assert s.queued() == len(requests)
+    await asyncio.gather(*tasks)
+    return served
+
+
+def test_users_are_served_round_robin_within_priority():
+    s = LLMScheduler(max_inflight=1, rpm=10000, tpm=10**7)
+    served = asyncio.run(_order(s, [("a", 1), ("a", 1), ("a", 1), ("b", 1), ("c", 1)]))
+    assert served == ["a", "b", "c", "a", "a"]
+
+
+def test_lower_priority_value_goes_first():
+    s = LLMScheduler(max_inflight=1, rpm=10000, tpm=10**7)
+    served = asyncio.run(_order(s, [
+        ("prefetch", PRIORITY_PREFETCH), ("click", PRIORITY_INTERACTIVE), ("onboarding", PRIORITY_ONBOARDING),
+    ]))
+    assert served == ["onboarding", "click", "prefetch"]
+
+
+def test_cancelled_waiter_is_skipped():
+    s = LLMScheduler(max_inflight=1, rpm=10000, tpm=10**7)
+    served: list[str] = []
+
+    async def _one(user: str) -> None:
+        async with s.slot(user, est_tokens=1):
+            served.append(user)
+
+    async def main() -> None:
+        async with s.slot("blocker", est_tokens=1):
+            gone = asyncio.create_task(_one("gone"))
+            kept = asyncio.create_task(_one("kept"))
+            await asyncio.sleep(0)
+            gone.cancel()
+        await asyncio.gather(gone, kept, return_exceptions=True)
+
+    asyncio.run(main())
+    assert served == ["kept"]
+    assert s.inflight == 0
+
+
+def test_pause_for_holds_the_whole_queue():
+    s = LLMScheduler(max_inflight=4, rpm=10000, tpm=10**7)
+
+    async def main() -> float:
+        delay = s.pause_for({"retry-after": "0.2"})
+        assert delay == 0.2
+        started = time.monotonic()
+        async with s.slot("u", est_tokens=1):
+            return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.19
+
+
+def test_pause_for_uses_reset_headers_without_retry_after():
+    s = LLMScheduler(max_inflight=1, rpm=100, tpm=1000)
+    assert s.pause_for({"x-ratelimit-reset-requests": "20ms", "x-ratelimit-reset-tokens": "1s"}) == 1.0
+    assert s.pause_for({}, default=0.5) == 0.5
+
+
+def test_tpm_budget_delays_next_request():
+    s = LLMScheduler(max_inflight=4, rpm=10000, tpm=600)  # 10 токенов в секунду
+
+    async def main() -> float:
+        async with s.slot("a", est_tokens=600):
+            pass
+        started = time.monotonic()
+        async with s.slot("b", est_tokens=2):
+            return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.15
+
+
+def test_try_take_respects_queue_pause_and_bucket():
+    s = LLMScheduler(max_inflight=1, rpm=2, tpm=10**6)
+    assert s.try_take(10)
+    assert s.try_take(10)
+    assert not s.try_take(10)  # RPM кончился
+
+    s = LLMScheduler(max_inflight=1, rpm=100, tpm=10**6)
+    s.pause_for({"retry-after": "5"})
+    assert not s.try_take(10)
+
+    s = LLMScheduler(max_inflight=1, rpm=100, tpm=10**6)
+
+    async def main() -> bool:
+        async with s.slot("blocker", est_tokens=1):
+            waiter = asyncio.create_task(_noop_slot(s))
+            await asyncio.sleep(0)
+            taken = s.try_take(10)  # дубль не обгоняет очередь
+        await waiter
+        return taken
+
+    assert asyncio.run(main()) is False
+
+
+async def _noop_slot(s: LLMScheduler) -> None:
+    async with s.slot("waiter", est_tokens=1):
+        pass
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    s = LLMScheduler(max_inflight=1, rpm=10000, tpm=10**7)
+
+    async def main() -> tuple[int, bool]:
+        async with s.slot("blocker", est_tokens=1):
+            gone = asyncio.create_task(_noop_slot(s))
+            await asyncio.sleep(0)
+            assert s.queued() == 1
+            gone.cancel()
+            await asyncio.gather(gone, return_exceptions=True)
+            return s.queued(), s.try_take(10)
+
+    assert asyncio.run(main()) == (0, True)
+
+
+def test_one_timer_while_waiting_for_the_bucket():
+    s = LLMScheduler(max_inflight=8, rpm=10000, tpm=600)  # 10 токенов в секунду
+
+    async def wait_slot(tokens: float, prio: int) -> None:
+        async with s.slot("u", prio, est_tokens=tokens):
+            pass
+
+    async def main() -> None:
+        async with s.slot("a", est_tokens=600):
+            pass
+        big = asyncio.create_task(wait_slot(300, PRIORITY_PREFETCH))  # ~30 с
+        await asyncio.sleep(0)
+        timer = s._timer
+        assert timer is not None
+        s._pump()  # повторные пампы (освобождение слотов, новые запросы) не плодят таймеры
+        s._pump()
+        assert s._timer is timer and not timer.cancelled()
+        small = asyncio.create_task(wait_slot(1, PRIORITY_ONBOARDING))  # ~0.1 с — таймер переносится раньше
+        await asyncio.sleep(0)
+        assert timer.cancelled() and s._timer.when() < timer.when()
+        await small
+        big.cancel()
+        await asyncio.gather(big, return_exceptions=True)
+
+    asyncio.run(main())
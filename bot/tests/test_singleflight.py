@@ -0,0 +1,153 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+
+from services.singleflight import Preempted, SingleFlight
+
+
+def test_concurrent_calls_share_one_run_and_get_copies():
+    sf = SingleFlight("test")
+    calls = []
+
+    async def work(waited: bool) -> dict:
+        calls.append(waited)
+        await asyncio.sleep(0.01)
+        return {"items": [1, 2]}
+
+    async def main():
+        return await asyncio.gather(*(sf.do(("s", 1), work) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == [False]
+    assert all(r == {"items": [1, 2]} for r in results)
+    results[1]["items"].append(3)
+    assert results[2] == {"items": [1, 2]}  # ожидающие получают копию
+    assert sf.inflight() == 0
+
+
+def test_different_keys_run_separately():
+    sf = SingleFlight("test")
+    calls = []
+
+    def work_for(key: str):
+        async def work(waited: bool) -> str:
+            calls.append(key)
+            await asyncio.sleep(0)
+            return key
+        return work
+
+    async def main():
+        return await asyncio.gather(sf.do("a", work_for("a")), sf.do("b", work_for("b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_cancelled_leader_does_not_cancel_the_work():
+    sf = SingleFlight("test")
+
+    async def work(waited: bool) -> str:
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        leader = asyncio.create_task(sf.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(sf.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_error_reaches_every_waiter_and_key_is_freed():
+    sf = SingleFlight("test")
+    runs = []
+
+    async def boom(waited: bool) -> None:
+        runs.append(1)
+        await asyncio.sleep(0)
+        raise RuntimeError("provider down")
+
+    async def main():
+        res = await asyncio.gather(sf.do("k", boom), sf.do("k", boom), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in res)
+        with pytest.raises(RuntimeError):
+            await sf.do("k", boom)  # следующий вызов — новая попытка
+
+    asyncio.run(main())
+    assert runs == [1, 1]
+
+
+def test_more_important_caller_preempts_background_work():
+    sf = SingleFlight("test", preempt_from=3)
+    runs = []
+
+    def work_for(tag: str):
+        async def work(waited: bool) -> str:
+            runs.append(tag)
+            await asyncio.sleep(0.02)
+            return tag
+        return work
+
+    async def main():
+        background = asyncio.create_task(sf.do("k", work_for("prefetch"), priority=3))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(sf.do("k", work_for("other"), priority=3))
+        await asyncio.sleep(0)
+        click = await sf.do("k", work_for("click"), priority=1)
+        res = await asyncio.gather(background, follower, return_exceptions=True)
+        return click, res
+
+    click, (background, follower) = asyncio.run(main())
+    assert click == "click"
+    assert runs == ["prefetch", "click"]
+    assert isinstance(background, Preempted) and isinstance(follower, Preempted)
+
+
+def test_foreground_work_is_joined_not_preempted():
+    sf = SingleFlight("test", preempt_from=3)
+    runs = []
+
+    async def work(waited: bool) -> str:
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "v"
+
+    async def main():
+        return await asyncio.gather(
+            sf.do("k", work, priority=2), sf.do("k", work, priority=1), sf.do("k", work, priority=3)
+        )
+
+    assert asyncio.run(main()) == ["v", "v", "v"]
+    assert runs == [1]
+
+
+def test_do_many_registers_every_key():
+    sf = SingleFlight("test")
+    runs = []
+
+    async def many(keys: list) -> dict:
+        runs.append(list(keys))
+        await asyncio.sleep(0.01)
+        return {k: {"code": k} for k in keys}
+
+    async def single(waited: bool) -> dict:
+        runs.append("single")
+        return {}
+
+    async def main():
+        combined = asyncio.create_task(sf.do_many(["a", "b"], many, priority=3))
+        await asyncio.sleep(0)
+        b = asyncio.create_task(sf.do("b", single, priority=3))
+        both = asyncio.create_task(sf.do_many(["a", "c"], many))
+        return await combined, await b, await both
+
+    combined, b, both = asyncio.run(main())
+    assert combined == {"a": {"code": "a"}, "b": {"code": "b"}}
+    assert b == {"code": "b"}
+    assert both == {"a": {"code": "a"}, "c": {"code": "c"}}
+    assert runs == [["a", "b"], ["c"]]
+    assert sf.inflight() == 0
@@ -262,3 +262,207 @@ ALTER TABLE sessions
   ADD COLUMN IF NOT EXISTS unknown_time BOOLEAN;
 
 -- ===== END init.sql =====
+
+
+-- ===== BEGIN 012_first_screen_scenarios.sql =====
+
+-- Сценарии первого экрана (генерируются параллельно после расчёта карты)
+ALTER TABLE admin_settings
+  ADD COLUMN IF NOT EXISTS first_screen_scenarios JSONB NOT NULL DEFAULT '["strengths","weaknesses"]'::jsonb;
+
+-- ===== END 012_first_screen_scenarios.sql =====
+
+
+-- ===== BEGIN 013_llm_cache.sql =====
+
+-- Кэш ответов LLM по отпечатку карты
+CREATE TABLE IF NOT EXISTS llm_cache (
+  key          TEXT PRIMARY KEY,
+  scenario     TEXT NOT NULL,
+  model        TEXT,
+  result       JSONB NOT NULL,
+  hits         INT NOT NULL DEFAULT 0,
+  created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+  last_hit_at  TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_scenario ON llm_cache (scenario);
+
+CREATE OR REPLACE FUNCTION llm_cache_invalidate_scenario() RETURNS trigger AS $$
+BEGIN
+  DELETE FROM llm_cache WHERE scenario = OLD.scenario;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_admin_scenarios_llm_cache ON admin_scenarios;
+CREATE TRIGGER trg_admin_scenarios_llm_cache
+  AFTER UPDATE OR DELETE ON admin_scenarios
+  FOR EACH ROW EXECUTE FUNCTION llm_cache_invalidate_scenario();
+
+-- ===== END 013_llm_cache.sql =====
+
+
+-- ===== BEGIN 014_scenario_context_spec.sql =====
+
+-- Контекст сценария для промпта (NULL = весь контекст)
+ALTER TABLE admin_scenarios
+  ADD COLUMN IF NOT EXISTS context_spec JSONB;
+
+-- ===== END 014_scenario_context_spec.sql =====
+
+
+-- ===== BEGIN 015_llm_messages_call_stats.sql =====
+
+-- Статистика вызовов LLM
+ALTER TABLE llm_messages
+  ADD COLUMN IF NOT EXISTS schema_ok     BOOLEAN,
+  ADD COLUMN IF NOT EXISTS input_tokens  INT,
+  ADD COLUMN IF NOT EXISTS output_tokens INT,
+  ADD COLUMN IF NOT EXISTS status        TEXT,
+  ADD COLUMN IF NOT EXISTS latency_ms    INT,
+  ADD COLUMN IF NOT EXISTS attempt       INT,
+  ADD COLUMN IF NOT EXISTS retry_reason  TEXT,
+  ADD COLUMN IF NOT EXISTS model         TEXT;
+
+-- CHECK ролей расширяем служебными ролями лога: assistant_raw (сырой ответ модели),
+-- assistant_fail (ошибка запроса или ответ не прошёл схему)
+ALTER TABLE llm_messages DROP CONSTRAINT IF EXISTS llm_messages_role_check;
+ALTER TABLE llm_messages ADD CONSTRAINT llm_messages_role_check
+  CHECK (role IN ('system','user','assistant','assistant_raw','assistant_fail'));
+
+CREATE INDEX IF NOT EXISTS idx_llm_messages_scenario_created
+  ON llm_messages (scenario, created_at) WHERE latency_ms IS NOT NULL;
+
+-- ===== END 015_llm_messages_call_stats.sql =====
+
+
+-- ===== BEGIN 016_prefetch_source.sql =====
+
+-- Источник версии факта (user / prefetch / prefetch_used)
+ALTER TABLE session_facts_versions
+  ADD COLUMN IF NOT EXISTS source TEXT NOT NULL DEFAULT 'user';
+
+CREATE INDEX IF NOT EXISTS idx_sfv_created_at ON session_facts_versions (created_at);
+
+-- ===== END 016_prefetch_source.sql =====
+
+
+-- ===== BEGIN 017_llm_batches.sql =====
+
+-- Пачки Batch API для периодических прогнозов
+CREATE TABLE IF NOT EXISTS llm_batches (
+    id                BIGSERIAL PRIMARY KEY,
+    scenario          TEXT NOT NULL,
+    period            DATE NOT NULL,
+    status            TEXT NOT NULL DEFAULT 'building',
+    provider_batch_id TEXT,
+    input_file_id     TEXT,
+    output_file_id    TEXT,
+    request_count     INT NOT NULL DEFAULT 0,
+    ok_count          INT NOT NULL DEFAULT 0,
+    fail_count        INT NOT NULL DEFAULT 0,
+    error             TEXT,
+    created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    UNIQUE (scenario, period)
+);
+CREATE INDEX IF NOT EXISTS idx_llm_batches_status ON llm_batches (status);
+
+INSERT INTO admin_scenarios(code, title, prompt, json_schema) VALUES
+('horoscope_daily', 'Прогноз на день', 'Верни {"text":"..."} — прогноз на дату из поля ДАТА.', '{"type":"object","properties":{"text":{"type":"string"}},"required":["text"]}')
+ON CONFLICT (code) DO NOTHING;
+
+-- ===== END 017_llm_batches.sql =====
+
+
+-- ===== BEGIN 018_scenario_llm_params.sql =====
+
+-- Модель/температура/лимит вывода на сценарий (NULL = глобальные настройки)
+ALTER TABLE admin_scenarios
+  ADD COLUMN IF NOT EXISTS model             TEXT,
+  ADD COLUMN IF NOT EXISTS temperature       REAL,
+  ADD COLUMN IF NOT EXISTS max_output_tokens INT;
+
+ALTER TABLE admin_scenarios DROP CONSTRAINT IF EXISTS admin_scenarios_llm_params_check;
+ALTER TABLE admin_scenarios ADD CONSTRAINT admin_scenarios_llm_params_check
+  CHECK ((temperature IS NULL OR temperature BETWEEN 0 AND 2)
+     AND (max_output_tokens IS NULL OR max_output_tokens > 0));
+
+-- Бюджеты вывода для стандартных сценариев (только если ещё не заданы); модель не трогаем
+UPDATE admin_scenarios s
+SET max_output_tokens = v.budget
+FROM (
+  VALUES
+    ('strengths',       1200),
+    ('weaknesses',      1200),
+    ('countries',       1000),
+    ('business',        1200),
+    ('mission',         1500),
+    ('love',            1500),
+    ('finance',         1500),
+    ('karma',           1500),
+    ('horoscope_daily',  600)
+) AS v(code, budget)
+WHERE s.code = v.code AND s.max_output_tokens IS NULL;
+
+-- ===== END 018_scenario_llm_params.sql =====
+
+
+-- ===== BEGIN 019_admin_settings_notify.sql =====
+
+-- Снимок настроек в боте перечитывается по NOTIFY admin_settings_changed
+CREATE OR REPLACE FUNCTION admin_settings_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('admin_settings_changed', TG_OP);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_admin_settings_notify ON admin_settings;
+CREATE TRIGGER trg_admin_settings_notify
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON admin_settings
+  FOR EACH STATEMENT EXECUTE FUNCTION admin_settings_notify();
+
+-- ===== END 019_admin_settings_notify.sql =====
+
+
+-- ===== BEGIN 020_admin_scenarios_notify.sql =====
+
+-- Каталог сценариев в боте перечитывается по NOTIFY admin_scenarios_changed
+CREATE OR REPLACE FUNCTION admin_scenarios_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('admin_scenarios_changed', TG_OP);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_admin_scenarios_notify ON admin_scenarios;
+CREATE TRIGGER trg_admin_scenarios_notify
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON admin_scenarios
+  FOR EACH STATEMENT EXECUTE FUNCTION admin_scenarios_notify();
+
+-- ===== END 020_admin_scenarios_notify.sql =====
+
+
+-- ===== BEGIN 021_session_facts_fillfactor.sql =====
+
+-- Патч фактов — одна версия строки; запас на странице для HOT-update
+ALTER TABLE session_facts SET (fillfactor = 80);
+ALTER TABLE session_facts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+-- ===== END 021_session_facts_fillfactor.sql =====
+
+
+-- ===== BEGIN 022_llm_batches_parts.sql =====
+
+-- Части пачки на период (по LLM_BATCH_MAX_REQUESTS сессий) и повтор неотправленных частей
+ALTER TABLE llm_batches
+  ADD COLUMN IF NOT EXISTS part            INT NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS attempts        INT NOT NULL DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS last_session_id BIGINT;
+
+ALTER TABLE llm_batches DROP CONSTRAINT IF EXISTS llm_batches_scenario_period_key;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_llm_batches_scenario_period_part
+  ON llm_batches (scenario, period, part);
+
+-- ===== END 022_llm_batches_parts.sql =====
@@ -0,0 +1,6 @@
+-- 012_first_screen_scenarios.sql
+-- Какие сценарии генерировать сразу после расчёта карты (параллельно).
+-- strengths/weaknesses нужны для первого экрана и добавляются ботом всегда.
+
+ALTER TABLE public.admin_settings
+  ADD COLUMN IF NOT EXISTS first_screen_scenarios JSONB NOT NULL DEFAULT '["strengths","weaknesses"]'::jsonb;
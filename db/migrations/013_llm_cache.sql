@@ -0,0 +1,27 @@
+-- 013_llm_cache.sql
+-- Кэш ответов LLM по «отпечатку» карты: sha256(scenario, prompt_template, schema_json,
+-- model, temperature, канонический ASTRO_JSON). Одинаковые карты → один запрос к OpenAI.
+
+CREATE TABLE IF NOT EXISTS public.llm_cache (
+  key          TEXT PRIMARY KEY,
+  scenario     TEXT NOT NULL,
+  model        TEXT,
+  result       JSONB NOT NULL,
+  hits         INT NOT NULL DEFAULT 0,
+  created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+  last_hit_at  TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_scenario ON public.llm_cache (scenario);
+
+-- Правка/удаление сценария в админке → его кэш больше не нужен
+CREATE OR REPLACE FUNCTION public.llm_cache_invalidate_scenario() RETURNS trigger AS $$
+BEGIN
+  DELETE FROM public.llm_cache WHERE scenario = OLD.scenario;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_admin_scenarios_llm_cache ON public.admin_scenarios;
+CREATE TRIGGER trg_admin_scenarios_llm_cache
+  AFTER UPDATE OR DELETE ON public.admin_scenarios
+  FOR EACH ROW EXECUTE FUNCTION public.llm_cache_invalidate_scenario();
@@ -0,0 +1,20 @@
+-- 014_scenario_context_spec.sql
+-- Какой контекст нужен сценарию: пути в ASTRO_JSON, поля FACTS, SESSION_SUMMARY и бюджет токенов.
+-- NULL = весь контекст (как раньше). Формат см. bot/services/llm_context.py.
+
+ALTER TABLE public.admin_scenarios
+  ADD COLUMN IF NOT EXISTS context_spec JSONB;
+
+-- Дефолты для стандартных сценариев (только если ещё не заданы)
+UPDATE public.admin_scenarios s
+SET context_spec = v.spec::jsonb
+FROM (
+  VALUES
+    ('strengths',  '{"facts":[],"summary":false,"max_tokens":2500}'),
+    ('weaknesses', '{"facts":[],"summary":false,"max_tokens":2500}'),
+    ('mission',    '{"facts":["strengths","weaknesses"],"summary":false,"max_tokens":3000}'),
+    ('love',       '{"facts":["mission","strengths","weaknesses"],"summary":true,"max_tokens":3000}'),
+    ('countries',  '{"facts":["mission","strengths"],"summary":true,"max_tokens":3000}'),
+    ('business',   '{"facts":["mission","strengths","weaknesses"],"summary":true,"max_tokens":3000}')
+) AS v(scenario, spec)
+WHERE s.scenario = v.scenario AND s.context_spec IS NULL;
@@ -0,0 +1,20 @@
+-- 015_llm_messages_call_stats.sql
+-- По каждому вызову модели: токены из usage, время, номер попытки, причина ретрая и модель.
+
+ALTER TABLE public.llm_messages
+  ADD COLUMN IF NOT EXISTS input_tokens  INT,
+  ADD COLUMN IF NOT EXISTS output_tokens INT,
+  ADD COLUMN IF NOT EXISTS status        TEXT,
+  ADD COLUMN IF NOT EXISTS latency_ms    INT,
+  ADD COLUMN IF NOT EXISTS attempt       INT,
+  ADD COLUMN IF NOT EXISTS retry_reason  TEXT,
+  ADD COLUMN IF NOT EXISTS model         TEXT;
+
+-- CHECK ролей расширяем служебными ролями лога: assistant_raw (сырой ответ модели),
+-- assistant_fail (ошибка запроса или ответ не прошёл схему)
+ALTER TABLE public.llm_messages DROP CONSTRAINT IF EXISTS llm_messages_role_check;
+ALTER TABLE public.llm_messages ADD CONSTRAINT llm_messages_role_check
+  CHECK (role IN ('system','user','assistant','assistant_raw','assistant_fail'));
+
+CREATE INDEX IF NOT EXISTS idx_llm_messages_scenario_created
+  ON public.llm_messages (scenario, created_at) WHERE latency_ms IS NOT NULL;
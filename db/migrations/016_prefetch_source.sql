@@ -0,0 +1,8 @@
+-- 016_prefetch_source.sql
+-- Откуда версия факта: user (клик/онбординг), prefetch (фоновая предгенерация, ещё не открыта),
+-- prefetch_used (предгенерацию открыли). Ранжирование предгенерации не учитывает prefetch.
+
+ALTER TABLE public.session_facts_versions
+  ADD COLUMN IF NOT EXISTS source TEXT NOT NULL DEFAULT 'user';
+
+CREATE INDEX IF NOT EXISTS idx_sfv_created_at ON public.session_facts_versions (created_at);
@@ -0,0 +1,32 @@
+-- 017_llm_batches.sql
+-- Периодические прогнозы (admin_settings.enable_periodic_horoscopes) генерируются через Batch API:
+-- одна пачка на (сценарий, период), статус и файлы провайдера — в llm_batches.
+-- Результаты пишутся в session_facts_versions с source='batch'. См. bot/services/llm_batch.py.
+
+CREATE TABLE IF NOT EXISTS public.llm_batches (
+  id                BIGSERIAL PRIMARY KEY,
+  scenario          TEXT NOT NULL,
+  period            DATE NOT NULL,
+  status            TEXT NOT NULL DEFAULT 'building',  -- building | submitted | ingesting | done | failed
+  provider_batch_id TEXT,
+  input_file_id     TEXT,
+  output_file_id    TEXT,
+  request_count     INT NOT NULL DEFAULT 0,
+  ok_count          INT NOT NULL DEFAULT 0,
+  fail_count        INT NOT NULL DEFAULT 0,
+  error             TEXT,
+  created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+  UNIQUE (scenario, period)
+);
+CREATE INDEX IF NOT EXISTS idx_llm_batches_status ON public.llm_batches (status);
+
+-- Сценарий ежедневного прогноза: выключен в меню (enabled=false), используется пачкой
+INSERT INTO public.admin_scenarios (code, scenario, title, prompt_template, schema_json, enabled, context_spec)
+SELECT 'horoscope_daily', 'horoscope_daily', 'Прогноз на день',
+       'Составь персональный прогноз на дату из поля ДАТА: настроение дня, на что опереться, чего избегать. '
+       '3–5 предложений, без медицинских/финансовых советов. Формат ответа строго JSON: {"text":"..."}.',
+       '{"type":"object","required":["text"],"properties":{"text":{"type":"string"}}}'::jsonb,
+       false,
+       '{"facts":["mission","strengths"],"summary":false,"max_tokens":2500}'::jsonb
+WHERE NOT EXISTS (SELECT 1 FROM public.admin_scenarios WHERE scenario = 'horoscope_daily');
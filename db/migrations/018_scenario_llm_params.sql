@@ -0,0 +1,31 @@
+-- 018_scenario_llm_params.sql
+-- Модель и бюджет ответа на сценарий: короткие списки не должны идти той же моделью
+-- и без лимита вывода, что и годовой отчёт. NULL = глобальные OPENAI_MODEL / OPENAI_TEMPERATURE, без лимита.
+-- Читает bot/services/llm.py (_get_scenario → LLMParams), правится в web-админке.
+
+ALTER TABLE public.admin_scenarios
+  ADD COLUMN IF NOT EXISTS model             TEXT,
+  ADD COLUMN IF NOT EXISTS temperature       REAL,
+  ADD COLUMN IF NOT EXISTS max_output_tokens INT;
+
+ALTER TABLE public.admin_scenarios DROP CONSTRAINT IF EXISTS admin_scenarios_llm_params_check;
+ALTER TABLE public.admin_scenarios ADD CONSTRAINT admin_scenarios_llm_params_check
+  CHECK ((temperature IS NULL OR temperature BETWEEN 0 AND 2)
+     AND (max_output_tokens IS NULL OR max_output_tokens > 0));
+
+-- Бюджеты вывода для стандартных сценариев (только если ещё не заданы); модель не трогаем
+UPDATE public.admin_scenarios s
+SET max_output_tokens = v.budget
+FROM (
+  VALUES
+    ('strengths',       1200),
+    ('weaknesses',      1200),
+    ('countries',       1000),
+    ('business',        1200),
+    ('mission',         1500),
+    ('love',            1500),
+    ('finance',         1500),
+    ('karma',           1500),
+    ('horoscope_daily',  600)
+) AS v(scenario, budget)
+WHERE s.scenario = v.scenario AND s.max_output_tokens IS NULL;
@@ -0,0 +1,16 @@
+-- 019_admin_settings_notify.sql
+-- Бот держит admin_settings в памяти (bot/services/admin_settings.py) и перечитывает снимок
+-- по NOTIFY admin_settings_changed. Триггер на уровне statement: одна правка в админке — одно уведомление.
+-- Уведомление уходит при COMMIT; потерянные (бот без LISTEN) покрывает TTL снимка.
+
+CREATE OR REPLACE FUNCTION public.admin_settings_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('admin_settings_changed', TG_OP);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_admin_settings_notify ON public.admin_settings;
+CREATE TRIGGER trg_admin_settings_notify
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.admin_settings
+  FOR EACH STATEMENT EXECUTE FUNCTION public.admin_settings_notify();
@@ -0,0 +1,16 @@
+-- 020_admin_scenarios_notify.sql
+-- Бот держит admin_scenarios в памяти (bot/services/scenario_catalog.py) и перечитывает каталог
+-- по NOTIFY admin_scenarios_changed — сохранение сценария в web-админке подхватывается без рестарта.
+-- Триггер на уровне statement (как в 019); кэш ответов по-прежнему чистит trg_admin_scenarios_llm_cache (013).
+
+CREATE OR REPLACE FUNCTION public.admin_scenarios_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('admin_scenarios_changed', TG_OP);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_admin_scenarios_notify ON public.admin_scenarios;
+CREATE TRIGGER trg_admin_scenarios_notify
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.admin_scenarios
+  FOR EACH STATEMENT EXECUTE FUNCTION public.admin_scenarios_notify();
@@ -0,0 +1,8 @@
+-- 021_session_facts_fillfactor.sql
+-- upsert_session_facts (bot/services/db.py) пишет патч фактов одной командой — одна новая версия строки
+-- на сохранение. Запас места на странице даёт HOT-update (session_id/id не меняются → индексы не трогаются),
+-- и мёртвые версии вычищаются прямо при чтении страницы, не дожидаясь autovacuum.
+-- Новый fillfactor действует для новых страниц; существующие перепакует VACUUM FULL / pg_repack.
+
+ALTER TABLE public.session_facts SET (fillfactor = 80);
+ALTER TABLE public.session_facts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
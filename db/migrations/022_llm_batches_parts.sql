@@ -0,0 +1,14 @@
+-- 022_llm_batches_parts.sql
+-- Пачки Batch API на период делятся на части по LLM_BATCH_MAX_REQUESTS сессий (лимит провайдера на файл):
+-- part — номер части, last_session_id — последняя сессия части (следующая часть начинается после неё).
+-- attempts — число попыток отправки: часть, не дошедшая до провайдера (ошибка /files или /batches),
+-- отправляется заново, пока attempts < LLM_BATCH_SUBMIT_ATTEMPTS. См. bot/services/llm_batch.py.
+
+ALTER TABLE public.llm_batches
+  ADD COLUMN IF NOT EXISTS part            INT NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS attempts        INT NOT NULL DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS last_session_id BIGINT;
+
+ALTER TABLE public.llm_batches DROP CONSTRAINT IF EXISTS llm_batches_scenario_period_key;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_llm_batches_scenario_period_part
+  ON public.llm_batches (scenario, period, part);
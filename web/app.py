@@ -13,16 +13,53 @@ ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASS = os.getenv("ADMIN_PASS", "admin")
 DB_URL     = os.getenv("DATABASE_URL", "postgresql://app:app@db:5432/appdb")
 
+# те же настройки пула, что у бота (bot/services/db_pool.py); по умолчанию — поменьше: админка однопользовательская
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_MAX_INACTIVE_SEC = float(os.getenv("DB_POOL_MAX_INACTIVE_SEC", "300"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_COMMAND_TIMEOUT_SEC = float(os.getenv("DB_COMMAND_TIMEOUT_SEC", "30")) or None  # 0 — без таймаута
+
 app = FastAPI()
 app.include_router(scenarios_router)
 security = HTTPBasic()
 templates = Jinja2Templates(directory="/app/templates")
 _pool: asyncpg.Pool | None = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _json_loads(s: str):
+    return orjson.loads(s) if orjson is not None else json.loads(s)
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """json/jsonb ↔ dict/list (как bot/services/pg_json.py): без json.dumps/json.loads вокруг запросов."""
+    for typename in ("jsonb", "json"):
+        await conn.set_type_codec(typename, schema="pg_catalog", encoder=_json_dumps, decoder=_json_loads, format="text")
+
+
 async def pool() -> asyncpg.Pool:
     global _pool
     if _pool is None:
-        _pool = await asyncpg.create_pool(DB_URL, min_size=1, max_size=5)
+        _pool = await asyncpg.create_pool(
+            DB_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_SEC,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT_SEC,
+            init=_init_connection,
+        )
     return _pool
 
 
@@ -62,26 +99,23 @@ def _as_bool(v: str) -> bool:
     return str(v).lower() in ("1", "true", "on", "yes")
 
 def _normalize_bonus_sections(bs):
-    """
-    Приводим bonus_sections к dict:
-    - если dict -> вернуть как есть
-    - если строка -> пробуем json.loads 1-2 раза (на случай двойной сериализации)
-    - иначе -> {}
-    """
-    if bs is None:
-        return {}
+    """bonus_sections → dict (jsonb декодирует кодек пула; строка — ввод формы при ошибке)."""
     if isinstance(bs, dict):
         return bs
     if isinstance(bs, str):
         try:
             d = json.loads(bs)
-            if isinstance(d, str):
-                d = json.loads(d)
             return d if isinstance(d, dict) else {}
         except Exception:
             return {}
     return {}
 
+def _normalize_scenario_list(v) -> list:
+    """first_screen_scenarios → list[str]."""
+    if not isinstance(v, list):
+        return []
+    return [str(x).strip().lower() for x in v if str(x or "").strip()]
+
 def _force_json_object(raw: str) -> dict:
     """
     Жёстко парсим JSON-объект из textarea.
@@ -122,6 +156,9 @@ async def settings_get(request: Request, user = Depends(require_basic)):
     ctx.setdefault("enable_periodic_horoscopes", False)
     ctx.setdefault("strict_json", True)
     ctx.setdefault("max_input_length", 80)
+    ctx["first_screen_scenarios"] = _normalize_scenario_list(
+        ctx.get("first_screen_scenarios") or ["strengths", "weaknesses"]
+    )
 
     # bonus_sections в шаблон — строго объект
     ctx["bonus_sections"] = _normalize_bonus_sections(ctx.get("bonus_sections"))
@@ -149,6 +186,7 @@ async def settings_post(
     enable_periodic_horoscopes: str = Form("off"),
     strict_json: str = Form("off"),
     max_input_length: int = Form(80),
+    first_screen_scenarios: str = Form("strengths, weaknesses"),
 ):
     if user is None:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
@@ -160,6 +198,9 @@ async def settings_post(
     en_periodic  = _as_bool(enable_periodic_horoscopes)
     en_strict    = _as_bool(strict_json)
 
+    # сценарии первого экрана: "a, b, c" → ["a","b","c"]
+    first_screen = [c.strip().lower() for c in first_screen_scenarios.replace("\n", ",").split(",") if c.strip()]
+
     # bonus_sections — строгий парс
     try:
         bonus_obj = _force_json_object(bonus_sections)
@@ -178,6 +219,7 @@ async def settings_post(
                     "enable_periodic_horoscopes": en_periodic,
                     "strict_json": en_strict,
                     "max_input_length": max_input_length,
+                    "first_screen_scenarios": first_screen,
                     "telegram_channel_id": telegram_channel_id,
                     "telegram_channel_url": telegram_channel_url,
                     "referral_bonus_threshold": referral_bonus_threshold,
@@ -200,11 +242,12 @@ async def settings_post(
             referral_bonus_threshold=$5,
             telegram_channel_id=$6,
             telegram_channel_url=$7,
-            bonus_sections=$8::jsonb,
+            bonus_sections=$8,
             enable_compat=$9,
             enable_periodic_horoscopes=$10,
             strict_json=$11,
             max_input_length=$12,
+            first_screen_scenarios=$13,
             updated_at=now()
         WHERE id=1
         """,
@@ -215,11 +258,12 @@ async def settings_post(
         referral_bonus_threshold,
         telegram_channel_id.strip(),
         telegram_channel_url.strip(),
-        json.dumps(bonus_obj),
+        bonus_obj,
         en_compat,
         en_periodic,
         en_strict,
         max_input_length,
+        first_screen,
     )
 
     return RedirectResponse(url="/settings", status_code=status.HTTP_303_SEE_OTHER)
@@ -7,6 +7,7 @@ from pydantic import BaseModel, Field
 from typing import Any, Dict, List, Optional
 import os, json, re
 from psycopg import connect  # psycopg[binary]
+from psycopg.types.json import Jsonb  # jsonb: psycopg сам (де)сериализует dict/list
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -47,13 +48,17 @@ def fetch_scenarios() -> List[Dict[str, Any]]:
               prompt_template,
               schema_json,
               enabled,
-              updated_at
+              updated_at,
+              context_spec,
+              model,
+              temperature,
+              max_output_tokens
             FROM admin_scenarios
             ORDER BY scenario
         """)
         rows = cur.fetchall() or []
     out = []
-    for scenario, title, prompt_template, schema_json, enabled, updated_at in rows:
+    for scenario, title, prompt_template, schema_json, enabled, updated_at, context_spec, model, temperature, max_output_tokens in rows:
         out.append({
             "scenario": scenario,
             "title": title,
@@ -61,6 +66,10 @@ def fetch_scenarios() -> List[Dict[str, Any]]:
             "schema_json": _parse_jsonb(schema_json),
             "enabled": bool(enabled),
             "updated_at": updated_at,
+            "context_spec": _parse_jsonb(context_spec) if context_spec is not None else None,
+            "model": model,
+            "temperature": temperature,
+            "max_output_tokens": max_output_tokens,
         })
     return out
 
@@ -68,7 +77,8 @@ def fetch_scenarios() -> List[Dict[str, Any]]:
 def fetch_scenario(scenario: str) -> Optional[Dict[str, Any]]:
     with connect(get_dsn()) as conn, conn.cursor() as cur:
         cur.execute("""
-            SELECT scenario, title, prompt_template, schema_json, enabled, updated_at
+            SELECT scenario, title, prompt_template, schema_json, enabled, updated_at, context_spec,
+                   model, temperature, max_output_tokens
             FROM admin_scenarios
             WHERE scenario = %s
             LIMIT 1
@@ -77,7 +87,7 @@ def fetch_scenario(scenario: str) -> Optional[Dict[str, Any]]:
     if not row:
         return None
 
-    scenario, title, prompt_template, schema_json, enabled, updated_at = row
+    scenario, title, prompt_template, schema_json, enabled, updated_at, context_spec, model, temperature, max_output_tokens = row
     return {
         "scenario": scenario,
         "title": title,
@@ -85,6 +95,10 @@ def fetch_scenario(scenario: str) -> Optional[Dict[str, Any]]:
         "schema_json": _parse_jsonb(schema_json),
         "enabled": bool(enabled),
         "updated_at": updated_at,
+        "context_spec": _parse_jsonb(context_spec) if context_spec is not None else None,
+        "model": model,
+        "temperature": temperature,
+        "max_output_tokens": max_output_tokens,
     }
 
 
@@ -94,37 +108,137 @@ def upsert_scenario(
     prompt_template: str,
     schema_json: Dict[str, Any],
     enabled: bool,
+    context_spec: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_output_tokens: Optional[int] = None,
 ) -> None:
     with connect(get_dsn()) as conn, conn.cursor() as cur:
         cur.execute("""
-            INSERT INTO admin_scenarios (scenario, title, prompt_template, schema_json, enabled, updated_at)
-            VALUES (%s, %s, %s, %s::jsonb, %s, now())
+            INSERT INTO admin_scenarios (scenario, title, prompt_template, schema_json, enabled, context_spec,
+                                         model, temperature, max_output_tokens, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, now())
             ON CONFLICT (scenario) DO UPDATE SET
               title = EXCLUDED.title,
               prompt_template = EXCLUDED.prompt_template,
               schema_json = EXCLUDED.schema_json,
               enabled = EXCLUDED.enabled,
+              context_spec = EXCLUDED.context_spec,
+              model = EXCLUDED.model,
+              temperature = EXCLUDED.temperature,
+              max_output_tokens = EXCLUDED.max_output_tokens,
               updated_at = now()
-        """, (scenario, title, prompt_template, json.dumps(schema_json), enabled))
+        """, (scenario, title, prompt_template, Jsonb(schema_json), enabled,
+              Jsonb(context_spec) if context_spec is not None else None,
+              model, temperature, max_output_tokens))
         conn.commit()
 
-def _parse_jsonb(v: Any) -> Any:
-    """Аккуратно привести jsonb из psycopg к обычному dict/list."""
-    if v is None or v == "":
-        return {}
-    if isinstance(v, (dict, list)):
-        return v
-    if isinstance(v, (bytes, bytearray, memoryview)):
+
+# ---------- статистика вызовов LLM по сценариям (llm_messages, см. 015/018) ----------
+# Цены — как у бота (LLM_PRICES): "модель=вход/выход" в USD за 1M токенов
+LLM_PRICES = os.getenv("LLM_PRICES", "gpt-4o-mini=0.15/0.60,gpt-4o=2.50/10.00,gpt-4.1-mini=0.40/1.60,gpt-4.1-nano=0.10/0.40")
+STATS_DAYS = int(os.getenv("ADMIN_LLM_STATS_DAYS", "7"))
+
+
+def _prices() -> Dict[str, tuple]:
+    out = {}
+    for item in LLM_PRICES.split(","):
+        name, _, pair = item.strip().partition("=")
+        pin, _, pout = pair.partition("/")
         try:
-            v = bytes(v).decode("utf-8", "ignore")
-        except Exception:
-            return {}
-    if isinstance(v, str):
+            out[name.strip()] = (float(pin), float(pout))
+        except ValueError:
+            continue
+    return out
+
+
+def _cost_usd(prices: Dict[str, tuple], model: Optional[str], tokens_in: int, tokens_out: int) -> Optional[float]:
+    model = model or ""
+    price = prices.get(model)
+    if price is None:  # версия модели: gpt-4o-mini-2024-07-18
+        known = [k for k in prices if model.startswith(k + "-")]
+        if not known:
+            return None
+        price = prices[max(known, key=len)]
+    return (tokens_in * price[0] + tokens_out * price[1]) / 1_000_000
+
+
+def fetch_llm_stats(days: int = STATS_DAYS) -> List[Dict[str, Any]]:
+    """Вызовы модели за days дней по (сценарий, модель): задержка, токены, оценка стоимости."""
+    with connect(get_dsn()) as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT scenario,
+                   COALESCE(model, '')                                                 AS model,
+                   count(*)                                                            AS calls,
+                   count(*) FILTER (WHERE status NOT IN ('ok', 'mock'))                AS failed,
+                   percentile_cont(0.5)  WITHIN GROUP (ORDER BY latency_ms)            AS p50,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms)            AS p95,
+                   COALESCE(sum(input_tokens), 0)                                      AS tokens_in,
+                   COALESCE(sum(output_tokens), 0)                                     AS tokens_out,
+                   max(output_tokens)                                                  AS max_out
+            FROM llm_messages
+            WHERE latency_ms IS NOT NULL
+              AND created_at > now() - make_interval(days => %s)
+            GROUP BY scenario, model
+            ORDER BY scenario, model
+        """, (days,))
+        rows = cur.fetchall() or []
+    prices = _prices()
+    out = []
+    for scenario, model, calls, failed, p50, p95, tokens_in, tokens_out, max_out in rows:
+        cost = _cost_usd(prices, model, tokens_in, tokens_out)
+        out.append({
+            "scenario": scenario,
+            "model": model or None,
+            "calls": calls,
+            "failed": failed,
+            "p50_ms": round(p50) if p50 is not None else None,
+            "p95_ms": round(p95) if p95 is not None else None,
+            "avg_in": round(tokens_in / calls) if calls else 0,
+            "avg_out": round(tokens_out / calls) if calls else 0,
+            "max_out": max_out,
+            "cost_usd": round(cost, 4) if cost is not None else None,
+            "cost_per_call_usd": round(cost / calls, 6) if cost is not None and calls else None,
+        })
+    return out
+
+def _parse_jsonb(v: Any) -> Any:
+    """jsonb из psycopg уже dict/list; NULL и скаляры — {}."""
+    if isinstance(v, str):  # старые строки: jsonb-строка с JSON внутри
         try:
-            return json.loads(v)
-        except Exception:
+            v = json.loads(v)
+        except ValueError:
             return {}
-    return {}
+    return v if isinstance(v, (dict, list)) else {}
+
+
+def _parse_llm_params(model: str, temperature: str, max_output_tokens: str) -> tuple:
+    """Пустые поля = NULL (глобальные OPENAI_MODEL / OPENAI_TEMPERATURE, без лимита вывода)."""
+    model = (model or "").strip() or None
+    try:
+        temp = float(temperature) if (temperature or "").strip() else None
+        budget = int(max_output_tokens) if (max_output_tokens or "").strip() else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"temperature / max_output_tokens: {e}")
+    if temp is not None and not 0 <= temp <= 2:
+        raise HTTPException(status_code=400, detail="temperature должна быть в диапазоне 0–2.")
+    if budget is not None and budget <= 0:
+        raise HTTPException(status_code=400, detail="max_output_tokens должен быть > 0.")
+    return model, temp, budget
+
+
+def _parse_context_spec(raw: str) -> Optional[Dict[str, Any]]:
+    """Пустое поле = NULL (весь контекст)."""
+    raw = (raw or "").strip()
+    if not raw:
+        return None
+    try:
+        obj = json.loads(raw)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"context_spec должен быть валидным JSON: {e}")
+    if obj is not None and not isinstance(obj, dict):
+        raise HTTPException(status_code=400, detail="context_spec должен быть JSON-объектом.")
+    return obj
 
 
 # ---------- Pydantic (JSON API) ----------
@@ -134,19 +248,27 @@ class ScenarioModel(BaseModel):
     prompt_template: str = Field("", min_length=0)
     schema_json: Dict[str, Any] = Field(default_factory=dict)
     enabled: bool = True
+    context_spec: Optional[Dict[str, Any]] = None
+    model: Optional[str] = Field(None, max_length=80)
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    max_output_tokens: Optional[int] = Field(None, gt=0)
 
 # ---------- HTML ----------
 @router.get("/scenarios", response_class=HTMLResponse)
 def scenarios_list(request: Request):
     items = fetch_scenarios()
-    return templates.TemplateResponse("scenarios.html", {"request": request, "items": items})
+    return templates.TemplateResponse(
+        "scenarios.html",
+        {"request": request, "items": items, "stats": fetch_llm_stats(), "stats_days": STATS_DAYS},
+    )
 
 @router.get("/scenarios/new", response_class=HTMLResponse)
 def scenario_new(request: Request):
-    s = {"scenario": "", "title": "", "prompt_template": "", "schema_json": {}, "enabled": True, "updated_at": None}
+    s = {"scenario": "", "title": "", "prompt_template": "", "schema_json": {}, "enabled": True, "updated_at": None,
+         "context_spec": None, "model": None, "temperature": None, "max_output_tokens": None}
     return templates.TemplateResponse(
         "scenario_detail.html",
-        {"request": request, "s": s, "is_new": True, "schema_json_str": dumps_pretty({})}
+        {"request": request, "s": s, "is_new": True, "schema_json_str": dumps_pretty({}), "context_spec_str": ""}
     )
 
 @router.post("/scenarios/new")
@@ -157,6 +279,10 @@ def scenario_new_post(
     prompt_template: str = Form(""),
     schema_json: str = Form("{}"),
     enabled: Optional[str] = Form(None),
+    context_spec: str = Form(""),
+    model: str = Form(""),
+    temperature: str = Form(""),
+    max_output_tokens: str = Form(""),
 ):
     key = sanitize_key(scenario_key)
     if not key or not re.fullmatch(r"^[a-z0-9_]{2,40}$", key):
@@ -165,15 +291,21 @@ def scenario_new_post(
         schema_obj = json.loads(schema_json or "{}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"schema_json должен быть валидным JSON: {e}")
-    upsert_scenario(key, title.strip(), prompt_template.strip(), schema_obj, bool(enabled))
+    upsert_scenario(key, title.strip(), prompt_template.strip(), schema_obj, bool(enabled),
+                    _parse_context_spec(context_spec), *_parse_llm_params(model, temperature, max_output_tokens))
     return RedirectResponse(url=f"/scenarios/{key}", status_code=HTTP_303_SEE_OTHER)
 
 @router.get("/scenarios/{scenario}", response_class=HTMLResponse)
 def scenario_detail(request: Request, scenario: str):
-    s = fetch_scenario(scenario) or {"scenario": scenario, "title": "", "prompt_template": "", "schema_json": {}, "enabled": True, "updated_at": None}
+    s = fetch_scenario(scenario) or {"scenario": scenario, "title": "", "prompt_template": "", "schema_json": {}, "enabled": True, "updated_at": None,
+                                     "context_spec": None, "model": None, "temperature": None, "max_output_tokens": None}
+    spec = s.get("context_spec")
+    stats = [r for r in fetch_llm_stats() if r["scenario"] == scenario]
     return templates.TemplateResponse(
         "scenario_detail.html",
-        {"request": request, "s": s, "is_new": False, "schema_json_str": dumps_pretty(s.get("schema_json") or {})}
+        {"request": request, "s": s, "is_new": False, "schema_json_str": dumps_pretty(s.get("schema_json") or {}),
+         "context_spec_str": dumps_pretty(spec) if spec is not None else "",
+         "stats": stats, "stats_days": STATS_DAYS}
     )
 
 @router.post("/scenarios/{scenario}")
@@ -184,6 +316,10 @@ def scenario_save(
     prompt_template: str = Form(""),
     schema_json: str = Form("{}"),
     enabled: Optional[str] = Form(None),
+    context_spec: str = Form(""),
+    model: str = Form(""),
+    temperature: str = Form(""),
+    max_output_tokens: str = Form(""),
 ):
     key = sanitize_key(scenario)
     if not key:
@@ -192,7 +328,8 @@ def scenario_save(
         schema_obj = json.loads(schema_json or "{}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"schema_json должен быть валидным JSON: {e}")
-    upsert_scenario(key, title.strip(), prompt_template.strip(), schema_obj, bool(enabled))
+    upsert_scenario(key, title.strip(), prompt_template.strip(), schema_obj, bool(enabled),
+                    _parse_context_spec(context_spec), *_parse_llm_params(model, temperature, max_output_tokens))
     return RedirectResponse(url=f"/scenarios/{key}", status_code=HTTP_303_SEE_OTHER)
 
 # ---------- JSON API ----------
@@ -200,6 +337,10 @@ def scenario_save(
 def api_scenarios_list():
     return JSONResponse(fetch_scenarios())
 
+@router.get("/api/scenarios/stats")
+def api_scenarios_stats(days: int = STATS_DAYS):
+    return JSONResponse(fetch_llm_stats(days))
+
 @router.get("/api/scenarios/{scenario}")
 def api_scenario_get(scenario: str):
     s = fetch_scenario(scenario)
@@ -210,5 +351,7 @@ def api_scenario_get(scenario: str):
 @router.post("/api/scenarios/{scenario}")
 def api_scenario_upsert(scenario: str, payload: ScenarioModel):
     key = sanitize_key(scenario or payload.scenario)
-    upsert_scenario(key, payload.title, payload.prompt_template, payload.schema_json, payload.enabled)
+    upsert_scenario(key, payload.title, payload.prompt_template, payload.schema_json, payload.enabled,
+                    payload.context_spec, (payload.model or "").strip() or None, payload.temperature,
+                    payload.max_output_tokens)
     return {"ok": True, "scenario": key}